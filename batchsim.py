@@ -0,0 +1,469 @@
+"""
+batchsim evaluates a whole generation in lockstep on the headless simulator
+
+Every ship's state is kept as NumPy arrays and each frame is stepped with vectorized physics and feelers.
+The per frame logic mirrors ShellBot (collect_info, check_done, set_action, perform_action and
+calculate_bonus) so results match flying each genome through xpsim.run_episode one at a time.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from nncompiler import NetworkBatch
+from sensors import (
+    CLOSEST_WALL,
+    CLOSEST_WALL_DEGREES,
+    CLOSEST_WALL_HEADING,
+    SCAN_CLOSEST_WALL,
+)
+from termination import make_termination
+from trackcompiler import FeelerProvider, load_track
+from trackindex import TrackIndex
+from xpmap import XPMap
+from xpsim import FPS, SHIP_MASS, SHIP_RADIUS, HULL_ANGLES
+
+## ShellBot settings
+SCAN_DISTANCE = 1000
+TURNSPEED = 20
+MAX_TURNTIME = math.ceil(180 / TURNSPEED)
+SAFETY_MARGIN = 1.1
+STUCK_FRAMES = 28 * 5
+
+## Feeler headings relative to the ship, in the order get_observations uses them
+FEELER_OFFSETS = np.array([0, 180, 90, -90, 15, -15, 30, -30])
+
+
+def angle_add(a1: np.ndarray, a2: np.ndarray) -> np.ndarray:
+    return (a1 + a2 + 720) % 360
+
+
+def angle_diff(a1: np.ndarray, a2: np.ndarray) -> np.ndarray:
+    """angle_diff Vectorized ShellBot.angle_diff"""
+    min_ang = np.minimum(a1, a2)
+    max_ang = np.maximum(a1, a2)
+    diff = max_ang - min_ang
+    comp_diff = min_ang + 360 - max_ang
+    return np.where(
+        a2 > a1,
+        np.where(comp_diff < diff, -comp_diff, -diff),
+        np.minimum(diff, comp_diff),
+    )
+
+
+class PopulationSim:
+
+    ## Track Info
+    checkpoints: np.ndarray = np.zeros((1, 2))
+    course_lengths: np.ndarray = np.zeros(1)
+    circuit: bool = False
+    finish_marker: int = 1670
+    starting_heading: float = 90.0
+    target_time: float = 0.0
+
+    def __init__(
+        self,
+        mapname: str,
+        nets: List[Any],
+        fps: int = FPS,
+        feeler_provider: Optional[FeelerProvider] = None,
+        termination: str = "",
+    ) -> None:
+        self.mapname = mapname
+        self.map = XPMap(f"{mapname}.xp")
+        self.feeler_provider = feeler_provider
+        self.nets = nets
+        self.fps = fps
+        for net in nets:
+            if hasattr(net, "reset"):
+                net.reset()
+        ## RecurrentNetworks are stacked and activated together, anything else is activated one by one
+        self.net_batch: Optional[NetworkBatch] = None
+        if all(hasattr(net, "node_evals") for net in nets):
+            self.net_batch = NetworkBatch(nets)
+        self.track = TrackIndex(mapname)
+        self.checkpoints = self.track.checkpoints
+        self.course_lengths = self.track.course_lengths
+        self.target_time = self.track.target_time
+        self.circuit = self.track.circuit
+        self.finish_marker = self.track.finish_marker
+        self.starting_heading = self.track.starting_heading
+        self.termination = make_termination(
+            termination, len(nets), int((self.target_time + 10.0) * self.fps)
+        )
+
+        ## Ship state, one entry per genome
+        pop = len(nets)
+        self.x = np.full(pop, self.map.base[0])
+        self.y = np.full(pop, self.map.base[1])
+        self.x_vel = np.zeros(pop)
+        self.y_vel = np.zeros(pop)
+        self.heading = np.full(pop, self.starting_heading % 360.0)
+        self.alive = np.ones(pop)
+        self.current_checkpoint = np.zeros(pop, dtype=int)
+
+        ## Bot state
+        self.frame = 0
+        self.done = np.zeros(pop, dtype=bool)
+        self.completed_course = np.zeros(pop, dtype=bool)
+        self.completion = np.zeros(pop)
+        self.max_completion = np.zeros(pop)
+        self.max_completion_frame = np.zeros(pop, dtype=int)
+        self.cum_bonus = np.zeros(pop)
+        self.cum_speed = np.zeros(pop)
+        self.average_speed = np.zeros(pop)
+        self.average_completion_per_frame = np.zeros(pop)
+        self.power_level = np.full(pop, 28.0)
+        self.last_thrust = np.zeros(pop)
+        self.last_turn = np.zeros(pop)
+        self.course_frames = np.full(pop, -1, dtype=int)
+        self.end_frame = np.zeros(pop, dtype=int)
+        self.final_completion = np.zeros(pop)
+        self.final_x = np.zeros(pop, dtype=int)
+        self.final_y = np.zeros(pop, dtype=int)
+        self.cause_of_death = np.full(pop, "Failed to start", dtype=object)
+
+    def step(
+        self,
+    ) -> None:
+        """step Runs one frame of ShellBot.run_loop for every ship that is still flying, then moves them"""
+        active = np.flatnonzero(~self.done)
+        if len(active) == 0:
+            return
+        self.frame += 1
+        frame = self.frame
+
+        ## collect_info
+        alive = self.alive[active]
+        x_pos = self.x[active]
+        y_pos = self.y[active]
+        x = np.trunc(x_pos)
+        y = np.trunc(y_pos)
+        heading = np.trunc(self.heading[active]) % 360
+        x_vel = self.x_vel[active]
+        y_vel = self.y_vel[active]
+        speed = np.hypot(x_vel, y_vel)
+        tracking = np.where(
+            (x_vel == 0.0) & (y_vel == 0.0),
+            heading,
+            np.trunc(np.degrees(np.arctan2(y_vel, x_vel)) + 360) % 360,
+        )
+
+        feeler_headings = np.trunc(angle_add(heading[:, None], FEELER_OFFSETS))
+        feeler_angles = np.concatenate(
+            [tracking[:, None], feeler_headings - 5, feeler_headings], axis=1
+        )
+        if self.feeler_provider is not None:
+            feelers = self.feeler_provider.feelers(
+                x_pos[:, None], y_pos[:, None], feeler_angles, SCAN_DISTANCE
+            )
+        else:
+            feelers = self.map.raycast(
+                x_pos[:, None], y_pos[:, None], feeler_angles, SCAN_DISTANCE
+            )
+        feelers = np.trunc(feelers)
+        track_wall = feelers[:, 0]
+        walls = (feelers[:, 1:9] + feelers[:, 9:]) / 3.0
+        closest_wall, closest_wall_heading = self.closest_walls(x_pos, y_pos)
+
+        power_level = self.power_level[active]
+        tt_tracking = np.ceil(track_wall / (speed + 0.0000001))
+        tt_retro = np.ceil(speed / power_level)
+        tt_retro_point = np.minimum(
+            tt_tracking - ((MAX_TURNTIME + tt_retro) * SAFETY_MARGIN + 1), 70.0
+        )
+
+        current = self.current_checkpoint[active]
+        completed = self.completed_course[active]
+        last_completion = self.completion[active]
+        checkpoint = self.track.get_current_checkpoint(x, y, current)
+        completion = self.track.get_completion_percent(x, y, checkpoint, completed)
+
+        ## check_done
+        done = np.zeros(len(active), dtype=bool)
+        cause = self.cause_of_death[active]
+        course_frames = self.course_frames[active]
+        if frame >= 28:
+            max_completion = self.max_completion[active]
+            max_completion_frame = self.max_completion_frame[active]
+            improved = completion > max_completion
+            max_completion[improved] = completion[improved]
+            max_completion_frame[improved] = frame
+            self.max_completion[active] = max_completion
+            self.max_completion_frame[active] = max_completion_frame
+            stuck = ~improved & (frame - max_completion_frame > STUCK_FRAMES)
+            done |= stuck
+            cause[stuck] = "Stuck"
+
+            if not self.circuit:
+                finished = (y >= self.finish_marker) & (alive == 1.0)
+            else:
+                last_checkpoint = self.checkpoints[-1]
+                finished = (
+                    (current == len(self.checkpoints) - 1)
+                    & (alive == 1.0)
+                    & (np.abs(x - last_checkpoint[0]) < 75)
+                    & (np.abs(y - last_checkpoint[1]) < 75)
+                )
+            done |= finished
+            completed = completed | finished
+            completion[finished] = 100.0
+            course_frames[finished] = frame
+            cause[finished] = "Completed"
+
+            crashed = alive != 1.0
+            done |= crashed
+            cause[crashed] = "Collision"
+
+            if self.termination is not None:
+                labels = self.termination.update(
+                    active, frame, completion, self.last_thrust[active], speed, heading
+                )
+                ended = ~done & (labels != "")
+                done |= ended
+                cause[ended] = labels[ended]
+
+        ## set_action
+        current = checkpoint
+        observations = np.empty((len(active), 23))
+        observations[:, 0] = speed / 20.0
+        observations[:, 1] = 1.0 - track_wall / float(SCAN_DISTANCE)
+        observations[:, 2] = angle_diff(heading, tracking) / 180.0
+        observations[:, 3] = 1.0 - closest_wall / float(SCAN_DISTANCE)
+        observations[:, 4] = angle_diff(heading, closest_wall_heading) / 180.0
+        observations[:, 5:13] = 1.0 - walls[:, [0, 1, 2, 3, 5, 4, 7, 6]] / float(
+            SCAN_DISTANCE
+        )
+        observations[:, 13] = np.maximum(1.0 - (tt_tracking / 140.0), 0.0)
+        observations[:, 14] = np.maximum(1.0 - (tt_retro_point / 70.0), 0.0)
+        observations[:, 15] = self.last_thrust[active]
+        observations[:, 16] = self.last_turn[active]
+        for offset in range(3):
+            dist, angle = self.track.get_checkpoint_info(x, y, current + offset)
+            observations[:, 17 + offset * 2] = 1.0 - dist / float(SCAN_DISTANCE)
+            observations[:, 18 + offset * 2] = angle_diff(heading, angle) / 180.0
+        observations = np.clip(np.nan_to_num(observations, nan=1.0), -1.0, 1.0)
+
+        if self.net_batch is not None:
+            outputs = self.net_batch.activate(observations, active)
+        else:
+            outputs = np.array(
+                [self.nets[idx].activate(obs) for idx, obs in zip(active, observations)],
+                dtype=float,
+            ).reshape(len(active), -1)
+        thrust_val = np.clip(outputs[:, 0], 0.0, 1.0)
+        turn_val = np.clip(outputs[:, 1], -1.0, 1.0)
+        thrust = thrust_val > 0.25
+        power_level = np.select(
+            [thrust_val > 0.75, thrust_val > 0.5, thrust_val > 0.25],
+            [28.0, 21.0, 14.0],
+            power_level,
+        )
+        desired_heading = angle_add(heading, turn_val * float(TURNSPEED))
+        self.last_thrust[active] = thrust_val
+        self.last_turn[active] = turn_val
+        self.power_level[active] = power_level
+
+        ## calculate_bonus
+        self.cum_speed[active] += speed
+        self.average_speed[active] = self.cum_speed[active] / frame
+        self.average_completion_per_frame[active] = completion / frame
+        speed_bonus = np.where(speed > 1.0, (speed ** 1.1) / 250.0, 0.0)
+        self.cum_bonus[active] += np.where((alive == 1.0) & ~done, speed_bonus, 0.0)
+
+        self.current_checkpoint[active] = current
+        self.completed_course[active] = completed
+        self.completion[active] = completion
+        self.course_frames[active] = course_frames
+        self.cause_of_death[active] = cause
+        self.final_x[active] = x
+        self.final_y[active] = y
+
+        ## Ships that finished this frame stop here
+        max_frames = int((self.target_time + 10.0) * self.fps)
+        if frame >= max_frames:
+            cause[~done] = "Time"
+            self.cause_of_death[active] = cause
+            done[:] = True
+        finished_idx = active[done]
+        self.done[finished_idx] = True
+        self.end_frame[finished_idx] = frame
+        self.final_completion[finished_idx] = self.track.get_completion_percent(
+            x[done],
+            y[done],
+            self.track.get_current_checkpoint(x[done], y[done], current[done]),
+            completed[done],
+        )
+
+        ## perform_action, then the server's physics step for ships still flying
+        flying = ~done
+        turn_delta = angle_diff(heading[flying], desired_heading[flying])
+        self.move(
+            active[flying],
+            thrust[flying],
+            power_level[flying],
+            turn_delta,
+            np.trunc(desired_heading[flying]),
+        )
+
+    def closest_walls(
+        self, x_pos: np.ndarray, y_pos: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """closest_walls Vectorized ShellBot.update_closest_wall, or its defaults when the scan is off
+
+        Args:
+            x_pos (np.ndarray): X positions of the active ships
+            y_pos (np.ndarray): Y positions of the active ships
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Closest wall distance and heading per ship
+        """
+        if not SCAN_CLOSEST_WALL:
+            return (
+                np.full(len(x_pos), float(CLOSEST_WALL)),
+                np.full(len(x_pos), float(CLOSEST_WALL_HEADING)),
+            )
+        degrees = np.array(CLOSEST_WALL_DEGREES, dtype=float)
+        angles = np.broadcast_to(degrees, (len(x_pos), len(degrees)))
+        if self.feeler_provider is not None:
+            walls = self.feeler_provider.feelers(
+                x_pos[:, None], y_pos[:, None], angles, SCAN_DISTANCE
+            )
+        else:
+            walls = np.trunc(
+                self.map.raycast(x_pos[:, None], y_pos[:, None], angles, SCAN_DISTANCE)
+            )
+        ## The first strictly closer feeler wins, nothing inside the scan leaves the heading at -1
+        nearest = np.argmin(walls, axis=1)
+        closest = walls[np.arange(len(x_pos)), nearest]
+        seen = closest < SCAN_DISTANCE
+        return (
+            np.where(seen, closest, float(SCAN_DISTANCE)),
+            np.where(seen, degrees[nearest], -1.0),
+        )
+
+    def move(
+        self,
+        active: np.ndarray,
+        thrusting: np.ndarray,
+        power: np.ndarray,
+        turn_delta: np.ndarray,
+        turn_target: np.ndarray,
+    ) -> None:
+        """move Vectorized HeadlessServer.step, dead ships stay where they crashed"""
+        living_mask = self.alive[active] == 1.0
+        living = active[living_mask]
+        thrusting = thrusting[living_mask]
+        power = power[living_mask]
+        turn_delta = turn_delta[living_mask]
+        turn_target = turn_target[living_mask]
+
+        ## ShellBot.turn_to_degree turns by hand when the target is out of reach, otherwise uses turnToDeg
+        heading = self.heading[living]
+        target_delta = (turn_target - heading + 180.0) % 360.0 - 180.0
+        heading = np.where(
+            np.abs(turn_delta) > TURNSPEED,
+            np.where(turn_delta < 0, heading - TURNSPEED, heading + TURNSPEED),
+            heading + np.clip(target_delta, -TURNSPEED, TURNSPEED),
+        )
+        heading %= 360.0
+        self.heading[living] = heading
+
+        acc = np.where(thrusting, power / SHIP_MASS, 0.0)
+        heading_rad = np.radians(heading)
+        x_vel = self.x_vel[living] + acc * np.cos(heading_rad)
+        y_vel = self.y_vel[living] + acc * np.sin(heading_rad)
+        y_vel -= self.map.gravity
+        friction = np.full(len(living), self.map.friction)
+        if self.map.block_friction:
+            friction += np.where(
+                self.map.is_friction(self.x[living], self.y[living]),
+                self.map.block_friction,
+                0.0,
+            )
+        x_vel *= 1.0 - friction
+        y_vel *= 1.0 - friction
+
+        x = self.x[living] + x_vel
+        y = self.y[living] + y_vel
+        crashed = self.map.is_wall(
+            x[:, None] + np.cos(HULL_ANGLES) * SHIP_RADIUS,
+            y[:, None] + np.sin(HULL_ANGLES) * SHIP_RADIUS,
+        ).any(axis=1)
+        x_vel[crashed] = 0.0
+        y_vel[crashed] = 0.0
+        self.x[living] = x
+        self.y[living] = y
+        self.x_vel[living] = x_vel
+        self.y_vel[living] = y_vel
+        self.alive[living[crashed]] = 0.0
+
+    def run(
+        self,
+    ) -> List[Dict[str, Any]]:
+        """run Steps every ship until all of them are done
+
+        Returns:
+            List[Dict[str, Any]]: One result per genome with the fields workerclient.py stores for a track
+        """
+        while not self.done.all():
+            self.step()
+        results = []
+        for idx in range(len(self.nets)):
+            course_time = -1.0
+            if self.completed_course[idx]:
+                course_time = round(self.course_frames[idx] / float(self.fps), 3)
+            results.append(
+                {
+                    "bonus": round(float(self.cum_bonus[idx]), 3),
+                    "completion": round(float(self.final_completion[idx]), 3),
+                    "time": course_time,
+                    "x": int(self.final_x[idx]),
+                    "y": int(self.final_y[idx]),
+                    "avg_speed": round(float(self.average_speed[idx]), 3),
+                    "avg_completion_per_frame": round(
+                        float(self.average_completion_per_frame[idx]), 3
+                    ),
+                    "autopsy": self.cause_of_death[idx],
+                    "frame": int(self.course_frames[idx]),
+                    "end_frame": int(self.end_frame[idx]),
+                    "runtime": round(self.end_frame[idx] / float(self.fps), 3),
+                }
+            )
+        return results
+
+
+def evaluate_population(
+    nets: List[Any],
+    tracks: List[str],
+    fps: int = FPS,
+    precomputed_feelers: bool = False,
+    termination: str = "",
+) -> List[Dict[str, List[Any]]]:
+    """evaluate_population Flies every network over every track in lockstep
+
+    Args:
+        nets (List[Any]): Networks with an activate method, one per genome
+        tracks (List[str]): Track names, in the order the genome documents list them
+        fps (int, optional): Frames per second of game time. Defaults to FPS.
+        precomputed_feelers (bool, optional): Answer feelers from the compiled track tables. Defaults to False.
+        termination (str, optional): Early termination rules for make_termination, empty for none. Defaults to "".
+
+    Returns:
+        List[Dict[str, List[Any]]]: Per genome results with one entry per track, shaped like the genome documents eval_genomes reads
+    """
+    results: List[Dict[str, List[Any]]] = [{} for _ in nets]
+    for track in tracks:
+        feeler_provider = load_track(track) if precomputed_feelers else None
+        track_results = PopulationSim(
+            track,
+            nets,
+            fps=fps,
+            feeler_provider=feeler_provider,
+            termination=termination,
+        ).run()
+        for genome_results, track_result in zip(results, track_results):
+            for field, value in track_result.items():
+                genome_results.setdefault(field, []).append(value)
+    return results
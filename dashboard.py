@@ -0,0 +1,79 @@
+"""
+dashboard renders the ShellBot telemetry readout from its own thread at a fixed rate
+
+The frame thread only hands over a shallow copy of the bot when a sample is due, all of the
+string formatting and terminal writes happen here.
+"""
+
+import sys
+import threading
+from typing import Any, Optional, TextIO
+
+from consoleutils import delete_last_lines
+
+
+class Dashboard(threading.Thread):
+
+    rate: float = 2.0
+    wants_snapshot: bool = False
+    lines_printed: int = 0
+
+    def __init__(self, rate: float = 2.0, stream: TextIO = sys.stdout) -> None:
+        super(Dashboard, self).__init__(daemon=True)
+        self.rate = rate
+        self.stream = stream
+        self.snapshot: Optional[Any] = None
+        self.snapshot_ready = threading.Event()
+        self.stop_now = threading.Event()
+        self.cum_avg_thrust = 0.0
+
+    def submit(self, snapshot: Any) -> None:
+        """submit Called from the frame thread with a copy of the bot once a sample is due
+
+        Args:
+            snapshot (Any): Shallow copy of the ShellBot
+        """
+        self.wants_snapshot = False
+        self.snapshot = snapshot
+        self.snapshot_ready.set()
+
+    def run(
+        self,
+    ) -> None:
+        interval = 1.0 / self.rate
+        while not self.stop_now.wait(interval):
+            self.wants_snapshot = True
+            ## Nothing to draw while the bot isn't running frames
+            if not self.snapshot_ready.wait(interval):
+                continue
+            self.snapshot_ready.clear()
+            self.render(self.snapshot)
+
+    def render(self, snapshot: Any) -> None:
+        ## Thrust smoothing has to carry over between samples rather than between frames
+        snapshot.cum_avg_thrust = self.cum_avg_thrust
+        output = snapshot.format_info()
+        self.cum_avg_thrust = snapshot.cum_avg_thrust
+        if self.lines_printed:
+            delete_last_lines(self.lines_printed)
+        self.stream.write(output + "\n")
+        self.stream.flush()
+        self.lines_printed = output.count("\n") + 1
+
+    def clear(
+        self,
+    ) -> None:
+        """clear Forgets the last readout so the next one doesn't erase lines printed since"""
+        self.lines_printed = 0
+
+    def stop(
+        self,
+    ) -> None:
+        self.stop_now.set()
+
+
+def has_tty(stream: TextIO = sys.stdout) -> bool:
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
@@ -0,0 +1,182 @@
+"""
+frameprofiler times the stages of ShellBot.run_loop into fixed bucket histograms
+
+Spans are recorded into preallocated arrays so profiling a frame costs a few perf_counter_ns calls.
+The summary is small enough to store with the genome results and merge per host in the manager.
+"""
+
+from bisect import bisect_right
+from time import perf_counter_ns
+from typing import Any, Dict, List
+
+import numpy as np
+
+## Spans recorded by ShellBot
+FRAME = 0
+FEELERS = 1
+COMPLETION = 2
+OBSERVATIONS = 3
+ACTIVATION = 4
+PERFORM_ACTION = 5
+PRINT_INFO = 6
+SPAN_NAMES = [
+    "frame",
+    "feelers",
+    "completion",
+    "observations",
+    "activation",
+    "perform_action",
+    "print_info",
+]
+
+## Upper edges of the histogram buckets in microseconds, anything slower lands in the last bucket
+BUCKET_EDGES_US = [
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+    20000,
+    35714,
+    50000,
+    100000,
+]
+
+
+class FrameProfiler:
+
+    budget_ms: float = 1000.0 / 28.0
+
+    def __init__(self, fps: float = 28.0) -> None:
+        self.budget_ms = 1000.0 / fps
+        self.budget_ns = int(self.budget_ms * 1e6)
+        self.edges_ns = [edge * 1000 for edge in BUCKET_EDGES_US]
+        self.counts = np.zeros((len(SPAN_NAMES), len(BUCKET_EDGES_US) + 1), dtype=np.int64)
+        self.totals_ns = np.zeros(len(SPAN_NAMES), dtype=np.int64)
+        self.max_ns = np.zeros(len(SPAN_NAMES), dtype=np.int64)
+        self.overruns = 0
+
+    def reset(
+        self,
+    ) -> None:
+        self.counts[:] = 0
+        self.totals_ns[:] = 0
+        self.max_ns[:] = 0
+        self.overruns = 0
+
+    def begin(
+        self,
+    ) -> int:
+        return perf_counter_ns()
+
+    def end(self, span: int, start: int) -> None:
+        """end Records the time since begin was called into a span's histogram
+
+        Args:
+            span (int): One of the span constants
+            start (int): Value returned by begin
+        """
+        duration = perf_counter_ns() - start
+        self.counts[span, bisect_right(self.edges_ns, duration)] += 1
+        self.totals_ns[span] += duration
+        if duration > self.max_ns[span]:
+            self.max_ns[span] = duration
+        if span == FRAME and duration > self.budget_ns:
+            self.overruns += 1
+
+    def summary(
+        self,
+    ) -> Dict[str, Any]:
+        """summary Summarizes the histograms for storing with the genome results
+
+        Returns:
+            Dict[str, Any]: Frame count, budget overruns and per span histograms in microseconds
+        """
+        spans = {}
+        for span, name in enumerate(SPAN_NAMES):
+            count = int(self.counts[span].sum())
+            spans[name] = {
+                "count": count,
+                "mean_us": round(int(self.totals_ns[span]) / max(count, 1) / 1000.0, 1),
+                "max_us": round(int(self.max_ns[span]) / 1000.0, 1),
+                "p50_us": get_percentile(self.counts[span].tolist(), 0.5),
+                "p99_us": get_percentile(self.counts[span].tolist(), 0.99),
+                "histogram": self.counts[span].tolist(),
+            }
+        return {
+            "frames": spans["frame"]["count"],
+            "overruns": int(self.overruns),
+            "budget_ms": round(self.budget_ms, 3),
+            "bucket_edges_us": BUCKET_EDGES_US,
+            "spans": spans,
+        }
+
+
+class NullProfiler(FrameProfiler):
+    """NullProfiler Stands in when profiling is off so run_loop doesn't need to check"""
+
+    def begin(
+        self,
+    ) -> int:
+        return 0
+
+    def end(self, span: int, start: int) -> None:
+        pass
+
+
+def get_percentile(histogram: List[int], fraction: float) -> float:
+    """get_percentile Estimates a percentile as the upper edge of the bucket it falls in
+
+    Args:
+        histogram (List[int]): Counts per bucket
+        fraction (float): Percentile between 0 and 1
+
+    Returns:
+        float: Upper bucket edge in microseconds, inf for the overflow bucket and 0 if nothing was recorded
+    """
+    total = sum(histogram)
+    if total == 0:
+        return 0.0
+    target = fraction * total
+    running = 0
+    for bucket, count in enumerate(histogram):
+        running += count
+        if running >= target:
+            break
+    if bucket >= len(BUCKET_EDGES_US):
+        return float("inf")
+    return float(BUCKET_EDGES_US[bucket])
+
+
+def merge_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """merge_summaries Adds up summaries from several episodes, e.g. every episode a host ran
+
+    Args:
+        summaries (List[Dict[str, Any]]): Results of FrameProfiler.summary
+
+    Returns:
+        Dict[str, Any]: Frames, overruns and the fraction of frames over budget, plus merged span histograms
+    """
+    frames = sum(summary["frames"] for summary in summaries)
+    overruns = sum(summary["overruns"] for summary in summaries)
+    spans = {}
+    for name in SPAN_NAMES:
+        histogram = np.zeros(len(BUCKET_EDGES_US) + 1, dtype=np.int64)
+        for summary in summaries:
+            if name in summary["spans"]:
+                histogram += summary["spans"][name]["histogram"]
+        spans[name] = {
+            "p50_us": get_percentile(histogram.tolist(), 0.5),
+            "p99_us": get_percentile(histogram.tolist(), 0.99),
+            "histogram": histogram.tolist(),
+        }
+    return {
+        "frames": frames,
+        "overruns": overruns,
+        "overrun_rate": overruns / frames if frames else 0.0,
+        "spans": spans,
+    }
@@ -0,0 +1,150 @@
+"""
+genstats computes the per generation summary statistics logged by the manager
+
+Every statistic for every column of a (genomes, tracks) matrix comes out of one vectorized pass,
+with the median found by partitioning instead of a full sort. GenerationStats keeps preallocated
+matrices that fill up as results arrive so the same summaries are available mid generation.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+STAT_NAMES = ["Avg", "Median", "Max", "Min", "SD"]
+
+
+def summarize(
+    matrix: np.ndarray, mask: Optional[np.ndarray] = None
+) -> Dict[str, np.ndarray]:
+    """summarize Mean, median, max, min and standard deviation of every column
+
+    Args:
+        matrix (np.ndarray): Rows are genomes, columns are tracks or metrics, 1D is treated as one column
+        mask (Optional[np.ndarray], optional): Rows to include per column, same shape as matrix. Defaults to None.
+
+    Returns:
+        Dict[str, np.ndarray]: Array per statistic in STAT_NAMES plus Count, columns with no rows are nan
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.ndim == 1:
+        matrix = matrix[:, None]
+        if mask is not None:
+            mask = np.asarray(mask)[:, None]
+    rows, cols = matrix.shape
+    if mask is None and rows == 0:
+        mask = np.zeros((rows, cols), dtype=bool)
+    if mask is None:
+        count = np.full(cols, rows)
+        ## Both middle elements land in place with one partition
+        middle = sorted({(rows - 1) // 2, rows // 2})
+        ordered = np.partition(matrix, middle, axis=0)
+        median = (ordered[(rows - 1) // 2] + ordered[rows // 2]) / 2.0
+        maximum = matrix.max(axis=0)
+        minimum = matrix.min(axis=0)
+        total = matrix.sum(axis=0)
+    else:
+        count = mask.sum(axis=0)
+        ## Masked out rows sort to the end so each column's median sits at its own count
+        ordered = np.sort(np.where(mask, matrix, np.inf), axis=0)
+        low = np.maximum((count - 1) // 2, 0)
+        high = count // 2
+        if rows == 0:
+            median = np.full(cols, np.nan)
+        else:
+            median = (
+                np.take_along_axis(ordered, low[None], axis=0)[0]
+                + np.take_along_axis(ordered, high[None], axis=0)[0]
+            ) / 2.0
+        maximum = np.where(mask, matrix, -np.inf).max(axis=0, initial=-np.inf)
+        minimum = np.where(mask, matrix, np.inf).min(axis=0, initial=np.inf)
+        total = np.where(mask, matrix, 0.0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        deviations = matrix - mean
+        if mask is not None:
+            deviations = np.where(mask, deviations, 0.0)
+        sd = np.sqrt((deviations**2).sum(axis=0) / count)
+    empty = count == 0
+    stats = {
+        "Avg": mean,
+        "Median": median,
+        "Max": maximum,
+        "Min": minimum,
+        "SD": sd,
+    }
+    for name in STAT_NAMES:
+        stats[name] = np.where(empty, np.nan, stats[name])
+    stats["Count"] = count
+    return stats
+
+
+def add_to_log(
+    log: Dict[str, float],
+    stats: Dict[str, np.ndarray],
+    metric: str,
+    prefixes: Optional[List[str]] = None,
+    names: Optional[List[str]] = None,
+) -> None:
+    """add_to_log Adds summaries to a wandb log as "{prefix} {stat} {metric}"
+
+    Args:
+        log (Dict[str, float]): Log being built
+        stats (Dict[str, np.ndarray]): Result of summarize
+        metric (str): Metric name, e.g. "Fitness"
+        prefixes (Optional[List[str]], optional): Prefix per column, e.g. the track names. Defaults to no prefix.
+        names (Optional[List[str]], optional): Statistics to add. Defaults to STAT_NAMES.
+    """
+    if prefixes is None:
+        prefixes = [""]
+    for col, prefix in enumerate(prefixes):
+        ## Columns without any rows are left out like the old masked stats were
+        if stats["Count"][col] == 0:
+            continue
+        for name in names or STAT_NAMES:
+            log[f"{prefix} {name} {metric}".strip()] = float(stats[name][col])
+
+
+class GenerationStats:
+
+    def __init__(self, metrics: List[str], pop_size: int, num_tracks: int) -> None:
+        """__init__ Preallocates a (pop_size, num_tracks) matrix per metric
+
+        Args:
+            metrics (List[str]): Metric names, e.g. fitness and completion
+            pop_size (int): Most genomes that will be added
+            num_tracks (int): Tracks per genome
+        """
+        self.metrics = metrics
+        self.matrices = {metric: np.zeros((pop_size, num_tracks)) for metric in metrics}
+        self.count = 0
+
+    def add(self, values: Dict[str, np.ndarray]) -> None:
+        """add Appends the results of one or more genomes
+
+        Args:
+            values (Dict[str, np.ndarray]): Per track values for every metric, (tracks,) or (genomes, tracks)
+        """
+        rows = np.atleast_2d(np.asarray(values[self.metrics[0]], dtype=float))
+        end = min(self.count + len(rows), len(self.matrices[self.metrics[0]]))
+        for metric in self.metrics:
+            rows = np.atleast_2d(np.asarray(values[metric], dtype=float))
+            self.matrices[metric][self.count : end] = rows[: end - self.count]
+        self.count = end
+
+    def get_matrix(self, metric: str) -> np.ndarray:
+        return self.matrices[metric][: self.count]
+
+    def summary(self, metric: str, combined: bool = False) -> Dict[str, np.ndarray]:
+        """summary Statistics over the genomes added so far
+
+        Args:
+            metric (str): Metric to summarize
+            combined (bool, optional): Summarize the sum over tracks instead of each track. Defaults to False.
+
+        Returns:
+            Dict[str, np.ndarray]: Result of summarize
+        """
+        matrix = self.get_matrix(metric)
+        if combined:
+            matrix = matrix.sum(axis=1)
+        return summarize(matrix)
@@ -1,15 +1,15 @@
 import argparse
 import json
 import pickle
-from datetime import datetime
-from time import sleep
 
 import pymongo
 from bson.objectid import ObjectId
 from bson.binary import Binary
 from neat import nn
 
+from nncompiler import compile_network
 from shellracebot import ShellBot
+from termination import make_termination
 
 ## Get port number track name and bot name from command line
 parser = argparse.ArgumentParser()
@@ -17,6 +17,15 @@ parser.add_argument("-port", help="port number", required=True)
 parser.add_argument("-track", help="track idx", required=True)
 parser.add_argument("-dbid", help="genome db id", required=True)
 parser.add_argument("-eval_length", help="evaluation length", required=True)
+parser.add_argument("-fps", help="server frames per second", default="28")
+parser.add_argument(
+    "-frame_clock",
+    help="time laps and evaluation length in game frames instead of wall clock",
+    action="store_true",
+)
+parser.add_argument(
+    "-log_stride", help="record the trajectory every n frames", default="1"
+)
 args = parser.parse_args()
 
 if not args.port:
@@ -34,6 +43,9 @@ db_objid = ObjectId(args.dbid)
 if not args.eval_length:
     print("No evaluation length specified!")
     exit(2)
+fps = float(args.fps)
+## Game time always runs at 28 frames per second, the server fps only changes how fast it passes
+game_fps = 28.0
 try:
     with open("creds.json") as f:
         creds = json.load(f)
@@ -62,27 +74,41 @@ try:
     host = hostname.split("_")[0]
     instance = hostname.split("_")[-1]
 
-    sb = ShellBot(f"EKKO{track_num}", track, args.port, headless=True, adv_log=True)
+    sb = ShellBot(
+        f"EKKO{track_num}",
+        track,
+        args.port,
+        headless=True,
+        adv_log=True,
+        frame_clock=args.frame_clock,
+        adv_log_frames=int(eval_length * max(fps, game_fps)),
+        adv_log_stride=int(args.log_stride),
+    )
+    if args.frame_clock:
+        sb.frame_limit = int(eval_length * game_fps)
+    ## Reruns end episodes by the same rules the genome was evaluated with
+    sb.termination = make_termination(
+        genome.get("terminate", ""), max_frames=int(eval_length * game_fps)
+    )
     sb.start()
-    sleep(1)
+    sb.wait_for(sb.connected, 30.0, "connection")
     sb.ask_for_perms = True
-    sleep(1)
-    sb.nn = net
+    sb.wait_for(sb.perms_granted, 10.0, "permissions")
+    sb.nn = compile_network(net)
     sb.reset()
-    while sb.awaiting_reset or sb.done:
-        pass
+    sb.wait_for(sb.reset_complete, 30.0, "reset")
     print(
         f"{host} {instance} === Generation {generation} number {individual_num} started logging on {track}!"
     )
-    start_time = datetime.now()
     sb.show_info = True
-    while not sb.done and (datetime.now() - start_time).total_seconds() < eval_length:
-        sleep(0.01)
-    if not sb.done and (datetime.now() - start_time).total_seconds() >= eval_length:
+    if args.frame_clock:
+        ## The bot signals when it reaches the frame limit, the timeout only guards against a stalled server
+        sb.episode_done.wait(eval_length * 2.0)
+    else:
+        sb.episode_done.wait(eval_length)
+    if not sb.done:
         sb.cause_of_death = "Time"
-    xs = sb.xs
-    ys = sb.ys
-    headings = sb.headings
+    trajectory = sb.recorder.to_blob()
     sb.show_info = False
 
     frame_rate = 0.0
@@ -95,7 +121,7 @@ try:
             {"$set": {"needs_adv_logging": True}},
         )
         exit(1)
-    if frame_rate < 27.9:
+    if frame_rate < fps * 27.9 / game_fps:
         collection.update_one(
             {"_id": genome["_id"]},
             {"$set": {"needs_adv_logging": True}},
@@ -105,9 +131,7 @@ try:
         {"_id": genome["_id"]},
         {
             "$set": {
-                f"{track}_xs": xs,
-                f"{track}_ys": ys,
-                f"{track}_headings": headings
+                f"{track}_trajectory": Binary(trajectory),
             }
         },
     )
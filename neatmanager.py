@@ -1,11 +1,14 @@
 import json
+import multiprocessing
 import os
 import pickle
 import shutil
 import sys
 from datetime import datetime, timedelta
 from math import ceil, floor
+from multiprocessing.pool import Pool
 from time import sleep
+from typing import Tuple
 
 import neat
 import numpy as np
@@ -14,7 +17,19 @@ from bson.binary import Binary
 
 import wandb
 from consoleutils import delete_last_lines, progress_bar
-from xpracefitness import get_fitness, get_many_fitnesses
+from frameprofiler import merge_summaries
+from genstats import GenerationStats, add_to_log, summarize
+from resultcache import (
+    EVAL_SETTINGS,
+    ResultCache,
+    get_eval_settings,
+    network_hash,
+)
+from stagedeval import get_seconds_saved, make_policy
+from steadystate import SteadyStateEvolver
+from termination import RULES as TERMINATION_RULES
+from workqueue import drop_expired_backups, ensure_indexes, requeue_expired
+from xpracefitness import get_fitness, get_fitness_matrix
 
 wandb.init(project="XPRace", entity="xprace", resume="must", id="c5i9zwx6")
 ##wandb.init(project="XPRace", entity="xprace", resume=False)
@@ -27,6 +42,29 @@ wandb.config = {
     "trial": 25,
     "completion_per_frame_mod": 1.2,
     "tracks": ["circuit1_a", "circuit1_b"],
+    ## Every genome records a trajectory every trace_stride frames while it is evaluated,
+    ## the best full_trace_top_k of the previous generation record every frame
+    "trace_stride": 14,
+    "full_trace_top_k": 5,
+    ## Breed a replacement as each result arrives instead of waiting on the whole generation,
+    ## workers never run speculative backups of steady state genomes
+    "steady_state": False,
+    "steady_state_in_flight": 100,
+    ## Networks identical to one evaluated in the last cache_generations generations and
+    ## cache_max_age seconds under the same settings reuse its results instead of being raced again
+    "result_cache": False,
+    "cache_generations": 5,
+    "cache_max_age": 6 * 60 * 60,
+    ## Every genome runs the first track, only those the stage policy promotes run the next one.
+    ## Imputed fitness isn't comparable with full evaluations, only turn on (e.g. "quantile") for a new trial
+    "staged_eval": None,
+    "stage_options": {"metric": "completion", "quantile": 0.5},
+    ## Early termination rules from termination.RULES, e.g. "too_slow,reversing,idle,spinning",
+    ## stored on every genome so a whole generation is cut short the same way. Only change between trials.
+    "terminate": "",
+    ## Evaluate on the batch simulator (workers run with -sim) instead of real servers.
+    ## The two don't score alike, so a generation is only ever leased to one kind of worker
+    "sim": False,
 }
 config_name = "config4"
 
@@ -52,6 +90,37 @@ for track in wandb.config["tracks"]:
 db_string = creds["mongodb"]
 client = pymongo.MongoClient(db_string)
 db = client.NEAT
+ensure_indexes(db.genomes)
+
+
+## Lines the progress readout takes up while waiting on a generation
+status_lines = 7
+## Summarized while a generation is still being evaluated
+live_metrics = ["fitness", "completion", "bonus", "avg_completion_per_frame"]
+
+## Genomes per bulk write when publishing a generation, workers can lease a chunk as soon as it lands
+publish_chunk = 25
+publish_processes = max(min(os.cpu_count() or 1, 8), 1)
+
+pool_config = None
+
+
+def set_pool_config(config: neat.Config) -> None:
+    global pool_config
+    pool_config = config
+
+
+def serialize_network(genome: neat.DefaultGenome) -> Tuple[bytes, str]:
+    """serialize_network Builds and pickles a genome's network inside the publishing pool
+
+    Args:
+        genome (neat.DefaultGenome): Genome to publish
+
+    Returns:
+        Tuple[bytes, str]: The pickled RecurrentNetwork and its network_hash
+    """
+    net = neat.nn.RecurrentNetwork.create(genome, pool_config)
+    return pickle.dumps(net), network_hash(genome, pool_config)
 
 
 local_dir = os.path.dirname(__file__)
@@ -74,12 +143,25 @@ class EvolveManager:
     avg_completion_per_frame_list = np.empty((0, 2))
     frame_list = np.empty((0, 2))
     end_frame_list = np.empty((0, 2))
+    ran_list = np.ones((2, 2), dtype=bool)
     autopsy_list = [{} for _ in range(2)]
     fitness_weight = [0.5]
+    host_frame_profiles = {}
+    full_trace_keys = []
+    pool = None
+    live_stats: GenerationStats
+    steady_state = False
 
     failed_evals = 0
     timedout_evals = 0
-    low_framerate = 0
+    low_framerates = 0
+    speculative_wins = 0
+    backups_launched = 0
+    cache_hits = 0
+    cache_settings = None
+    stage = 0
+    staged_rejections = 0
+    staged_seconds_saved = 0.0
 
     def __init__(self, config_file: str, generation: int = 0):
         self.config_file = config_file
@@ -103,6 +185,24 @@ class EvolveManager:
         self.checkpointer = neat.Checkpointer(1, filename_prefix="NEAT-")
         self.p.add_reporter(self.checkpointer)
         self.num_tracks = len(wandb.config["tracks"])
+        self.result_cache = ResultCache(
+            wandb.config["trial"],
+            wandb.config["tracks"],
+            wandb.config["cache_generations"],
+            wandb.config["cache_max_age"],
+        )
+        self.stage_policy = make_policy(
+            wandb.config["staged_eval"], wandb.config["stage_options"]
+        )
+
+    def reset_eval_counters(self):
+        """reset_eval_counters Zeroes the evaluation counters logged once per generation or steady state epoch"""
+        self.timedout_evals = 0
+        self.failed_evals = 0
+        self.low_framerates = 0
+        self.speculative_wins = 0
+        self.backups_launched = 0
+        self.cache_hits = 0
 
     def eval_genomes(self, genomes, config):
         print(
@@ -111,58 +211,29 @@ class EvolveManager:
         self.num_workers = 0
         self.gen_start = datetime.now()
         collection = db.genomes
-        individual_num = 0
-        self.current_species_list = []
-        self.timedout_evals = 0
-        self.failed_evals = 0
-        self.low_framerates = 0
-        for genome_id, genome in genomes:
-            individual_num += 1
-            key = genome.key
-            net = neat.nn.RecurrentNetwork.create(genome, config)
-            net = Binary(pickle.dumps(net))
-            species_id = self.p.species.get_species_id(genome_id)
-            if species_id not in self.current_species_list:
-                self.current_species_list.append(species_id)
-            db_entry = {
-                "key": key,
-                "genome": net,
-                "individual_num": individual_num,
-                "generation": self.generation,
-                "tracks": wandb.config["tracks"],
-                "bonus": np.zeros(self.num_tracks).tolist(),
-                "completion": np.zeros(self.num_tracks).tolist(),
-                "time": (np.ones(self.num_tracks) * -1).tolist(),
-                "started_eval": False,
-                "started_at": None,
-                "finished_eval": False,
-                "algo": "NEAT",
-                "species": species_id,
-                "trial": wandb.config["trial"],
-                "avg_speed": np.zeros(self.num_tracks).tolist(),
-                "avg_completion_per_frame": np.zeros(self.num_tracks).tolist(),
-                "failed_eval": False,
-            }
-            collection.find_one_and_replace(
-                {
-                    "generation": self.generation,
-                    "individual_num": individual_num,
-                    "algo": "NEAT",
-                    "trial": wandb.config["trial"],
-                },
-                replacement=db_entry,
-                upsert=True,
-            )
+        self.reset_eval_counters()
+        self.stage = 0
+        species_ids = [
+            self.p.species.get_species_id(genome_id) for genome_id, _ in genomes
+        ]
+        self.current_species_list = list(dict.fromkeys(species_ids))
+        self.publish_genomes(collection, genomes, species_ids, 1)
         sleep(1)
         first_sleep = True
         secs_passed = 0
         no_alert = True
         secs_since_tg_update = 0
         last_secs_tg = 0
-        avg_eval_time = np.mean(np.sum(self.runtime_list, axis=1)) + (
+        ## Skipped tracks are left at -1, they cost nothing
+        avg_eval_time = np.mean(
+            np.sum(np.where(self.ran_list, self.runtime_list, 0.0), axis=1)
+        ) + (
             8.0 * self.num_tracks
         )
         start_time = datetime.now()
+        self.live_stats = GenerationStats(live_metrics, len(genomes), self.num_tracks)
+        self.live_ids = []
+        secs_since_live_stats = 0
         while True:
             uncompleted_training = collection.count_documents(
                 {
@@ -195,17 +266,28 @@ class EvolveManager:
 
             self.check_eval_status(collection)
 
-            if uncompleted_training == 0:
+            if uncompleted_training == 0 and not self.advance_stage(collection):
                 break
+            if secs_since_live_stats >= 5:
+                self.update_live_stats(collection)
+                secs_since_live_stats = 0
+            secs_since_live_stats += 1
 
             if not first_sleep:
-                delete_last_lines(6)
+                delete_last_lines(status_lines)
             else:
                 first_sleep = False
             print(
                 f'=== {datetime.now().strftime("%H:%M:%S")} ===\n{uncompleted_training} genomes still need to be evaluated\n{started_training} currently being evaluated\n{finished_training} have been evaluated'
             )
             progress_bar(finished_training, started_training, len(genomes))
+            live_fitness = self.live_stats.summary("fitness", combined=True)
+            if self.live_stats.count:
+                print(
+                    f'Live Fitness over {self.live_stats.count} genomes - Avg {round(live_fitness["Avg"][0], 1)} Median {round(live_fitness["Median"][0], 1)} Max {round(live_fitness["Max"][0], 1)}'
+                )
+            else:
+                print("Live Fitness - waiting for results")
             secs_tg = ceil(
                 uncompleted_training * (avg_eval_time) / (self.num_workers + 1)
             )
@@ -239,99 +321,521 @@ class EvolveManager:
             f'=== {datetime.now().strftime("%H:%M:%S")} === Finished Evaluating Genomes > {self.generation}'
         )
 
-        summed_fit_list = []
-        fit_list = np.empty((0, self.num_tracks))
-        bonus_list = np.empty((0, self.num_tracks))
-        completion_list = np.empty((0, self.num_tracks))
-        time_list = np.empty((0, self.num_tracks))
-        runtime_list = np.empty((0, self.num_tracks))
-        avg_speed_list = np.empty((0, self.num_tracks))
-        avg_completion_per_frame_list = np.empty((0, self.num_tracks))
-        frame_list = np.empty((0, self.num_tracks))
-        end_frame_list = np.empty((0, self.num_tracks))
+        result_fields = [
+            "fitness",
+            "bonus",
+            "completion",
+            "time",
+            "runtime",
+            "avg_speed",
+            "avg_completion_per_frame",
+            "frame",
+            "end_frame",
+        ]
+        pop_size = len(genomes)
+        rows = {genome.key: row for row, (_, genome) in enumerate(genomes)}
+        matrices = {
+            field: np.zeros((pop_size, self.num_tracks)) for field in result_fields
+        }
+        found = np.zeros(pop_size, dtype=bool)
         possible_autopsies = {
             "Collision": 0,
             "Stuck": 0,
             "Time": 0,
             "Completed": 0,
             "Failed to start": 0,
+            "Skipped": 0,
         }
-        autopsy_list = [possible_autopsies for _ in range(self.num_tracks)]
-        fitness_weight = []
-        for genome_id, genome in genomes:
-            key = genome.key
-            results = collection.find_one(
-                {
-                    "trial": wandb.config["trial"],
-                    "generation": self.generation,
-                    "key": key,
-                }
-            )
-            if results == None:
-                print(f"No results found for {key}")
+        for rule in TERMINATION_RULES.values():
+            possible_autopsies[rule.label] = 0
+        autopsy_list = [dict(possible_autopsies) for _ in range(self.num_tracks)]
+        host_profiles = {}
+        ids = [None for _ in range(pop_size)]
+        fleet_settings = []
+        ran = np.ones((pop_size, self.num_tracks), dtype=bool)
+        ## One query for the whole generation, rows are scattered back into genome order by key
+        for results in collection.find(
+            {
+                "trial": wandb.config["trial"],
+                "generation": self.generation,
+                "algo": "NEAT",
+            },
+            projection=result_fields[1:]
+            + [
+                "key",
+                "autopsy",
+                "frame_profile",
+                "hostname",
+                "backup_id",
+                "speculative_win",
+                "net_hash",
+                "started_at",
+                "trace_stride",
+                "failed_eval",
+                "evaluated_generation",
+                "evaluated_at",
+                "tracks_run",
+            ]
+            + EVAL_SETTINGS,
+        ):
+            row = rows.get(results["key"])
+            if row is None:
                 continue
-            runtime = results["runtime"]
-            completion = results["completion"]
-            bonus = results["bonus"]
-            avg_speed = results["avg_speed"]
-            avg_completion_per_frame = results["avg_completion_per_frame"]
-            time = results["time"]
-            frame = results["frame"]
-            autopsies = results["autopsy"]
-            end_frame = results["end_frame"]
-            for i, autopsy in enumerate(autopsies):
+            found[row] = True
+            if "net_hash" in results:
+                self.result_cache.add(results["net_hash"], results, self.generation)
+                fleet_settings.append(get_eval_settings(results))
+            if "backup_id" in results:
+                self.backups_launched += 1
+            if results.get("speculative_win"):
+                self.speculative_wins += 1
+            ids[row] = results["_id"]
+            for field in result_fields[1:]:
+                matrices[field][row] = results[field]
+            ## Workers started with -profile store a frame timing summary per track
+            profiles = [
+                profile for profile in results.get("frame_profile") or [] if profile
+            ]
+            if profiles:
+                host = results["hostname"].split("_")[0]
+                host_profiles.setdefault(host, []).extend(profiles)
+            if "tracks_run" in results:
+                ran[row] = False
+                ran[row, results["tracks_run"]] = True
+            for i, autopsy in enumerate(results["autopsy"]):
+                if not ran[row, i]:
+                    autopsy = "Skipped"
                 if autopsy in autopsy_list[i]:
                     autopsy_list[i][autopsy] += 1
                 else:
                     autopsy_list[i][autopsy] = 1
-            avg_speed_list = np.append(avg_speed_list, [avg_speed], axis=0)
-            avg_completion_per_frame_list = np.append(
-                avg_completion_per_frame_list, [avg_completion_per_frame], axis=0
+
+        self.set_cache_settings(fleet_settings)
+
+        ## Every genome and track in one go, rows without results are dropped below
+        matrices["fitness"] = get_fitness_matrix(
+            matrices["completion"],
+            matrices["bonus"],
+            matrices["frame"] / 28.0,
+            matrices["avg_speed"],
+            matrices["avg_completion_per_frame"],
+            target_times,
+            wandb.config,
+        )
+        ## Tracks the stage policy didn't promote a genome to get an imputed fitness
+        self.staged_rejections = int(np.count_nonzero(~ran[found].all(axis=1)))
+        self.staged_seconds_saved = get_seconds_saved(
+            matrices["runtime"][found],
+            ran[found],
+            [target_time + 10.0 for target_time in target_times],
+        )
+        if self.stage_policy is not None:
+            matrices["fitness"][found] = self.stage_policy.impute(
+                matrices["fitness"][found], ran[found]
+            )
+        fitness_updates = [
+            pymongo.UpdateOne(
+                {"_id": ids[row]},
+                {"$set": {"fitness": float(np.sum(matrices["fitness"][row]))}},
+            )
+            for row in np.flatnonzero(found)
+        ]
+        if fitness_updates:
+            collection.bulk_write(fitness_updates, ordered=False)
+
+        keys = []
+        for row, (_, genome) in enumerate(genomes):
+            if not found[row]:
+                print(f"No results found for {genome.key}")
+                continue
+            genome.fitness = np.sum(matrices["fitness"][row])
+            keys.append(genome.key)
+        fit_list = matrices["fitness"][found]
+        summed_fit_list = np.sum(fit_list, axis=1)
+
+        self.completion_list = matrices["completion"][found]
+        self.fit_list = fit_list
+        self.bonus_list = matrices["bonus"][found]
+        self.time_list = matrices["time"][found]
+        self.runtime_list = matrices["runtime"][found]
+        self.avg_speed_list = matrices["avg_speed"][found]
+        self.avg_completion_list = matrices["avg_completion_per_frame"][found]
+        self.summed_fit_list = summed_fit_list.tolist()
+        self.fitness_weight = (
+            np.maximum(fit_list[:, 0], 1.0) / np.maximum(summed_fit_list, 1.0)
+        ).tolist()
+        self.autopsy_list = autopsy_list
+        self.frame_list = matrices["frame"][found]
+        self.end_frame_list = matrices["end_frame"][found]
+        self.ran_list = ran[found]
+        self.host_frame_profiles = {
+            host: merge_summaries(profiles) for host, profiles in host_profiles.items()
+        }
+        ## Survivors keep their key, so the best of this generation get full traces next generation
+        top_k = np.argsort(summed_fit_list)[::-1][: wandb.config["full_trace_top_k"]]
+        self.full_trace_keys = [keys[idx] for idx in top_k]
+        print(
+            f'=== {datetime.now().strftime("%H:%M:%S")} === Finished Fitness Calculation For > {self.generation}'
+        )
+
+    def publish_genomes(self, collection, genomes, species_ids, first_individual_num):
+        """publish_genomes Writes genomes to the work queue under the current generation
+
+        Args:
+            collection (Collection): The genomes collection
+            genomes (List[Tuple[int, neat.DefaultGenome]]): Genome ids and genomes
+            species_ids (List[int]): Species of each genome
+            first_individual_num (int): individual_num of the first genome, the rest count up from it
+        """
+        ## Networks are built, hashed and pickled in the pool and each chunk is written as soon as it
+        ## comes back, so workers lease the first genomes while later networks are still being built
+        networks = self.get_pool().imap(
+            serialize_network,
+            [genome for _, genome in genomes],
+            chunksize=max(len(genomes) // (publish_processes * 4), 1),
+        )
+        settings = None
+        if wandb.config["result_cache"] and self.cache_settings is not None:
+            self.result_cache.set_context(wandb.config["trial"], wandb.config["tracks"])
+            self.result_cache.evict(self.generation)
+            ## Hits have to match what the workers will evaluate everything else in the generation under
+            settings = dict(
+                self.cache_settings,
+                tracks=wandb.config["tracks"],
+                terminate=wandb.config["terminate"],
+                sim=wandb.config["sim"],
             )
-            completion_list = np.append(completion_list, [completion], axis=0)
-            bonus_list = np.append(bonus_list, [bonus], axis=0)
-
-            fitnesses = get_many_fitnesses(
-                completion,
-                bonus,
-                (np.array(frame, dtype=float) / 28.0).tolist(),
-                avg_speed,
-                avg_completion_per_frame,
+        ## Steady state scores genomes as soon as they finish, so staging only applies to whole generations
+        stage_tracks = list(range(self.num_tracks))
+        if self.stage_policy is not None and not self.steady_state:
+            stage_tracks = [0]
+        chunk = []
+        for individual_num, ((_, genome), species_id, network) in enumerate(
+            zip(genomes, species_ids, networks), first_individual_num
+        ):
+            chunk.append((individual_num, genome, species_id) + network)
+            if len(chunk) == publish_chunk:
+                self.write_chunk(collection, chunk, stage_tracks, settings)
+                chunk = []
+        if chunk:
+            self.write_chunk(collection, chunk, stage_tracks, settings)
+
+    def write_chunk(self, collection, chunk, stage_tracks, settings):
+        """write_chunk Writes one chunk of published genomes in a single bulk write
+
+        Args:
+            collection (Collection): The genomes collection
+            chunk (List[Tuple[int, neat.DefaultGenome, int, bytes, str]]): individual_num, genome, species, pickled network and network_hash
+            stage_tracks (List[int]): Tracks the genomes run first
+            settings (Optional[Dict[str, Any]]): Evaluation settings to look cached results up under, None to evaluate everything
+        """
+        trace_strides = [
+            1 if genome.key in self.full_trace_keys else wandb.config["trace_stride"]
+            for _, genome, _, _, _ in chunk
+        ]
+        cached = {}
+        if settings is not None:
+            hits = {}
+            for (_, _, _, _, net_hash), trace_stride in zip(chunk, trace_strides):
+                entry = self.result_cache.lookup(net_hash, settings, trace_stride)
+                if entry is not None:
+                    hits[net_hash] = entry
+            cached = self.result_cache.fetch(collection, hits)
+        requests = []
+        for (
+            individual_num,
+            genome,
+            species_id,
+            net_blob,
+            net_hash,
+        ), trace_stride in zip(chunk, trace_strides):
+            db_entry = {
+                "key": genome.key,
+                "genome": Binary(net_blob),
+                "net_hash": net_hash,
+                "individual_num": individual_num,
+                "generation": self.generation,
+                "tracks": wandb.config["tracks"],
+                "bonus": np.zeros(self.num_tracks).tolist(),
+                "completion": np.zeros(self.num_tracks).tolist(),
+                "time": (np.ones(self.num_tracks) * -1).tolist(),
+                "started_eval": False,
+                "started_at": None,
+                "finished_eval": False,
+                "algo": "NEAT",
+                "species": species_id,
+                "trial": wandb.config["trial"],
+                "avg_speed": np.zeros(self.num_tracks).tolist(),
+                "avg_completion_per_frame": np.zeros(self.num_tracks).tolist(),
+                "failed_eval": False,
+                "trace_stride": trace_stride,
+                "stage": 0,
+                "stage_tracks": stage_tracks,
+                "tracks_run": stage_tracks,
+                "terminate": wandb.config["terminate"],
+                "sim": wandb.config["sim"],
+                "steady_state": self.steady_state,
+            }
+            ## A cache hit goes out already finished so no worker ever leases it
+            if net_hash in cached:
+                db_entry.update(cached[net_hash])
+                db_entry.update({"started_eval": True, "finished_eval": True})
+                self.cache_hits += 1
+            requests.append(
+                pymongo.ReplaceOne(
+                    {
+                        "generation": self.generation,
+                        "individual_num": individual_num,
+                        "algo": "NEAT",
+                        "trial": wandb.config["trial"],
+                    },
+                    db_entry,
+                    upsert=True,
+                )
+            )
+        collection.bulk_write(requests, ordered=False)
+
+    def advance_stage(self, collection):
+        """advance_stage Sends the genomes the stage policy promotes on to the next track once a stage is done
+
+        Args:
+            collection (Collection): The genomes collection
+
+        Returns:
+            bool: True if genomes were put back in the queue, False once the generation is finished
+        """
+        if self.stage_policy is None or self.steady_state:
+            return False
+        if self.stage + 1 >= self.num_tracks:
+            return False
+        fields = ["completion", "bonus", "frame", "avg_speed", "avg_completion_per_frame"]
+        ## Survivors ran exactly the tracks so far, cache hits that already ran everything stay finished
+        survivors = list(
+            collection.find(
+                {
+                    "trial": wandb.config["trial"],
+                    "generation": self.generation,
+                    "algo": "NEAT",
+                    "tracks_run": list(range(self.stage + 1)),
+                },
+                projection=fields,
+            )
+        )
+        self.stage += 1
+        if len(survivors) == 0:
+            return self.advance_stage(collection)
+        values = {
+            field: np.array([genome[field] for genome in survivors], dtype=float)
+            for field in fields
+        }
+        if self.stage_policy.metric == "fitness":
+            scores = get_fitness_matrix(
+                values["completion"],
+                values["bonus"],
+                values["frame"] / 28.0,
+                values["avg_speed"],
+                values["avg_completion_per_frame"],
                 target_times,
                 wandb.config,
             )
-            genome.fitness = np.sum(fitnesses)
-            collection.update_one(
+        else:
+            scores = values[self.stage_policy.metric]
+        promoted = self.stage_policy.select(scores[:, : self.stage].sum(axis=1))
+        promoted_ids = [
+            genome["_id"] for genome, promote in zip(survivors, promoted) if promote
+        ]
+        collection.update_many(
+            {"_id": {"$in": promoted_ids}},
+            {
+                "$set": {
+                    "started_eval": False,
+                    "started_at": None,
+                    "finished_eval": False,
+                    "stage": self.stage,
+                    "stage_tracks": [self.stage],
+                },
+                "$push": {"tracks_run": self.stage},
+                "$unset": {"hostname": "", "lease_id": "", "lease_expires": ""},
+            },
+        )
+        delete_last_lines(status_lines)
+        print(
+            f'=== {datetime.now().strftime("%H:%M:%S")} === {len(promoted_ids)} of {len(survivors)} genomes promoted to {wandb.config["tracks"][self.stage]}\n\n\n\n\n\n\n'
+        )
+        return True
+
+    def set_cache_settings(self, fleet_settings):
+        """set_cache_settings Remembers the settings the workers evaluated the latest results under
+
+        Args:
+            fleet_settings (List[Dict[str, Any]]): get_eval_settings of each result, results are only reused while they all agree
+        """
+        if len(fleet_settings) == 0:
+            return
+        self.cache_settings = None
+        if all(settings == fleet_settings[0] for settings in fleet_settings):
+            self.cache_settings = fleet_settings[0]
+
+    def harvest_finished(self, collection):
+        """harvest_finished Scores genomes that finished since the last call, for steady state mode
+
+        Args:
+            collection (Collection): The genomes collection
+
+        Returns:
+            List[Tuple[int, float]]: Genome key and fitness of each newly finished genome
+        """
+        fields = ["completion", "bonus", "frame", "avg_speed", "avg_completion_per_frame"]
+        finished = list(
+            collection.find(
                 {
-                    "key": key,
-                    "generation": self.generation,
                     "trial": wandb.config["trial"],
+                    "algo": "NEAT",
+                    "finished_eval": True,
+                    "fitness": {"$exists": False},
                 },
-                {"$set": {"fitness": genome.fitness}},
+                projection=fields
+                + [
+                    "key",
+                    "generation",
+                    "net_hash",
+                    "started_at",
+                    "trace_stride",
+                    "failed_eval",
+                    "evaluated_generation",
+                    "evaluated_at",
+                ]
+                + EVAL_SETTINGS,
             )
-            fit_list = np.append(fit_list, [fitnesses], axis=0)
-            summed_fit_list.append(genome.fitness)
-            runtime_list = np.append(runtime_list, [runtime], axis=0)
-            time_list = np.append(time_list, [time], axis=0)
-            frame_list = np.append(frame_list, [frame], axis=0)
-            fitness_weight.append(max(fitnesses[0], 1.0) / max(genome.fitness, 1.0))
-            end_frame_list = np.append(end_frame_list, [end_frame], axis=0)
-
-        self.completion_list = completion_list
-        self.fit_list = fit_list
-        self.bonus_list = bonus_list
-        self.time_list = time_list
-        self.runtime_list = runtime_list
-        self.avg_speed_list = avg_speed_list
-        self.avg_completion_list = avg_completion_per_frame_list
-        self.summed_fit_list = summed_fit_list
-        self.fitness_weight = fitness_weight
-        self.autopsy_list = autopsy_list
-        self.frame_list = frame_list
-        self.end_frame_list = end_frame_list
+        )
+        if len(finished) == 0:
+            return []
+        fleet_settings = []
+        for genome in finished:
+            if "net_hash" in genome:
+                self.result_cache.add(genome["net_hash"], genome, genome["generation"])
+                fleet_settings.append(get_eval_settings(genome))
+        self.set_cache_settings(fleet_settings)
+        values = {
+            field: np.array([genome[field] for genome in finished], dtype=float)
+            for field in fields
+        }
+        fitnesses = np.sum(
+            get_fitness_matrix(
+                values["completion"],
+                values["bonus"],
+                values["frame"] / 28.0,
+                values["avg_speed"],
+                values["avg_completion_per_frame"],
+                target_times,
+                wandb.config,
+            ),
+            axis=1,
+        )
+        collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": genome["_id"]}, {"$set": {"fitness": float(fitness)}}
+                )
+                for genome, fitness in zip(finished, fitnesses)
+            ],
+            ordered=False,
+        )
+        return [(genome["key"], fitness) for genome, fitness in zip(finished, fitnesses)]
+
+    def run_steady_state(self):
+        """run_steady_state Breeds and publishes a replacement as each result comes back, never returns"""
+        self.steady_state = True
+        collection = db.genomes
+        self.reset_eval_counters()
+        evolver = SteadyStateEvolver(
+            self.p, in_flight=wandb.config["steady_state_in_flight"]
+        )
+        self.generation = evolver.epoch
+        pending = evolver.get_pending()
+        self.publish_genomes(
+            collection, pending, [evolver.species_of.get(key) for key, _ in pending], 1
+        )
+        published = len(pending)
         print(
-            f'=== {datetime.now().strftime("%H:%M:%S")} === Finished Fitness Calculation For > {self.generation}'
+            f'=== {datetime.now().strftime("%H:%M:%S")} === Steady state evolution started with {published} genomes out for evaluation'
         )
+        while True:
+            self.check_eval_status(collection)
+            children = []
+            for key, fitness in self.harvest_finished(collection):
+                children.extend(evolver.report(key, fitness))
+            if evolver.epoch != self.generation:
+                fitnesses = [genome.fitness for genome in evolver.pool.values()]
+                log = {
+                    "Generation": self.generation,
+                    "Num Species": len(self.p.species.species),
+                    "Population Size": len(fitnesses),
+                    "Failed Evaluations": self.failed_evals,
+                    "Timedout Evaluations": self.timedout_evals,
+                    "Low Framerates": self.low_framerates,
+                    "Backups Launched": self.backups_launched,
+                    "Speculative Wins": self.speculative_wins,
+                    "Cache Hits": self.cache_hits,
+                }
+                add_to_log(log, summarize(fitnesses), "Fitness")
+                wandb.log(log)
+                ## Counts are per epoch, like the per generation counts eval_genomes logs
+                self.reset_eval_counters()
+                self.generation = evolver.epoch
+            if children:
+                self.publish_genomes(
+                    collection,
+                    children,
+                    [evolver.species_of.get(key) for key, _ in children],
+                    published + 1,
+                )
+                published += len(children)
+            sleep(1)
+
+    def update_live_stats(self, collection):
+        """update_live_stats Adds genomes that finished since the last call to the live statistics"""
+        finished = list(
+            collection.find(
+                {
+                    "generation": self.generation,
+                    "finished_eval": True,
+                    "algo": "NEAT",
+                    "trial": wandb.config["trial"],
+                    "_id": {"$nin": self.live_ids},
+                },
+                projection=live_metrics[1:] + ["avg_speed", "frame"],
+            )
+        )
+        if len(finished) == 0:
+            return
+        self.live_ids.extend(genome["_id"] for genome in finished)
+        values = {
+            metric: np.array([genome[metric] for genome in finished], dtype=float)
+            for metric in live_metrics[1:] + ["avg_speed", "frame"]
+        }
+        values["fitness"] = get_fitness_matrix(
+            values["completion"],
+            values["bonus"],
+            values["frame"] / 28.0,
+            values["avg_speed"],
+            values["avg_completion_per_frame"],
+            target_times,
+            wandb.config,
+        )
+        self.live_stats.add(values)
+
+    def get_pool(
+        self,
+    ) -> Pool:
+        if self.pool is None:
+            ## Forked so the workers don't rerun this script's wandb setup on import
+            self.pool = multiprocessing.get_context("fork").Pool(
+                processes=publish_processes,
+                initializer=set_pool_config,
+                initargs=(self.config,),
+            )
+        return self.pool
 
     def run(self, num_gens: int = 0):
 
@@ -339,91 +843,84 @@ class EvolveManager:
         return winner
 
     def check_eval_status(self, collection):
+        ## Backup copies are never requeued, the original is still out or already finished
+        generation_query = {"trial": wandb.config["trial"], "algo": "NEAT"}
+        ## Steady state mode has genomes from several epochs out at once
+        if not self.steady_state:
+            generation_query["generation"] = self.generation
+        ## Workers renew their leases every few seconds, a lease that ran out means the worker is gone
+        for genome in requeue_expired(collection, generation_query):
+            hostname = genome.get("hostname") or "Unknown"
+            delete_last_lines(status_lines)
+            print(
+                f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {genome["key"]} lost its lease on worker {hostname}, requeued!\n\n\n\n\n\n\n'
+            )
+            self.timedout_evals += 1
+        drop_expired_backups(collection)
         for genome in collection.find(
-            {
-                "generation": self.generation,
-                "started_eval": True,
-                "finished_eval": False,
-                "trial": wandb.config["trial"],
-            }
+            dict(
+                generation_query,
+                started_eval=True,
+                finished_eval=False,
+                just_failed=True,
+            )
         ):
             genome_id = genome["_id"]
             key = genome["key"]
-            started_at = genome["started_at"]
-            mins = (np.sum(target_times) * 1.1 + 10.0 * len(target_times)) / 60.0
-            if (
-                started_at != None
-                and (datetime.now() - started_at) > timedelta(minutes=mins)
-            ) or ("just_failed" in genome and genome["just_failed"]):
-                collection.update_one(
-                    {"_id": genome_id},
-                    {
-                        "$set": {"started_eval": False, "finished_eval": False},
-                        "$unset": {"just_failed": ""},
-                    },
-                )
-                if "failed_eval" in genome and genome["failed_eval"]:
-                    if "error" in genome and genome["error"] == "Frame rate too low!":
-                        hostname = (
-                            genome["hostname"]
-                            if "hostname" in genome and genome["hostname"]
-                            else "Unknown"
-                        )
-                        frame_rate = genome["frame_rate"]
-                        delete_last_lines(6)
-                        print(
-                            f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {genome["key"]} has a framerate of {frame_rate} on worker {hostname}!'
-                        )
-                        wandb.alert(
-                            title="Low Framerate",
-                            text=f"Gen: {self.generation} Genome {genome['key']} on {hostname} had a framerate of {frame_rate}\n\n\n\n\n\n\n",
-                        )
-                        self.low_framerates += 1
-                        continue
-                    delete_last_lines(6)
+            collection.update_one(
+                {"_id": genome_id},
+                {
+                    "$set": {"started_eval": False, "finished_eval": False},
+                    "$unset": {"just_failed": ""},
+                },
+            )
+            if "failed_eval" in genome and genome["failed_eval"]:
+                if "error" in genome and genome["error"] == "Frame rate too low!":
+                    hostname = (
+                        genome["hostname"]
+                        if "hostname" in genome and genome["hostname"]
+                        else "Unknown"
+                    )
+                    frame_rate = genome["frame_rate"]
+                    delete_last_lines(status_lines)
                     print(
-                        f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {key} failed to evaluate Worker {genome["hostname"]} Error: {genome["error"] if "error" in genome else "Unknown"}\n\n\n\n\n\n\n'
+                        f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {genome["key"]} has a framerate of {frame_rate} on worker {hostname}!'
                     )
                     wandb.alert(
-                        title="Failed Eval!",
-                        text=f"Gen: {self.generation} Genome {key} failed to evaluate! Worker {genome['hostname']} Error: {genome['error'] if 'error' in genome else 'Unknown'}",
+                        title="Low Framerate",
+                        text=f"Gen: {self.generation} Genome {genome['key']} on {hostname} had a framerate of {frame_rate}\n\n\n\n\n\n\n",
                     )
-                    self.failed_evals += 1
+                    self.low_framerates += 1
                     continue
-                delete_last_lines(6)
+                delete_last_lines(status_lines)
                 print(
-                    f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {key} has been running for {round(mins, 1)} minutes, marking for review!\n\n\n\n\n\n\n'
-                )
-                collection.update_one(
-                    {"_id": genome_id},
-                    {
-                        "$set": {
-                            "started_eval": False,
-                            "failed_eval": True,
-                            "error": "Timeout",
-                        }
-                    },
+                    f'=== {datetime.now().strftime("%H:%M:%S")} === Genome {key} failed to evaluate Worker {genome["hostname"]} Error: {genome["error"] if "error" in genome else "Unknown"}\n\n\n\n\n\n\n'
                 )
-                hostname = "Unknown"
-                try:
-                    if genome["hostname"]:
-                        hostname = genome["hostname"]
-                except KeyError:
-                    pass
                 wandb.alert(
-                    title="Evaluation Timeout",
-                    text=f"Gen: {self.generation} Genome {key} has been running for {round(mins, 1)} minutes, marking for review. Worker {hostname}.",
+                    title="Failed Eval!",
+                    text=f"Gen: {self.generation} Genome {key} failed to evaluate! Worker {genome['hostname']} Error: {genome['error'] if 'error' in genome else 'Unknown'}",
                 )
-                self.timedout_evals += 1
+                self.failed_evals += 1
 
 
 manager = EvolveManager(config_path, generation=773)
+if wandb.config["steady_state"]:
+    try:
+        manager.run_steady_state()
+    except KeyboardInterrupt:
+        sleep(5)
+        wandb.alert(
+            title="Run Aborted",
+            text=f"Run Ended at generation {manager.generation}",
+        )
+        sys.exit()
 while True:
     try:
         manager.run(num_gens=1)
         print(
             f'=== {datetime.now().strftime("%H:%M:%S")} === Starting Logging For > {manager.generation}'
         )
+        tracks = wandb.config["tracks"]
         log = {
             "Generation": manager.generation,
             "Time Elapsed": (datetime.now() - manager.gen_start).total_seconds(),
@@ -431,131 +928,72 @@ while True:
             "Num Species": len(manager.current_species_list),
             "Population Size": len(manager.fit_list),
             "Num Workers": manager.num_workers,
-            "Max Fitness": np.max(manager.summed_fit_list),
-            "Min Fitness": np.min(manager.summed_fit_list),
-            "Avg Fitness": np.mean(manager.summed_fit_list),
-            "Median Fitness": np.median(manager.summed_fit_list),
-            "SD Fitness": np.std(manager.summed_fit_list),
-            "Avg Combined Completion": np.mean(np.sum(manager.completion_list, axis=1)),
-            "Median Combined Completion": np.median(
-                np.sum(manager.completion_list, axis=1)
-            ),
-            "Max Combined Completion": np.max(np.sum(manager.completion_list, axis=1)),
-            "Min Combined Completion": np.min(np.sum(manager.completion_list, axis=1)),
-            "Avg Fitness Weight": np.mean(manager.fitness_weight),
-            "Median Fitness Weight": np.median(manager.fitness_weight),
-            "Max Fitness Weight": np.max(manager.fitness_weight),
-            "Min Fitness Weight": np.min(manager.fitness_weight),
             "Failed Evaluations": manager.failed_evals,
             "Timedout Evaluations": manager.timedout_evals,
             "Low Framerates": manager.low_framerates,
+            "Backups Launched": manager.backups_launched,
+            "Speculative Wins": manager.speculative_wins,
+            "Cache Hits": manager.cache_hits,
+            "Staged Rejections": manager.staged_rejections,
+            "Staged Seconds Saved": manager.staged_seconds_saved,
         }
-        for idx, track in enumerate(wandb.config["tracks"]):
-            track_log = {
-                f"{track} Avg Fitness": np.mean(manager.fit_list[:, idx]),
-                f"{track} Median Fitness": np.median(manager.fit_list[:, idx]),
-                f"{track} Max Fitness": np.max(manager.fit_list[:, idx]),
-                f"{track} Min Fitness": np.min(manager.fit_list[:, idx]),
-                f"{track} SD Fitness": np.std(manager.fit_list[:, idx]),
-                f"{track} Avg Bonus": np.mean(manager.bonus_list[:, idx]),
-                f"{track} Median Bonus": np.median(manager.bonus_list[:, idx]),
-                f"{track} Max Bonus": np.max(manager.bonus_list[:, idx]),
-                f"{track} Min Bonus": np.min(manager.bonus_list[:, idx]),
-                f"{track} SD Bonus": np.std(manager.bonus_list[:, idx]),
-                f"{track} Avg Completion": np.mean(manager.completion_list[:, idx]),
-                f"{track} Median Completion": np.median(
-                    manager.completion_list[:, idx]
-                ),
-                f"{track} Max Completion": np.max(manager.completion_list[:, idx]),
-                f"{track} Min Completion": np.min(manager.completion_list[:, idx]),
-                f"{track} SD Completion": np.std(manager.completion_list[:, idx]),
-                f"{track} Avg Runtime": np.mean(manager.runtime_list[:, idx]),
-                f"{track} Median Runtime": np.median(manager.runtime_list[:, idx]),
-                f"{track} Max Runtime": np.max(manager.runtime_list[:, idx]),
-                f"{track} Min Runtime": np.min(manager.runtime_list[:, idx]),
-                f"{track} SD Runtime": np.std(manager.runtime_list[:, idx]),
-                f"{track} Avg Speed": np.mean(manager.avg_speed_list[:, idx]),
-                f"{track} Median Speed": np.median(manager.avg_speed_list[:, idx]),
-                f"{track} Max Speed": np.max(manager.avg_speed_list[:, idx]),
-                f"{track} Min Speed": np.min(manager.avg_speed_list[:, idx]),
-                f"{track} SD Speed": np.std(manager.avg_speed_list[:, idx]),
-                f"{track} Avg Completion Per Frame": np.mean(
-                    manager.avg_completion_list[:, idx]
-                ),
-                f"{track} Median Completion Per Frame": np.median(
-                    manager.avg_completion_list[:, idx]
-                ),
-                f"{track} Max Completion Per Frame": np.max(
-                    manager.avg_completion_list[:, idx]
-                ),
-                f"{track} Min Completion Per Frame": np.min(
-                    manager.avg_completion_list[:, idx]
-                ),
-                f"{track} SD Completion Per Frame": np.std(
-                    manager.avg_completion_list[:, idx]
-                ),
-                f"{track} Completions": len(
-                    manager.completion_list[manager.completion_list[:, idx] == 100.0]
-                ),
-            }
+        add_to_log(log, summarize(manager.summed_fit_list), "Fitness")
+        combined_completion = np.sum(manager.completion_list, axis=1)
+        add_to_log(
+            log,
+            summarize(combined_completion),
+            "Combined Completion",
+            names=["Avg", "Median", "Max", "Min"],
+        )
+        add_to_log(
+            log,
+            summarize(manager.fitness_weight),
+            "Fitness Weight",
+            names=["Avg", "Median", "Max", "Min"],
+        )
+        for metric, matrix in [
+            ("Fitness", manager.fit_list),
+            ("Bonus", manager.bonus_list),
+            ("Completion", manager.completion_list),
+            ("Runtime", manager.runtime_list),
+            ("Speed", manager.avg_speed_list),
+            ("Completion Per Frame", manager.avg_completion_list),
+            (
+                "Runtime Diff",
+                manager.runtime_list - manager.end_frame_list.astype(float) / 28.0,
+            ),
+        ]:
+            add_to_log(log, summarize(matrix, manager.ran_list), metric, tracks)
 
+        ## Lap times only count for genomes that finished the track
+        finished = (manager.time_list > 0) & manager.ran_list
+        frame_times = manager.frame_list.astype(float) / 28.0
+        add_to_log(log, summarize(manager.time_list, finished), "Time", tracks)
+        add_to_log(log, summarize(frame_times, finished), "Frame Time", tracks)
+        add_to_log(
+            log,
+            summarize(manager.time_list - frame_times, finished),
+            "Time Diff",
+            tracks,
+        )
+        for idx, track in enumerate(tracks):
+            log[f"{track} Completions"] = int(
+                np.count_nonzero(manager.completion_list[:, idx] == 100.0)
+            )
             for key in manager.autopsy_list[idx].keys():
-                track_log[f"{track} {key}"] = manager.autopsy_list[idx][key]
-            end_frames = manager.end_frame_list[:, idx]
-            end_frames = end_frames.astype(float)
-            end_frames = end_frames / 28.0
-            time_diffs = manager.runtime_list[:, idx] - end_frames
-            track_log[f"{track} Avg Runtime Diff"] = np.mean(time_diffs)
-            track_log[f"{track} Median Runtime Diff"] = np.median(time_diffs)
-            track_log[f"{track} Max Runtime Diff"] = np.max(time_diffs)
-            track_log[f"{track} Min Runtime Diff"] = np.min(time_diffs)
-            track_log[f"{track} SD Runtime Diff"] = np.std(time_diffs)
-
-            if np.max(manager.time_list[:, idx]) > 0:
-                real_times = manager.time_list[:, idx][manager.time_list[:, idx] > 0]
-                track_log[f"{track} Avg Time"] = np.mean(real_times)
-                track_log[f"{track} Median Time"] = np.median(real_times)
-                track_log[f"{track} Max Time"] = np.max(real_times)
-                track_log[f"{track} Min Time"] = np.min(real_times)
-                track_log[f"{track} SD Time"] = np.std(real_times)
-                real_frames = manager.frame_list[:, idx][manager.time_list[:, idx] > 0]
-                ## Convert frames nparray from int to float
-                real_frames = real_frames.astype(float)
-                real_frames = real_frames / 28.0
-                track_log[f"{track} Avg Frame Time"] = np.mean(real_frames)
-                track_log[f"{track} Median Frame Time"] = np.median(real_frames)
-                track_log[f"{track} Max Frame Time"] = np.max(real_frames)
-                track_log[f"{track} Min Frame Time"] = np.min(real_frames)
-                track_log[f"{track} SD Frame Time"] = np.std(real_frames)
-
-                if np.shape(real_times) != np.shape(real_frames):
-                    print(np.shape(real_times))
-                    print(np.shape(real_frames))
-                    raise Exception("Time and Frame shape mismatch")
-
-                time_diffs = real_times - real_frames
-                track_log[f"{track} Avg Time Diff"] = np.mean(time_diffs)
-                track_log[f"{track} Median Time Diff"] = np.median(time_diffs)
-                track_log[f"{track} Max Time Diff"] = np.max(time_diffs)
-                track_log[f"{track} Min Time Diff"] = np.min(time_diffs)
-                track_log[f"{track} SD Time Diff"] = np.std(time_diffs)
-
-            log.update(track_log)
-        combined_times = np.sum(manager.time_list, axis=1)[
-            np.sum(manager.completion_list, axis=1) == 200.0
-        ]
-        try:
-            combined_time_stats = {
-                "Combined Avg Time": np.mean(combined_times),
-                "Combined Median Time": np.median(combined_times),
-                "Combined Max Time": np.max(combined_times),
-                "Combined Min Time": np.min(combined_times),
-                "Combined SD Time": np.std(combined_times),
-                "Total Completions": len(combined_times),
-            }
-            log.update(combined_time_stats)
-        except:
-            pass
+                log[f"{track} {key}"] = manager.autopsy_list[idx][key]
+        for host, profile in manager.host_frame_profiles.items():
+            log[f"{host} Profiled Frames"] = profile["frames"]
+            log[f"{host} Frame Overruns"] = profile["overruns"]
+            log[f"{host} Frame Overrun Rate"] = profile["overrun_rate"]
+            log[f"{host} P99 Frame Time"] = profile["spans"]["frame"]["p99_us"] / 1000.0
+        combined_times = np.sum(manager.time_list, axis=1)
+        completed_all = combined_completion == 100.0 * len(tracks)
+        add_to_log(
+            log, summarize(combined_times, completed_all), "Time", ["Combined"]
+        )
+        if np.any(completed_all):
+            log["Total Completions"] = int(np.count_nonzero(completed_all))
         wandb.log(log)
         print(
             f'=== {datetime.now().strftime("%H:%M:%S")} === Finished Logging For > {manager.generation}'
@@ -0,0 +1,269 @@
+"""
+nncompiler turns unpickled neat RecurrentNetworks into faster evaluators that give exactly the same outputs
+
+compile_network generates a specialized Python function for one network, used by ShellBot every frame:
+
+    sb.nn = compile_network(pickle.loads(genome["genome"]))
+
+NetworkBatch stacks many networks into padded NumPy arrays so a whole population is activated in one call.
+"""
+
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from neat import activations, aggregations
+
+## Activation codes used by NetworkBatch, covering the activation_options in the configs
+IDENTITY = 0
+SIGMOID = 1
+TANH = 2
+CLAMPED = 3
+HAT = 4
+GAUSS = 5
+
+ACTIVATION_CODES: Dict[Callable, int] = {
+    activations.identity_activation: IDENTITY,
+    activations.sigmoid_activation: SIGMOID,
+    activations.tanh_activation: TANH,
+    activations.clamped_activation: CLAMPED,
+    activations.hat_activation: HAT,
+    activations.gauss_activation: GAUSS,
+}
+
+
+def get_slots(net: Any) -> Dict[int, int]:
+    """get_slots Numbers every value a RecurrentNetwork stores, inputs first then outputs then hidden nodes
+
+    Args:
+        net (Any): A neat.nn.RecurrentNetwork
+
+    Returns:
+        Dict[int, int]: Position of each node key in the state vector
+    """
+    slots: Dict[int, int] = {}
+    for key in [*net.input_nodes, *net.output_nodes]:
+        slots.setdefault(key, len(slots))
+    for node, _, _, _, _, links in net.node_evals:
+        slots.setdefault(node, len(slots))
+        for key, _ in links:
+            slots.setdefault(key, len(slots))
+    return slots
+
+
+def literal(value: float) -> str:
+    if math.isfinite(value):
+        return repr(float(value))
+    return f"float('{value}')"
+
+
+class CompiledNetwork:
+
+    def __init__(self, net: Any) -> None:
+        self.input_nodes = list(net.input_nodes)
+        self.output_nodes = list(net.output_nodes)
+        self.slots = get_slots(net)
+        self.reset()
+
+        ## Every node reads last frame's values, so compute all of them before storing any
+        lines = [
+            "def activate(v, inputs):",
+            f"    if len(inputs) != {len(self.input_nodes)}:",
+            f"        raise RuntimeError(f'Expected {len(self.input_nodes)} inputs, got {{len(inputs)}}')",
+        ]
+        for idx, key in enumerate(self.input_nodes):
+            lines.append(f"    v[{self.slots[key]}] = inputs[{idx}]")
+        namespace: Dict[str, Any] = {}
+        stores = []
+        for num, (node, activation, aggregation, bias, response, links) in enumerate(
+            net.node_evals
+        ):
+            if aggregation is not aggregations.sum_aggregation:
+                raise ValueError(f"Node {node} uses an unsupported aggregation!")
+            namespace[f"act{num}"] = activation
+            ## sum() starts from 0 and adds left to right, keep that order so rounding matches
+            terms = " + ".join(
+                f"v[{self.slots[key]}] * {literal(weight)}" for key, weight in links
+            )
+            lines.append(
+                f"    n{num} = act{num}({literal(bias)} + {literal(response)} * (0 + {terms}))"
+            )
+            stores.append(f"    v[{self.slots[node]}] = n{num}")
+        lines.extend(stores)
+        lines.append(
+            "    return ["
+            + ", ".join(f"v[{self.slots[key]}]" for key in self.output_nodes)
+            + "]"
+        )
+        self.source = "\n".join(lines)
+        exec(compile(self.source, "<nncompiler>", "exec"), namespace)
+        self.evaluator = namespace["activate"]
+
+    def reset(
+        self,
+    ) -> None:
+        self.values = [0.0] * len(self.slots)
+
+    def activate(self, inputs: Sequence[float]) -> List[float]:
+        """activate Drop in replacement for RecurrentNetwork.activate
+
+        Args:
+            inputs (Sequence[float]): One value per input node
+
+        Returns:
+            List[float]: One value per output node
+        """
+        if isinstance(inputs, np.ndarray):
+            inputs = inputs.tolist()
+        return self.evaluator(self.values, inputs)
+
+
+def compile_network(net: Any) -> Any:
+    """compile_network Compiles a RecurrentNetwork, anything without node_evals is returned unchanged
+
+    Args:
+        net (Any): Network unpickled from a genome document
+
+    Returns:
+        Any: An object with the same activate and reset methods
+    """
+    if not hasattr(net, "node_evals"):
+        return net
+    return CompiledNetwork(net)
+
+
+def map_math(func: Callable[[float], float], values: np.ndarray) -> np.ndarray:
+    """map_math Applies a math function element by element, np.exp and np.tanh round differently from math"""
+    return np.fromiter(map(func, values.tolist()), dtype=float, count=values.size)
+
+
+def apply_activations(codes: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """apply_activations Vectorized neat activation functions with the same clamping and rounding
+
+    Args:
+        codes (np.ndarray): Activation code of each value
+        z (np.ndarray): Values to activate, already biased and scaled by the response
+
+    Returns:
+        np.ndarray: The activated values
+    """
+    out = z.copy()
+    ## max(lo, min(hi, x)) written with comparisons so NaN handling matches Python
+    mask = codes == SIGMOID
+    if mask.any():
+        s = 5.0 * z[mask]
+        s = np.where(s < 60.0, s, 60.0)
+        s = np.where(s > -60.0, s, -60.0)
+        out[mask] = 1.0 / (1.0 + map_math(math.exp, -s))
+    mask = codes == TANH
+    if mask.any():
+        s = 2.5 * z[mask]
+        s = np.where(s < 60.0, s, 60.0)
+        s = np.where(s > -60.0, s, -60.0)
+        out[mask] = map_math(math.tanh, s)
+    mask = codes == CLAMPED
+    if mask.any():
+        s = np.where(z[mask] < 1.0, z[mask], 1.0)
+        out[mask] = np.where(s > -1.0, s, -1.0)
+    mask = codes == HAT
+    if mask.any():
+        s = 1 - np.abs(z[mask])
+        out[mask] = np.where(s > 0.0, s, 0.0)
+    mask = codes == GAUSS
+    if mask.any():
+        s = np.where(z[mask] < 3.4, z[mask], 3.4)
+        s = np.where(s > -3.4, s, -3.4)
+        ## Python's z ** 2 goes through libm pow, which can round differently from z * z
+        out[mask] = map_math(lambda v: math.exp(-5.0 * v**2), s)
+    return out
+
+
+class NetworkBatch:
+
+    def __init__(self, nets: List[Any]) -> None:
+        self.num_inputs = len(nets[0].input_nodes)
+        self.num_outputs = len(nets[0].output_nodes)
+        all_slots = [get_slots(net) for net in nets]
+        pop = len(nets)
+        num_slots = max(len(slots) for slots in all_slots)
+        num_nodes = max(max(len(net.node_evals) for net in nets), 1)
+        fan_in = max(
+            [len(links) for net in nets for *_, links in net.node_evals] + [1]
+        )
+
+        ## Padding reads from an always zero slot and writes to a scratch slot
+        self.zero_slot = num_slots
+        self.scratch_slot = num_slots + 1
+        self.node_slots = np.full((pop, num_nodes), self.scratch_slot, dtype=int)
+        self.sources = np.full((pop, num_nodes, fan_in), self.zero_slot, dtype=int)
+        self.weights = np.zeros((pop, num_nodes, fan_in))
+        self.biases = np.zeros((pop, num_nodes))
+        self.responses = np.zeros((pop, num_nodes))
+        self.codes = np.full((pop, num_nodes), IDENTITY, dtype=int)
+        for idx, (net, slots) in enumerate(zip(nets, all_slots)):
+            if (
+                len(net.input_nodes) != self.num_inputs
+                or len(net.output_nodes) != self.num_outputs
+            ):
+                raise ValueError("Every network in a batch needs the same inputs and outputs!")
+            for num, (node, activation, aggregation, bias, response, links) in enumerate(
+                net.node_evals
+            ):
+                if aggregation is not aggregations.sum_aggregation:
+                    raise ValueError(f"Node {node} uses an unsupported aggregation!")
+                if activation not in ACTIVATION_CODES:
+                    raise ValueError(f"Node {node} uses an unsupported activation!")
+                self.node_slots[idx, num] = slots[node]
+                self.codes[idx, num] = ACTIVATION_CODES[activation]
+                self.biases[idx, num] = bias
+                self.responses[idx, num] = response
+                for link, (key, weight) in enumerate(links):
+                    self.sources[idx, num, link] = slots[key]
+                    self.weights[idx, num, link] = weight
+        self.values = np.zeros((pop, num_slots + 2))
+
+    def reset(self, rows: Optional[np.ndarray] = None) -> None:
+        if rows is None:
+            self.values[:] = 0.0
+        else:
+            self.values[rows] = 0.0
+
+    def activate(
+        self, inputs: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """activate Steps every network in the batch once, matching RecurrentNetwork.activate
+
+        Args:
+            inputs (np.ndarray): Observations, one row per activated network
+            rows (Optional[np.ndarray], optional): Which networks to activate, the rest keep their state. Defaults to all.
+
+        Returns:
+            np.ndarray: Outputs, one row per activated network
+        """
+        if rows is None:
+            rows = np.arange(len(self.values))
+        inputs = np.asarray(inputs, dtype=float).reshape(len(rows), -1)
+        if inputs.shape[1] != self.num_inputs:
+            raise RuntimeError(
+                f"Expected {self.num_inputs} inputs, got {inputs.shape[1]}"
+            )
+        values = self.values[rows]
+        values[:, : self.num_inputs] = inputs
+        gathered = np.take_along_axis(
+            values[:, None, :],
+            self.sources[rows].reshape(len(rows), 1, -1),
+            axis=2,
+        ).reshape(self.sources[rows].shape)
+        weights = self.weights[rows]
+
+        ## Same left to right order as sum() over the links
+        total = np.zeros(gathered.shape[:2])
+        for link in range(gathered.shape[2]):
+            total = total + gathered[:, :, link] * weights[:, :, link]
+        z = self.biases[rows] + self.responses[rows] * total
+        activated = apply_activations(self.codes[rows], z)
+
+        np.put_along_axis(values, self.node_slots[rows], activated, axis=1)
+        values[:, self.zero_slot] = 0.0
+        self.values[rows] = values
+        return values[:, self.num_inputs : self.num_inputs + self.num_outputs].copy()
@@ -0,0 +1,249 @@
+"""
+resultcache reuses the results of networks that were already evaluated instead of racing them again
+
+Elites and unchanged survivors come back every generation with bit for bit the same network. network_hash
+reduces a genome to exactly what RecurrentNetwork.create builds from it, so genomes that would fly the same
+network share a hash. The cache maps that hash, together with the settings the network was evaluated
+under (tracks, termination rules, server fps, frame clock and real server or simulator), to the genome
+document holding its results, and a hit is published already finished with those results copied over.
+
+A cache only ever holds results for one trial and one track list, and entries are evicted once they are too
+many generations or too long ago, so a result is never reused under a different config or gets too stale.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import neat
+from neat.graphs import required_for_output
+from pymongo.collection import Collection
+
+## Per track results written by workerclient, copied from the cached document on a hit
+CACHED_FIELDS = [
+    "bonus",
+    "completion",
+    "time",
+    "runtime",
+    "x",
+    "y",
+    "avg_speed",
+    "avg_completion_per_frame",
+    "frame_rate",
+    "autopsy",
+    "frame",
+    "end_frame",
+    "time_diff",
+    "frame_adj_runtime",
+    "trace_stride",
+    "tracks_run",
+    "eval_fps",
+    "frame_clock",
+    "sim",
+]
+
+## Genome document fields a result depends on besides the network, part of every cache key
+EVAL_SETTINGS = ["tracks", "terminate", "eval_fps", "frame_clock", "sim"]
+
+
+def get_eval_settings(genome: Dict[str, Any]) -> Dict[str, Any]:
+    """get_eval_settings The settings a genome document was evaluated under, missing fields as None"""
+    return {field: genome.get(field) for field in EVAL_SETTINGS}
+
+
+def eval_key(net_hash: str, settings: Dict[str, Any]) -> str:
+    """eval_key Cache key for a network evaluated under the given settings
+
+    Args:
+        net_hash (str): The genome's network_hash
+        settings (Dict[str, Any]): Result of get_eval_settings
+
+    Returns:
+        str: Hex digest, only equal for the same network under the same settings
+    """
+    return hashlib.sha1(
+        (net_hash + json.dumps(settings, sort_keys=True)).encode()
+    ).hexdigest()
+
+
+def network_hash(genome: neat.DefaultGenome, config: neat.Config) -> str:
+    """network_hash Canonical hash of the network a genome is flown as
+
+    Args:
+        genome (neat.DefaultGenome): Genome to hash
+        config (neat.Config): Config the network is built with
+
+    Returns:
+        str: Hex digest, equal for genomes that build the same network
+    """
+    genome_config = config.genome_config
+    required = required_for_output(
+        genome_config.input_keys, genome_config.output_keys, genome.connections
+    )
+    ## Same pruning as RecurrentNetwork.create, disabled and unused connections don't change the network
+    node_inputs: Dict[int, List[str]] = {}
+    for cg in genome.connections.values():
+        if not cg.enabled:
+            continue
+        i, o = cg.key
+        if o not in required and i not in required:
+            continue
+        node_inputs.setdefault(o, []).append(f"{i}:{float(cg.weight).hex()}")
+    parts = []
+    for node_key in sorted(node_inputs):
+        node = genome.nodes[node_key]
+        fields = [
+            str(node_key),
+            node.activation,
+            node.aggregation,
+            float(node.bias).hex(),
+            float(node.response).hex(),
+            ",".join(sorted(node_inputs[node_key])),
+        ]
+        parts.append("|".join(fields))
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+class ResultCache:
+
+    def __init__(
+        self,
+        trial: Any,
+        tracks: List[str],
+        max_generations: int = 5,
+        max_age: float = 6 * 60 * 60,
+    ) -> None:
+        """__init__ Results of evaluated networks for one trial and track list
+
+        Args:
+            trial (Any): Trial the results were evaluated under
+            tracks (List[str]): Tracks the results were evaluated on, in order
+            max_generations (int, optional): Generations a result is reused for after it was evaluated. Defaults to 5.
+            max_age (float, optional): Seconds a result is reused for after it was evaluated. Defaults to 6 hours.
+        """
+        self.trial = trial
+        self.tracks = list(tracks)
+        self.max_generations = max_generations
+        self.max_age = max_age
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def set_context(self, trial: Any, tracks: List[str]) -> None:
+        """set_context Empties the cache if the trial or track list changed"""
+        if trial != self.trial or list(tracks) != self.tracks:
+            self.entries = {}
+            self.trial = trial
+            self.tracks = list(tracks)
+
+    def add(
+        self,
+        net_hash: str,
+        genome: Dict[str, Any],
+        generation: int,
+    ) -> None:
+        """add Remembers a finished genome document's results
+
+        Args:
+            net_hash (str): The genome's network_hash
+            genome (Dict[str, Any]): Its document, needs _id, started_at and the EVAL_SETTINGS fields, plus evaluated_generation and evaluated_at if it was a hit itself
+            generation (int): Generation the document was published in
+        """
+        if genome.get("failed_eval"):
+            return
+        key = eval_key(net_hash, get_eval_settings(genome))
+        ## A reused result keeps the age of the evaluation it came from
+        self.entries[key] = {
+            "key": key,
+            "_id": genome["_id"],
+            "evaluated_generation": genome.get("evaluated_generation", generation),
+            "evaluated_at": genome.get("evaluated_at")
+            or genome.get("started_at")
+            or datetime.now(),
+            "trace_stride": genome.get("trace_stride", 0),
+        }
+
+    def lookup(
+        self, net_hash: str, settings: Dict[str, Any], trace_stride: int
+    ) -> Optional[Dict[str, Any]]:
+        """lookup Finds a usable entry for a network
+
+        Args:
+            net_hash (str): The genome's network_hash
+            settings (Dict[str, Any]): Settings the genome would be evaluated under, see get_eval_settings
+            trace_stride (int): Stride the genome would be traced at, a coarser cached trace is a miss
+
+        Returns:
+            Optional[Dict[str, Any]]: The entry or None
+        """
+        entry = self.entries.get(eval_key(net_hash, settings))
+        if entry is None:
+            return None
+        if trace_stride > 0 and not 0 < entry["trace_stride"] <= trace_stride:
+            return None
+        return entry
+
+    def evict(self, generation: int) -> int:
+        """evict Drops entries evaluated too many generations or too long ago
+
+        Args:
+            generation (int): Generation about to be published
+
+        Returns:
+            int: Number of entries dropped
+        """
+        oldest = datetime.now() - timedelta(seconds=self.max_age)
+        expired = [
+            net_hash
+            for net_hash, entry in self.entries.items()
+            if generation - entry["evaluated_generation"] > self.max_generations
+            or entry["evaluated_at"] < oldest
+        ]
+        for net_hash in expired:
+            del self.entries[net_hash]
+        return len(expired)
+
+    def fetch(
+        self, collection: Collection, hits: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """fetch Loads the results for cache hits in one query
+
+        Args:
+            collection (Collection): The genomes collection
+            hits (Dict[str, Dict[str, Any]]): Entries returned by lookup by network hash
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Fields to publish each hit with, hits whose document is gone are left out
+        """
+        if len(hits) == 0:
+            return {}
+        ## The trial and tracks are checked again against the stored document, not just the cache's own context
+        documents = {
+            document["_id"]: document
+            for document in collection.find(
+                {
+                    "_id": {"$in": [entry["_id"] for entry in hits.values()]},
+                    "trial": self.trial,
+                    "tracks": self.tracks,
+                    "finished_eval": True,
+                    "failed_eval": False,
+                },
+                projection=CACHED_FIELDS
+                + [f"{track}_trajectory" for track in self.tracks],
+            )
+        }
+        results = {}
+        for net_hash, entry in hits.items():
+            document = documents.get(entry["_id"])
+            if document is None:
+                self.entries.pop(entry["key"], None)
+                continue
+            del document["_id"]
+            document.update(
+                {
+                    "cached_from": entry["_id"],
+                    "evaluated_generation": entry["evaluated_generation"],
+                    "evaluated_at": entry["evaluated_at"],
+                }
+            )
+            results[net_hash] = document
+        return results
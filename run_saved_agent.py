@@ -11,6 +11,7 @@ from typing import List, Union, Dict, Any
 import numpy as np
 import pymongo
 
+from serverpool import ServerPool
 from shellracebot import ShellBot
 
 fps = 28
@@ -68,27 +69,14 @@ individual_num = genome["individual_num"]
 species = genome["species"]
 tracks = genome["tracks"]
 trial = genome["trial"]
+server_pool = ServerPool(fps=fps)
 print(f'Running genome {individual_num} in generation {generation} from trial {trial} on {tracks}!')
 for track_num, track in enumerate(tracks):
     eval_length = 10
     with open(f'{track}.json') as f:
         track_info = json.load(f)
         eval_length += track_info["target_time"]
-    port_num = randint(49152, 65535)
-    print(f"Starting Server on {port_num}! Track: {track}")
-    server = subprocess.Popen(
-        [
-            "./xpilots",
-            "-map", f"{track}.xp",
-            "-noQuit",
-            "-maxClientsPerIP", "500",
-            "-password", "test",
-            "-worldlives", "999",
-            "-fps", f"{fps}",
-            "-contactPort", f"{port_num}",
-        ]
-    )
-    sleep(3)
+    port_num = server_pool.get_port(track)
     print("Starting Bot!")
     bot = subprocess.Popen(
         [
@@ -100,18 +88,12 @@ for track_num, track in enumerate(tracks):
             "-eval_length", f"{eval_length}",
         ]
     )
-    sleep(1)
     print("Waiting for Bot to finish!")
     bot_return_code = bot.wait()
-    sleep(1)
     print(f"Bot finished with return code {bot_return_code}!")
+    server_pool.stop_server(track)
+    print("Server killed!")
     if bot_return_code != 0:
-        server.kill()
-        server.wait()
-        print("Server killed!")
         raise Exception("Bot Error!")
-    server.kill()
-    sleep(1)
-    print("Server killed!")
     print(f"=== Finished Track {track_num + 1}/{len(tracks)} ===")
 print("=== Finished Test Successfully ===")
@@ -0,0 +1,168 @@
+"""
+sensors builds ShellBot's network inputs in one preallocated buffer that is reused every frame
+
+Each sensor is a stage that writes its normalized values into its own slice of the buffer, in the order the
+networks were trained on (num_inputs = 23 in config2 to config4):
+
+    0      speed
+    1      track wall
+    2      tracking angle
+    3      closest wall
+    4      closest wall angle
+    5-12   wall feelers: front, back, left, right, 15 right, 15 left, 30 right, 30 left
+    13     time to wall along tracking
+    14     time to the retro point
+    15-16  last thrust and turn
+    17-22  distance and bearing to the next three checkpoints
+"""
+
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+## ShellBot only scans for the closest wall when this is on, the networks trained so far saw the defaults below
+SCAN_CLOSEST_WALL = False
+CLOSEST_WALL = 0
+CLOSEST_WALL_HEADING = 0
+CLOSEST_WALL_DEGREES = list(range(0, 360, 30))
+
+
+class Sensor:
+
+    def __init__(
+        self, name: str, width: int, fill: Callable[[Any, np.ndarray], None]
+    ) -> None:
+        """__init__ A stage of the observation pipeline
+
+        Args:
+            name (str): Name used when reporting the stage's cost
+            width (int): Number of inputs the stage writes
+            fill (Callable[[Any, np.ndarray], None]): Writes the bot's normalized values into the given slice
+        """
+        self.name = name
+        self.width = width
+        self.fill = fill
+
+
+def fill_speed(bot: Any, out: np.ndarray) -> None:
+    out[0] = bot.speed / 20.0
+
+
+def fill_track_wall(bot: Any, out: np.ndarray) -> None:
+    out[0] = 1.0 - (float(bot.track_wall) / float(bot.scan_distance))
+
+
+def fill_tracking(bot: Any, out: np.ndarray) -> None:
+    out[0] = bot.angle_diff(bot.heading, bot.tracking) / 180.0
+
+
+def fill_closest_wall(bot: Any, out: np.ndarray) -> None:
+    out[0] = 1.0 - (float(bot.closest_wall) / float(bot.scan_distance))
+    out[1] = bot.angle_diff(bot.heading, bot.closest_wall_heading) / 180.0
+
+
+def fill_walls(bot: Any, out: np.ndarray) -> None:
+    scan_distance = float(bot.scan_distance)
+    out[0] = 1.0 - (float(bot.wall_front) / scan_distance)
+    out[1] = 1.0 - (float(bot.wall_back) / scan_distance)
+    out[2] = 1.0 - (float(bot.wall_left) / scan_distance)
+    out[3] = 1.0 - (float(bot.wall_right) / scan_distance)
+    out[4] = 1.0 - (float(bot.wall_15_right) / scan_distance)
+    out[5] = 1.0 - (float(bot.wall_15_left) / scan_distance)
+    out[6] = 1.0 - (float(bot.wall_30_right) / scan_distance)
+    out[7] = 1.0 - (float(bot.wall_30_left) / scan_distance)
+
+
+def fill_tt_tracking(bot: Any, out: np.ndarray) -> None:
+    out[0] = max(1.0 - (bot.tt_tracking / 140.0), 0.0)
+
+
+def fill_tt_retro_point(bot: Any, out: np.ndarray) -> None:
+    out[0] = max(1.0 - (bot.tt_retro_point / 70.0), 0.0)
+
+
+def fill_last_action(bot: Any, out: np.ndarray) -> None:
+    out[0] = bot.last_thrust
+    out[1] = bot.last_turn
+
+
+def fill_checkpoints(bot: Any, out: np.ndarray) -> None:
+    scan_distance = float(bot.scan_distance)
+    for idx, (dist, bearing) in enumerate(
+        zip(bot.checkpoint_distances, bot.checkpoint_bearings)
+    ):
+        out[idx * 2] = 1.0 - (float(dist) / scan_distance)
+        out[idx * 2 + 1] = bearing / 180.0
+
+
+DEFAULT_SENSORS = [
+    Sensor("speed", 1, fill_speed),
+    Sensor("track_wall", 1, fill_track_wall),
+    Sensor("tracking", 1, fill_tracking),
+    Sensor("closest_wall", 2, fill_closest_wall),
+    Sensor("walls", 8, fill_walls),
+    Sensor("tt_tracking", 1, fill_tt_tracking),
+    Sensor("tt_retro_point", 1, fill_tt_retro_point),
+    Sensor("last_action", 2, fill_last_action),
+    Sensor("checkpoints", 6, fill_checkpoints),
+]
+
+
+class ObservationPipeline:
+
+    profile: bool = False
+
+    def __init__(self, sensors: Optional[List[Sensor]] = None) -> None:
+        self.sensors = sensors if sensors is not None else DEFAULT_SENSORS
+        self.size = sum(sensor.width for sensor in self.sensors)
+        self.buffer = np.zeros(self.size)
+        self.nan_mask = np.zeros(self.size, dtype=bool)
+
+        ## Views into the buffer are made once so stages write in place
+        self.views = []
+        start = 0
+        for sensor in self.sensors:
+            self.views.append(self.buffer[start : start + sensor.width])
+            start += sensor.width
+        self.stage_ns = np.zeros(len(self.sensors), dtype=np.int64)
+        self.calls = 0
+
+    def observe(self, bot: Any) -> np.ndarray:
+        """observe Fills the buffer with the bot's observations for this frame
+
+        Args:
+            bot (Any): The ShellBot being observed
+
+        Returns:
+            np.ndarray: The shared buffer, only valid until the next call
+        """
+        if self.profile:
+            for idx, (sensor, view) in enumerate(zip(self.sensors, self.views)):
+                start = perf_counter_ns()
+                sensor.fill(bot, view)
+                self.stage_ns[idx] += perf_counter_ns() - start
+            self.calls += 1
+        else:
+            for sensor, view in zip(self.sensors, self.views):
+                sensor.fill(bot, view)
+
+        ## NaN reads as a wall at point blank, everything else is clamped to [-1, 1]
+        np.isnan(self.buffer, out=self.nan_mask)
+        np.copyto(self.buffer, 1.0, where=self.nan_mask)
+        np.clip(self.buffer, -1.0, 1.0, out=self.buffer)
+        return self.buffer
+
+    def stage_costs(
+        self,
+    ) -> Dict[str, float]:
+        """stage_costs Average time each sensor took per frame while profiling
+
+        Returns:
+            Dict[str, float]: Microseconds per frame by sensor name
+        """
+        calls = max(self.calls, 1)
+        return {
+            sensor.name: round(int(cost) / calls / 1000.0, 2)
+            for sensor, cost in zip(self.sensors, self.stage_ns)
+        }
@@ -0,0 +1,111 @@
+"""
+serverpool keeps one warm xpilots server per track so workers don't pay a server start for every evaluation
+"""
+
+import socket
+import subprocess
+from datetime import datetime
+from random import randint
+from time import sleep
+from typing import Dict, Tuple
+
+
+def is_port_bound(port: int) -> bool:
+    """is_port_bound Checks whether something on this machine is already listening on a UDP port
+
+    Args:
+        port (int): Port to check
+
+    Returns:
+        bool: True if the port is taken
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(("", port))
+        except OSError:
+            return True
+    return False
+
+
+class ServerPool:
+
+    servers: Dict[str, Tuple[subprocess.Popen, int]] = {}
+    startup_timeout: float = 10.0
+
+    def __init__(self, fps: int = 28, log_prefix: str = "") -> None:
+        self.fps = fps
+        self.log_prefix = log_prefix
+        self.servers = {}
+
+    def get_port(self, track: str) -> int:
+        """get_port Returns the contact port of the track's server, starting it if it isn't running
+
+        Args:
+            track (str): Track name without the .xp extension
+
+        Returns:
+            int: Contact port to join on
+        """
+        if track in self.servers:
+            server, port = self.servers[track]
+            if server.poll() is None:
+                return port
+            print(
+                f"{self.log_prefix} === Server for {track} exited with code {server.returncode}, restarting!"
+            )
+            del self.servers[track]
+        return self.start_server(track)
+
+    def start_server(self, track: str) -> int:
+        port_num = randint(49152, 65535)
+        while is_port_bound(port_num):
+            port_num = randint(49152, 65535)
+        print(f"{self.log_prefix} === Starting Server on {port_num}! Track: {track}")
+        server = subprocess.Popen(
+            [
+                "./xpilots",
+                "-map",
+                f"{track}.xp",
+                "-noQuit",
+                "-maxClientsPerIP",
+                "500",
+                "-password",
+                "test",
+                "-worldlives",
+                "999",
+                "-fps",
+                f"{self.fps}",
+                "-contactPort",
+                f"{port_num}",
+            ]
+        )
+        self.servers[track] = (server, port_num)
+        self.wait_until_ready(track)
+        return port_num
+
+    def wait_until_ready(self, track: str) -> None:
+        """wait_until_ready Blocks until the server has bound its contact port"""
+        server, port = self.servers[track]
+        start_time = datetime.now()
+        while not is_port_bound(port):
+            if server.poll() is not None:
+                del self.servers[track]
+                raise Exception(f"Server for {track} exited during startup!")
+            if (datetime.now() - start_time).total_seconds() > self.startup_timeout:
+                self.stop_server(track)
+                raise Exception(f"Server for {track} did not start!")
+            sleep(0.05)
+
+    def stop_server(self, track: str) -> None:
+        server, _ = self.servers.pop(track)
+        server.terminate()
+        try:
+            server.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    def close(
+        self,
+    ) -> None:
+        for track in list(self.servers.keys()):
+            self.stop_server(track)
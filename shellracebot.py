@@ -4,6 +4,7 @@ Author: Nicholas Lorentzen
 Date: 20220607
 """
 
+import copy
 import json
 import math
 import pickle
@@ -14,13 +15,27 @@ from random import randint, random
 from sys import exc_info
 from time import sleep
 from traceback import format_exception
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import libpyAI as ai
 import numpy as np
 from neat import nn
 
+import frameprofiler
 from consoleutils import delete_last_lines, get_bar_graph
+from dashboard import Dashboard, has_tty
+from frameprofiler import FrameProfiler, NullProfiler
+from sensors import (
+    CLOSEST_WALL,
+    CLOSEST_WALL_DEGREES,
+    CLOSEST_WALL_HEADING,
+    SCAN_CLOSEST_WALL,
+    ObservationPipeline,
+)
+from termination import TerminationPolicy
+from trackcompiler import FeelerProvider, load_track
+from trackindex import TrackIndex
+from trajectory import TrajectoryRecorder
 from xpracefitness import get_fitness
 
 
@@ -37,8 +52,11 @@ class ShellBot(threading.Thread):
     headless: bool = False
     gamemap: str = ""
     test_mode: bool = False
+    frame_clock: bool = False
     show_info: bool = False
     just_printed_info: bool = False
+    dashboard: Optional[Dashboard] = None
+    dashboard_rate: float = 2.0
     human: bool = False
 
     ## Neat Info
@@ -46,7 +64,8 @@ class ShellBot(threading.Thread):
     exploration_rate = 0.02
     cum_bonus = 0.0
     max_thrust_val = -999
-    last_observations = np.zeros(22).tolist()
+    last_observations = np.zeros(23)
+    observation_pipeline: ObservationPipeline
 
     ## Racing Info
     completed_course: bool = False
@@ -56,6 +75,8 @@ class ShellBot(threading.Thread):
     circuit: bool = False
     start_time: datetime = datetime.now()
     course_time: float = -1.0
+    ## Course time frozen when a dashboard snapshot is taken, None on the live bot
+    snapshot_course_time: Optional[float] = None
     course_frames: int = -1
     average_speed: float = 0.0
     cum_speed: float = 0.0
@@ -93,6 +114,19 @@ class ShellBot(threading.Thread):
     reset_time: datetime = datetime.now()
     ask_for_perms = False
     frame_rate: float = 28.0
+    game_fps: float = 28.0
+    frame_limit: int = 0
+    profiler: FrameProfiler = NullProfiler()
+    ## Only one client per server sends /reset all, the others wait to be respawned by it
+    lead_reset: bool = True
+    awaiting_round_reset: bool = False
+
+    ## Signals for the controlling thread, created per bot in __init__
+    connected: threading.Event
+    perms_granted: threading.Event
+    reset_complete: threading.Event
+    episode_done: threading.Event
+    round_armed: threading.Event
 
     ## State of the bot
     alive: float = 0.0
@@ -115,21 +149,25 @@ class ShellBot(threading.Thread):
     wall_right: float = 1000
     wall_back: float = 1000
     track_wall: float = 1000
-    closest_wall: float = 0
-    closest_wall_heading: int = 0
+    closest_wall: float = CLOSEST_WALL
+    closest_wall_heading: int = CLOSEST_WALL_HEADING
     tt_retro: float = 140.0
     tt_tracking: float = 140.0
     tt_retro_point: float = 140.0
+    feeler_offsets: List[int] = [0, 180, 90, -90, 15, -15, 30, -30]
+    feeler_provider: Optional[FeelerProvider] = None
 
     ## Track Info
     checkpoints: List[List[int]] = [[0, 0]]
-    course_length_list: List[float] = [0.0]
+    track_index: TrackIndex
+    next_checkpoint: int = 0
+    checkpoint_distances: List[float] = [0.0, 0.0, 0.0]
+    checkpoint_bearings: List[float] = [0.0, 0.0, 0.0]
 
     ## Logging Info
     adv_log: bool = False
-    xs: List[int] = []
-    ys: List[int] = []
-    headings: List[int] = []
+    recorder: Optional[TrajectoryRecorder] = None
+    termination: Optional[TerminationPolicy] = None
 
     def __init__(
         self,
@@ -139,6 +177,11 @@ class ShellBot(threading.Thread):
         headless: bool = False,
         human: bool = False,
         adv_log: bool = False,
+        precomputed_feelers: bool = False,
+        frame_clock: bool = False,
+        dashboard_rate: float = 2.0,
+        adv_log_frames: int = 0,
+        adv_log_stride: int = 1,
     ) -> None:
         super(ShellBot, self).__init__()
         self.username = username
@@ -148,6 +191,13 @@ class ShellBot(threading.Thread):
         self.headless = headless
         self.human = human
         self.adv_log = adv_log
+        self.frame_clock = frame_clock
+        self.dashboard_rate = dashboard_rate
+        self.connected = threading.Event()
+        self.perms_granted = threading.Event()
+        self.reset_complete = threading.Event()
+        self.episode_done = threading.Event()
+        self.round_armed = threading.Event()
         with open(f"{self.gamemap}.json", "r") as f:
             map_data = json.load(f)
             self.checkpoints = map_data["checkpoints"]
@@ -160,11 +210,21 @@ class ShellBot(threading.Thread):
                     print("Circuit Mode Detected")
             else:
                 self.finish_marker = map_data["finish_marker"]
-            self.course_length_list = [0.0 for _ in self.checkpoints]
             if "starting_heading" in map_data:
                 self.starting_heading = map_data["starting_heading"]
             else:
                 self.starting_heading = 90
+        self.track_index = TrackIndex(self.gamemap)
+        self.observation_pipeline = ObservationPipeline()
+        if self.adv_log:
+            ## Without a frame budget assume the usual evaluation length of target time plus 10 seconds
+            if not adv_log_frames:
+                adv_log_frames = int((self.target_time + 10) * self.game_fps)
+            self.recorder = TrajectoryRecorder(adv_log_frames, adv_log_stride)
+        ## Exact against the map's geometry, but the server rounds its own feelers, so evaluations that
+        ## produce fitness leave this off and ask ai.wallFeeler
+        if precomputed_feelers:
+            self.feeler_provider = load_track(self.gamemap)
 
     ## For Interfacing with the Environment
     def run(
@@ -184,14 +244,33 @@ class ShellBot(threading.Thread):
     def reset(
         self,
     ) -> None:
+        self.reset_complete.clear()
+        self.episode_done.clear()
+        self.round_armed.clear()
         self.reset_now = True
 
     def close_bot(
         self,
     ) -> None:
         self.close_now = True
+        if self.dashboard is not None:
+            self.dashboard.stop()
         ai.quitAI()
 
+    def wait_for(self, event: threading.Event, timeout: float, name: str) -> None:
+        """wait_for Blocks the calling thread until the bot signals an event
+
+        Args:
+            event (threading.Event): One of connected, perms_granted, reset_complete or episode_done
+            timeout (float): Seconds to wait before giving up
+            name (str): What is being waited on, used in the error
+
+        Raises:
+            Exception: If the event was not set in time
+        """
+        if not event.wait(timeout):
+            raise Exception(f"Timed out waiting for {name}!")
+
     def reset_values(
         self,
     ) -> None:
@@ -212,14 +291,23 @@ class ShellBot(threading.Thread):
         self.reset_time = datetime.now()
         self.frame_rate = 28.0
         self.current_checkpoint = 0
+        self.profiler.reset()
+        if self.recorder is not None:
+            self.recorder.reset()
+        if self.termination is not None:
+            self.termination.reset()
+        self.episode_done.clear()
+        self.reset_complete.set()
 
     def run_loop(
         self,
     ) -> None:
         ##print(f"Bot starting frame {self.frame}")
+        frame_start = self.profiler.begin()
         if not self.human or self.frame == 0:
             self.reset_flags()
         self.frame += 1
+        self.connected.set()
 
         try:
             ai.setTurnSpeedDeg(self.turnspeed)
@@ -227,6 +315,17 @@ class ShellBot(threading.Thread):
             if self.ask_for_perms:
                 ai.talk("/password test")
                 self.ask_for_perms = False
+                ## The server grants operator rights as soon as it sees the password
+                self.perms_granted.set()
+            if self.awaiting_round_reset:
+                ## Armed once alive, so joining before the first spawn isn't mistaken for the reset
+                if float(ai.selfAlive()) == 1.0:
+                    self.round_armed.set()
+                elif self.round_armed.is_set():
+                    ## Killed by the round reset, from here on the same as sending it
+                    self.awaiting_round_reset = False
+                    self.reset_frame = self.frame
+                return
             if (
                 self.alive == 1.0
                 and self.awaiting_reset
@@ -241,7 +340,10 @@ class ShellBot(threading.Thread):
                 self.turnspeed = 20
             if self.reset_now:
                 self.reset_now = False
-                ai.talk("/reset all")
+                if self.lead_reset:
+                    ai.talk("/reset all")
+                else:
+                    self.awaiting_round_reset = True
                 self.alive = 0.0
                 self.last_alive = 0.0
                 self.awaiting_reset = True
@@ -256,7 +358,9 @@ class ShellBot(threading.Thread):
             self.check_done()
             self.set_action()
             if not self.human:
+                span_start = self.profiler.begin()
                 self.perform_action()
+                self.profiler.end(frameprofiler.PERFORM_ACTION, span_start)
             if self.adv_log:
                 self.adv_logger()
             ai.setPowerLevel(self.power_level)
@@ -268,25 +372,78 @@ class ShellBot(threading.Thread):
             if self.test_mode:
                 raise e
         self.calculate_bonus()
+        if not self.awaiting_reset and (
+            self.done or (self.frame_limit and self.frame >= self.frame_limit)
+        ):
+            self.episode_done.set()
 
-        if self.test_mode or self.show_info:
+        span_start = self.profiler.begin()
+        if self.test_mode:
             self.print_info()
+        elif self.show_info and self.start_dashboard():
+            if self.dashboard.wants_snapshot:
+                self.dashboard.submit(self.snapshot())
         else:
             self.just_printed_info = False
+            if self.dashboard is not None:
+                self.dashboard.clear()
+        self.profiler.end(frameprofiler.PRINT_INFO, span_start)
         self.last_alive = self.alive
         self.frame_rate = (
             self.frame / (datetime.now() - self.reset_time).total_seconds()
         )
+        self.profiler.end(frameprofiler.FRAME, frame_start)
+
+    def start_dashboard(
+        self,
+    ) -> bool:
+        """start_dashboard Starts the dashboard thread the first time info is shown
+
+        Returns:
+            bool: Whether there is a dashboard to draw on
+        """
+        if self.dashboard is None and not self.close_now:
+            ## Headless workers only draw the dashboard when someone is watching the terminal
+            if self.dashboard_rate > 0 and (not self.headless or has_tty()):
+                self.dashboard = Dashboard(self.dashboard_rate)
+                self.dashboard.start()
+            else:
+                self.dashboard_rate = 0
+        return self.dashboard is not None
+
     def adv_logger(self,) -> None:
-        self.xs.append(self.x)
-        self.ys.append(self.y)
-        self.headings.append(self.heading)
+        self.recorder.record(
+            self.frame,
+            self.x,
+            self.y,
+            self.heading,
+            self.speed,
+            self.thrust_val,
+            self.turn_val,
+        )
+
+    def snapshot(
+        self,
+    ) -> "ShellBot":
+        """snapshot Copy of the bot for the dashboard thread, owning its buffers and with the course time of this frame"""
+        snapshot = copy.copy(self)
+        ## The observation pipeline fills last_observations in place every frame
+        snapshot.last_observations = self.last_observations.copy()
+        snapshot.snapshot_course_time = self.get_course_time()
+        return snapshot
 
     def print_info(
         self,
     ) -> None:
         if self.just_printed_info:
             delete_last_lines(14)
+        print(self.format_info())
+        self.just_printed_info = True
+
+    def format_info(
+        self,
+    ) -> str:
+        """format_info Builds the telemetry readout, also called by the dashboard thread on a snapshot of the bot"""
         feeler_view = []
         for row in range(0, 11):
             blank_row = []
@@ -335,9 +492,10 @@ class ShellBot(threading.Thread):
 
         # feeler_view[10 - checkpoint_y_diff][10 + checkpoint_x_diff] = "*"
 
-        current_coursetime = round(
-            (datetime.now() - self.start_time).total_seconds(), 3
-        )
+        if self.snapshot_course_time is not None:
+            current_coursetime = round(self.snapshot_course_time, 3)
+        else:
+            current_coursetime = round(self.get_course_time(), 3)
 
         time_readout = f" Current Lap Time: {current_coursetime:6}s"
         completion_readout = f"    {get_bar_graph(self.completion / 100.0)}    - Course Completion: {self.completion / 100.0:.2%}"
@@ -420,82 +578,15 @@ class ShellBot(threading.Thread):
         for idx in range(0, len(feeler_view[0])):
             output += "─"
         output += "┘\n"
-
-        print(output)
-        self.just_printed_info = True
+        return output
 
     def get_observations(
         self,
-    ) -> List[float]:
-        ## Normalize the values
-        wall_track = 1.0 - (float(self.track_wall) / float(self.scan_distance))
-        closest_wall = 1.0 - (float(self.closest_wall) / float(self.scan_distance))
-        wall_front = 1.0 - (float(self.wall_front) / float(self.scan_distance))
-        wall_left = 1.0 - (float(self.wall_left) / float(self.scan_distance))
-        wall_right = 1.0 - (float(self.wall_right) / float(self.scan_distance))
-        wall_back = 1.0 - (float(self.wall_back) / float(self.scan_distance))
-        wall_30_right = 1.0 - (float(self.wall_30_right) / float(self.scan_distance))
-        wall_30_left = 1.0 - (float(self.wall_30_left) / float(self.scan_distance))
-        wall_15_right = 1.0 - (float(self.wall_15_right) / float(self.scan_distance))
-        wall_15_left = 1.0 - (float(self.wall_15_left) / float(self.scan_distance))
-
-        ship_speed = self.speed / 20.0
-
-        tt_tracking = max(1.0 - (self.tt_tracking / 140.0), 0.0)
-        tt_retro_point = max(1.0 - (self.tt_retro_point / 70.0), 0.0)
-        angle_diff_tracking = self.angle_diff(self.heading, self.tracking) / 180.0
-        angle_diff_closest = (
-            self.angle_diff(self.heading, self.closest_wall_heading) / 180.0
-        )
-
-        self.current_checkpoint = self.get_current_checkpoint()
-
-        checkpoint_info = []
-        first_checkpoint = True
-        for checkpoint_num in range(
-            self.current_checkpoint, self.current_checkpoint + 3
-        ):
-            dist, angle = self.get_checkpoint_info(checkpoint_num)
-            dist = 1.0 - (float(dist) / float(self.scan_distance))
-            if first_checkpoint:
-                ##print(f"Checkpoint Bearing: {self.angle_diff(self.heading, angle)}")
-                first_checkpoint = False
-            angle = self.angle_diff(self.heading, angle) / 180.0
-            checkpoint_info.append(dist)
-            checkpoint_info.append(angle)
-
-        ## Organize the values
-        oberservations = [
-            ship_speed,
-            wall_track,
-            angle_diff_tracking,
-            closest_wall,
-            angle_diff_closest,
-            wall_front,
-            wall_back,
-            wall_left,
-            wall_right,
-            wall_15_right,
-            wall_15_left,
-            wall_30_right,
-            wall_30_left,
-            tt_tracking,
-            tt_retro_point,
-            self.last_thrust,
-            self.last_turn,
-        ]
-        oberservations.extend(checkpoint_info)
-
-        ## Check Normalization
-        for idx in range(0, len(oberservations)):
-            num = oberservations[idx]
-            if math.isnan(num):
-                num = 1.0
-            num = min(num, 1.0)
-            num = max(num, -1.0)
-            oberservations[idx] = num
-        self.last_observations = oberservations
-        return oberservations
+    ) -> np.ndarray:
+        """get_observations Writes this frame's normalized inputs into the observation buffer and returns it"""
+        self.current_checkpoint = self.next_checkpoint
+        self.last_observations = self.observation_pipeline.observe(self)
+        return self.last_observations
 
     def sigmoid_activation(self, x: np.ndarray) -> np.ndarray:
         return 1 / (1 + np.exp(-x))
@@ -510,14 +601,17 @@ class ShellBot(threading.Thread):
         self,
     ) -> None:
         ## Get the observations
+        span_start = self.profiler.begin()
         observations = self.get_observations()
+        self.profiler.end(frameprofiler.OBSERVATIONS, span_start)
 
         ## Forward Propogation
-        inputs = np.array(observations)
+        span_start = self.profiler.begin()
         if not self.test_mode:
-            outputs = self.nn.activate(inputs)
+            outputs = self.nn.activate(observations)
         else:
             outputs = [0, 0]
+        self.profiler.end(frameprofiler.ACTIVATION, span_start)
 
         self.thrust_val = outputs[0]
         self.turn_val = outputs[1]
@@ -578,69 +672,14 @@ class ShellBot(threading.Thread):
     def get_total_course_length(self, idx: int = len(checkpoints) - 1) -> float:
         if idx <= 0:
             return 0.0
-        if self.course_length_list[idx] != 0.0:
-            return self.course_length_list[idx]
-        total_length = self.get_total_course_length(idx - 1)
-        total_length += self.get_distance(
-            self.checkpoints[idx - 1][0],
-            self.checkpoints[idx - 1][1],
-            self.checkpoints[idx][0],
-            self.checkpoints[idx][1],
-        )
-        self.course_length_list[idx] = total_length
-        return total_length
+        return self.track_index.course_length_list[idx]
 
     def get_completion_percent(
         self,
     ) -> float:
-        if (not self.circuit and self.y >= self.finish_marker) or self.completed_course:
-            return 100.0
-
-        percent_per_checkpt = 100.0 / float(len(self.checkpoints) - 1)
-        checkpt_idx = self.get_current_checkpoint() - 1
-
-        if not self.circuit:
-            try:
-                if self.checkpoints[checkpt_idx + 1][1] >= self.finish_marker:
-                    percentage = 100.0 - percent_per_checkpt
-                    diff_finish = self.finish_marker - self.checkpoints[checkpt_idx][1]
-                    percent_to_finish = max(
-                        min(
-                            diff_finish - (self.finish_marker - self.y) / diff_finish,
-                            1.0,
-                        ),
-                        0.0,
-                    )
-                    percentage += percent_to_finish * percent_per_checkpt
-                    percentage = max(min(round(percentage, 3), 99.999), 0.1)
-                    return percentage
-            except:
-                print("Error in get_completion_percent")
-
-        percent_per_unit = 100.0 / self.get_total_course_length(
-            len(self.checkpoints) - 1
-        )
-
-        base_percentage = percent_per_unit * self.get_total_course_length(checkpt_idx)
-        distance_to_checkpt = self.get_distance(
-            self.x,
-            self.y,
-            self.checkpoints[checkpt_idx + 1][0],
-            self.checkpoints[checkpt_idx + 1][1],
-        )
-        distance_btw_checkpt = (
-            self.get_distance(
-                self.checkpoints[checkpt_idx][0],
-                self.checkpoints[checkpt_idx][1],
-                self.checkpoints[min(checkpt_idx + 1, len(self.checkpoints) - 1)][0],
-                self.checkpoints[min(checkpt_idx + 1, len(self.checkpoints) - 1)][1],
-            )
-            - 120.0
-        )
-        percent_to_next = (
-            distance_btw_checkpt - distance_to_checkpt
-        ) * percent_per_unit
-        return max(min(round(base_percentage + percent_to_next, 3), 99.999), 0.1)
+        return self.track_index.query(
+            self.x, self.y, self.current_checkpoint, self.heading, self.completed_course
+        )[1]
 
     def perform_action(
         self,
@@ -681,8 +720,7 @@ class ShellBot(threading.Thread):
                 self.completed_course = True
                 self.done = True
                 self.completion = 100.0
-                course_time = datetime.now() - self.start_time
-                self.course_time = course_time.total_seconds()
+                self.course_time = self.get_course_time()
                 self.cause_of_death = "Completed"
                 self.course_frames = self.frame
                 ##print(f"Bot completed course in {round(self.course_time, 3)} seconds")
@@ -699,8 +737,7 @@ class ShellBot(threading.Thread):
                     self.done = True
                     self.completion = 100.0
                     self.completed_course = True
-                    course_time = datetime.now() - self.start_time
-                    self.course_time = course_time.total_seconds()
+                    self.course_time = self.get_course_time()
                     self.course_frames = self.frame
                     self.cause_of_death = "Completed"
                     ##print(f"Bot completed course in {round(self.course_time, 3)} seconds")
@@ -708,44 +745,35 @@ class ShellBot(threading.Thread):
             self.done = True
             self.cause_of_death = "Collision"
             self.course_time = -1.0
+        ## Episodes that are clearly going nowhere end early with the rule's own autopsy
+        if self.termination is not None and not self.done and not self.awaiting_reset:
+            cause = self.termination.update(
+                np.zeros(1, dtype=int),
+                self.frame,
+                self.completion,
+                self.last_thrust,
+                self.speed,
+                self.heading,
+            )[0]
+            if cause:
+                self.done = True
+                self.cause_of_death = cause
+
+    def get_course_time(
+        self,
+    ) -> float:
+        """get_course_time Returns the time since the episode started, in game frames when using the frame clock"""
+        if self.frame_clock:
+            return self.frame / self.game_fps
+        return (datetime.now() - self.start_time).total_seconds()
 
     def get_current_checkpoint(
         self,
     ) -> int:
         """get_current_checkpoint Returns the current checkpoint"""
-        check_dists = []
-        for checkpoint in self.checkpoints[
-            max(0, self.current_checkpoint - 2) : min(
-                len(self.checkpoints), self.current_checkpoint + 3
-            )
-        ]:
-            check_dists.append(
-                self.get_distance(self.x, self.y, checkpoint[0], checkpoint[1])
-            )
-
-        closest_check_dist_idx = int(np.argmin(check_dists))
-        closest_idx = int(closest_check_dist_idx + max(self.current_checkpoint - 2, 0))
-        dist_to_closest = check_dists[closest_check_dist_idx]
-        closest_wpt = self.checkpoints[closest_idx]
-
-        next_wpt = self.checkpoints[min(closest_idx + 1, len(check_dists) - 1)]
-        dist_to_next = self.get_distance(self.x, self.y, next_wpt[0], next_wpt[1])
-
-        dist_btw_next = self.get_distance(
-            closest_wpt[0], closest_wpt[1], next_wpt[0], next_wpt[1]
-        )
-
-        if dist_to_closest < 120.0 or (
-            dist_to_next < dist_btw_next + 50.0
-            and closest_idx < len(self.checkpoints) - 1
-        ):
-            closest_idx += 1
-
-        return max(min(closest_idx, len(self.checkpoints) - 1), 0)
-
-        # for idx, checkpoint in enumerate(self.checkpoints):
-        #     if self.y + 40 > checkpoint[1]:
-        #         return idx + 1
+        return self.track_index.query(
+            self.x, self.y, self.current_checkpoint, self.heading, self.completed_course
+        )[0]
 
     def get_checkpoint_info(self, checkpoint_idx: int) -> tuple:
         """get_checkpoint_info gets information about the checkpoint
@@ -800,29 +828,36 @@ class ShellBot(threading.Thread):
         self.y_vel = ai.selfVelY()
 
         ## Walls
-        self.track_wall = ai.wallFeeler(self.scan_distance, self.tracking)
-        self.wall_front = self.get_average_wall_distance(int(self.heading))
-        self.wall_back = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, 180))
-        )
-        self.wall_left = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, 90))
-        )
-        self.wall_right = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, -90))
-        )
-        self.wall_15_left = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, 15))
-        )
-        self.wall_15_right = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, -15))
-        )
-        self.wall_30_left = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, 30))
-        )
-        self.wall_30_right = self.get_average_wall_distance(
-            int(self.angle_add(self.heading, -30))
-        )
+        span_start = self.profiler.begin()
+        if self.feeler_provider is not None:
+            self.collect_walls()
+        else:
+            self.track_wall = ai.wallFeeler(self.scan_distance, self.tracking)
+            self.wall_front = self.get_average_wall_distance(int(self.heading))
+            self.wall_back = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, 180))
+            )
+            self.wall_left = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, 90))
+            )
+            self.wall_right = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, -90))
+            )
+            self.wall_15_left = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, 15))
+            )
+            self.wall_15_right = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, -15))
+            )
+            self.wall_30_left = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, 30))
+            )
+            self.wall_30_right = self.get_average_wall_distance(
+                int(self.angle_add(self.heading, -30))
+            )
+        if SCAN_CLOSEST_WALL:
+            self.update_closest_wall()
+        self.profiler.end(frameprofiler.FEELERS, span_start)
 
         ## Timings
         self.tt_tracking = math.ceil(float(self.track_wall) / (self.speed + 0.0000001))
@@ -835,8 +870,41 @@ class ShellBot(threading.Thread):
             70.0,
         )
 
+        span_start = self.profiler.begin()
         self.last_completion = self.completion
-        self.completion = self.get_completion_percent()
+        ## One lookup covers completion now and the checkpoint observations in set_action
+        (
+            self.next_checkpoint,
+            self.completion,
+            self.checkpoint_distances,
+            self.checkpoint_bearings,
+        ) = self.track_index.query(
+            self.x, self.y, self.current_checkpoint, self.heading, self.completed_course
+        )
+        self.profiler.end(frameprofiler.COMPLETION, span_start)
+
+    def collect_walls(
+        self,
+    ) -> None:
+        """collect_walls Answers every feeler for the frame with one call to the feeler provider"""
+        headings = [int(self.angle_add(self.heading, offset)) for offset in self.feeler_offsets]
+        angles = [self.tracking]
+        for heading in headings:
+            angles.extend([heading - 5, heading])
+        walls = self.feeler_provider.feelers(self.x, self.y, angles, self.scan_distance)
+        self.track_wall = int(walls[0])
+        ## Two feelers per direction divided by three, same as get_average_wall_distance
+        averages = (walls[1::2] + walls[2::2]) / 3.0
+        (
+            self.wall_front,
+            self.wall_back,
+            self.wall_left,
+            self.wall_right,
+            self.wall_15_left,
+            self.wall_15_right,
+            self.wall_30_left,
+            self.wall_30_right,
+        ) = averages.tolist()
 
     ##Utility Functions
     def update_closest_wall(
@@ -845,8 +913,14 @@ class ShellBot(threading.Thread):
         """update_closest_wall Updates the closest wall distance and heading"""
         self.closest_wall = self.scan_distance
         self.closest_wall_heading = -1
-        for degree in range(0, 360, 30):
-            wall = ai.wallFeeler(self.scan_distance, degree)
+        degrees = CLOSEST_WALL_DEGREES
+        if self.feeler_provider is not None:
+            walls = self.feeler_provider.feelers(
+                self.x, self.y, degrees, self.scan_distance
+            ).tolist()
+        else:
+            walls = [ai.wallFeeler(self.scan_distance, degree) for degree in degrees]
+        for degree, wall in zip(degrees, walls):
             if wall < self.closest_wall:
                 self.closest_wall = wall
                 self.closest_wall_heading = degree
@@ -0,0 +1,184 @@
+"""
+stagedeval evaluates a generation one track at a time and only sends the promising genomes on to later tracks
+
+Every genome is published with stage_tracks = [0]. Once the whole generation has finished a stage, the
+stage policy looks at what each survivor scored so far and promotes the ones worth another track, which
+go back in the queue with the next track as their stage_tracks. Genomes that aren't promoted keep their
+results and get an imputed fitness for the tracks they skipped. With a quantile of 0.5 this is successive
+halving over the track list.
+
+Policies are looked up by name in POLICIES so a different rule can be plugged in from the manager config:
+
+    policy = make_policy("quantile", {"metric": "completion", "quantile": 0.5})
+    promoted = policy.select(scores)
+    fitness = policy.impute(fitness, ran)
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+## Value of each per track result field for a track that hasn't been run
+TRACK_DEFAULTS = {
+    "bonus": 0.0,
+    "completion": 0.0,
+    "time": -1.0,
+    "runtime": -1.0,
+    "x": 0.0,
+    "y": 0.0,
+    "avg_speed": 0.0,
+    "avg_completion_per_frame": 0.0,
+    "autopsy": "Unknown",
+    "frame": 0,
+    "end_frame": 0,
+    "time_diff": 0.0,
+    "frame_adj_runtime": -1.0,
+    "frame_profile": None,
+}
+
+
+def get_stage_tracks(genome: Dict[str, Any]) -> List[int]:
+    """get_stage_tracks Indices into genome["tracks"] a worker should run now, all of them for unstaged genomes"""
+    stage_tracks = genome.get("stage_tracks")
+    if stage_tracks is None:
+        return list(range(len(genome["tracks"])))
+    return list(stage_tracks)
+
+
+def merge_track_results(
+    genome: Dict[str, Any],
+    results: Dict[str, List[Any]],
+    stage_tracks: List[int],
+) -> Dict[str, List[Any]]:
+    """merge_track_results Places the results of the tracks run this stage into full length per track lists
+
+    Args:
+        genome (Dict[str, Any]): The genome document, results from earlier stages are kept
+        results (Dict[str, List[Any]]): One entry per stage track for every field
+        stage_tracks (List[int]): Indices of the tracks the results are for
+
+    Returns:
+        Dict[str, List[Any]]: One entry per track for every field
+    """
+    num_tracks = len(genome["tracks"])
+    merged = {}
+    for field, values in results.items():
+        current = genome.get(field)
+        if not isinstance(current, list) or len(current) != num_tracks:
+            current = [TRACK_DEFAULTS.get(field) for _ in range(num_tracks)]
+        current = list(current)
+        for idx, value in zip(stage_tracks, values):
+            current[idx] = value
+        merged[field] = current
+    return merged
+
+
+def get_seconds_saved(
+    runtimes: np.ndarray, ran: np.ndarray, fallback: List[float]
+) -> float:
+    """get_seconds_saved Estimates the evaluation time the skipped tracks would have taken
+
+    Args:
+        runtimes (np.ndarray): (genomes, tracks) runtimes in seconds
+        ran (np.ndarray): (genomes, tracks) mask of tracks that were run
+        fallback (List[float]): Seconds per track when no genome ran it, e.g. the evaluation length
+
+    Returns:
+        float: Seconds of worker time not spent
+    """
+    counted = ran & (runtimes > 0)
+    runs = counted.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_runtimes = np.where(counted, runtimes, 0.0).sum(axis=0) / runs
+    mean_runtimes = np.where(runs > 0, mean_runtimes, fallback)
+    return float(((~ran) * mean_runtimes).sum())
+
+
+class StagePolicy:
+    """StagePolicy Decides who runs the next track and what the others are assumed to score on it"""
+
+    ## Result field the manager scores genomes on for select, completion or fitness
+    metric = "completion"
+
+    def select(self, scores: np.ndarray) -> np.ndarray:
+        """select Picks the genomes that run the next track
+
+        Args:
+            scores (np.ndarray): Metric summed over the tracks run so far, one per surviving genome
+
+        Returns:
+            np.ndarray: Boolean mask of the genomes to promote
+        """
+        return np.ones(len(scores), dtype=bool)
+
+    def impute(self, fitness: np.ndarray, ran: np.ndarray) -> np.ndarray:
+        """impute Fills in the fitness of tracks a genome skipped
+
+        Args:
+            fitness (np.ndarray): (genomes, tracks) fitness, entries for skipped tracks are ignored
+            ran (np.ndarray): (genomes, tracks) mask of tracks that were run
+
+        Returns:
+            np.ndarray: Fitness with every skipped entry filled in
+        """
+        return np.where(ran, fitness, 0.0)
+
+
+class QuantilePolicy(StagePolicy):
+
+    def __init__(
+        self, metric: str = "completion", quantile: float = 0.5, min_promoted: int = 1
+    ) -> None:
+        """__init__ Promotes genomes scoring at or above a quantile of the survivors
+
+        Args:
+            metric (str, optional): completion or fitness. Defaults to "completion".
+            quantile (float, optional): Share of survivors left behind each stage. Defaults to 0.5.
+            min_promoted (int, optional): Fewest genomes promoted however the scores fall. Defaults to 1.
+        """
+        self.metric = metric
+        self.quantile = quantile
+        self.min_promoted = min_promoted
+
+    def select(self, scores: np.ndarray) -> np.ndarray:
+        scores = np.asarray(scores, dtype=float)
+        if len(scores) == 0:
+            return np.zeros(0, dtype=bool)
+        ## Ties with the threshold are promoted, so a generation that all crashed at the start isn't cut
+        promoted = scores >= np.quantile(scores, self.quantile)
+        if promoted.sum() < self.min_promoted:
+            promoted[np.argsort(scores)[::-1][: self.min_promoted]] = True
+        return promoted
+
+    def impute(self, fitness: np.ndarray, ran: np.ndarray) -> np.ndarray:
+        ## Conservative: the lower of the worst fitness anyone who ran the track got and the genome's own
+        ## average over the tracks it ran, so a rejected genome is never pushed above the promoted ones
+        ran_count = ran.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            own_mean = np.where(ran, fitness, 0.0).sum(axis=1) / ran_count
+        own_mean = np.where(ran_count > 0, own_mean, 0.0)
+        track_min = np.where(ran, fitness, np.inf).min(axis=0, initial=np.inf)
+        imputed = np.minimum(own_mean[:, None], track_min[None, :])
+        return np.where(ran, fitness, imputed)
+
+
+POLICIES = {
+    "quantile": QuantilePolicy,
+}
+
+
+def make_policy(
+    name: Optional[str], options: Optional[Dict[str, Any]] = None
+) -> Optional[StagePolicy]:
+    """make_policy Builds the stage policy named in the manager config
+
+    Args:
+        name (Optional[str]): Key in POLICIES, None or empty evaluates every track for every genome
+        options (Optional[Dict[str, Any]], optional): Keyword arguments for the policy. Defaults to None.
+
+    Returns:
+        Optional[StagePolicy]: The policy or None
+    """
+    if not name:
+        return None
+    return POLICIES[name](**(options or {}))
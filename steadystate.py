@@ -0,0 +1,187 @@
+"""
+steadystate breeds NEAT genomes one at a time as results come back instead of a generation at a time
+
+The evaluated pool plays the part of the population. Each result joins the pool, the weakest genome
+that isn't the best of its species is evicted once the pool is full, and replacement children are bred
+until in_flight genomes are out for evaluation again, so workers never wait on a generation barrier.
+
+Every pop_size results count as an epoch. At an epoch the pool is respeciated and stagnation is checked
+with the population's own species set and stagnation objects, so config4's compatibility threshold,
+max_stagnation and species_elitism keep their meaning.
+"""
+
+import random
+from typing import Dict, List, Optional, Tuple
+
+import neat
+
+
+class SteadyStateEvolver:
+
+    def __init__(
+        self,
+        population: neat.Population,
+        in_flight: int = 0,
+        tournament_size: int = 3,
+    ) -> None:
+        """__init__ Takes over breeding from a neat Population
+
+        Args:
+            population (neat.Population): Freshly created or restored from a checkpoint, genomes without a fitness are evaluated first
+            in_flight (int, optional): Genomes kept out for evaluation once breeding starts. Defaults to half the population.
+            tournament_size (int, optional): Genomes drawn per parent selection. Defaults to 3.
+        """
+        self.p = population
+        self.config = population.config
+        self.pop_size = self.config.pop_size
+        self.in_flight = in_flight or max(self.pop_size // 2, 1)
+        self.tournament_size = tournament_size
+        self.epoch = population.generation
+        ## Genomes restored from a steady state checkpoint keep their fitness and go straight back in the pool
+        self.pool: Dict[int, neat.DefaultGenome] = {
+            key: genome
+            for key, genome in population.population.items()
+            if genome.fitness is not None
+        }
+        self.pending: Dict[int, neat.DefaultGenome] = {
+            key: genome
+            for key, genome in population.population.items()
+            if genome.fitness is None
+        }
+        self.species_of: Dict[int, int] = dict(population.species.genome_to_species)
+        self.results_this_epoch = 0
+        self.best_genome: Optional[neat.DefaultGenome] = population.best_genome
+        ## Newer neat-python tracks innovations per generation
+        self.innovation_tracker = getattr(population.reproduction, "innovation_tracker", None)
+        if self.innovation_tracker is not None:
+            self.config.genome_config.innovation_tracker = self.innovation_tracker
+        self.p.reporters.start_generation(self.epoch)
+
+    def get_pending(
+        self,
+    ) -> List[Tuple[int, neat.DefaultGenome]]:
+        """get_pending Genomes waiting on a result, published at startup"""
+        self.refill()
+        return list(self.pending.items())
+
+    def report(self, key: int, fitness: float) -> List[Tuple[int, neat.DefaultGenome]]:
+        """report Adds a result to the pool and breeds whatever is needed to keep workers busy
+
+        Args:
+            key (int): Genome key the result is for
+            fitness (float): Its fitness
+
+        Returns:
+            List[Tuple[int, neat.DefaultGenome]]: New genomes to publish
+        """
+        genome = self.pending.pop(key, None)
+        if genome is None:
+            return []
+        genome.fitness = fitness
+        self.pool[key] = genome
+        if self.best_genome is None or fitness > self.best_genome.fitness:
+            self.best_genome = genome
+        while len(self.pool) > self.pop_size:
+            self.evict()
+        self.results_this_epoch += 1
+        if self.results_this_epoch >= self.pop_size:
+            self.end_epoch()
+
+        return self.refill()
+
+    def refill(
+        self,
+    ) -> List[Tuple[int, neat.DefaultGenome]]:
+        children = []
+        ## Breeding waits for enough results that selection means something
+        if len(self.pool) >= self.pop_size - self.in_flight:
+            while len(self.pending) < self.in_flight:
+                child = self.breed()
+                self.pending[child.key] = child
+                children.append((child.key, child))
+        return children
+
+    def tournament(self, members: List[neat.DefaultGenome]) -> neat.DefaultGenome:
+        entrants = random.sample(members, min(self.tournament_size, len(members)))
+        return max(entrants, key=lambda genome: genome.fitness)
+
+    def breed(
+        self,
+    ) -> neat.DefaultGenome:
+        """breed Crosses two parents from the same species and mutates the child
+
+        Returns:
+            neat.DefaultGenome: The child, in its first parent's species until the next epoch
+        """
+        parent1 = self.tournament(list(self.pool.values()))
+        species_id = self.species_of.get(parent1.key)
+        mates = [
+            genome
+            for key, genome in self.pool.items()
+            if self.species_of.get(key) == species_id
+        ]
+        parent2 = self.tournament(mates)
+        key = next(self.p.reproduction.genome_indexer)
+        child = self.config.genome_type(key)
+        child.configure_crossover(parent1, parent2, self.config.genome_config)
+        child.mutate(self.config.genome_config)
+        self.p.reproduction.ancestors[key] = (parent1.key, parent2.key)
+        self.species_of[key] = species_id
+        return child
+
+    def evict(
+        self,
+    ) -> None:
+        """evict Removes the weakest pool genome, the best of each species is never removed"""
+        best_of_species: Dict[int, int] = {}
+        for key, genome in self.pool.items():
+            species_id = self.species_of.get(key)
+            best = best_of_species.get(species_id)
+            if best is None or genome.fitness > self.pool[best].fitness:
+                best_of_species[species_id] = key
+        protected = set(best_of_species.values())
+        candidates = [key for key in self.pool if key not in protected]
+        if len(candidates) == 0:
+            candidates = list(self.pool)
+        worst = min(candidates, key=lambda key: self.pool[key].fitness)
+        del self.pool[worst]
+        self.species_of.pop(worst, None)
+
+    def end_epoch(
+        self,
+    ) -> None:
+        """end_epoch Respeciates the pool, drops stagnant species and checkpoints"""
+        self.results_this_epoch = 0
+        species_set = self.p.species
+        species_set.speciate(self.config, self.pool, self.epoch)
+        best = max(self.pool.values(), key=lambda genome: genome.fitness)
+        self.p.reporters.post_evaluate(self.config, self.pool, species_set, best)
+        for species_id, species, stagnant in self.p.reproduction.stagnation.update(
+            species_set, self.epoch
+        ):
+            if not stagnant:
+                continue
+            self.p.reporters.species_stagnant(species_id, species)
+            ## Never empty the pool entirely, breeding needs somewhere to start
+            if len(species.members) < len(self.pool):
+                for key in species.members:
+                    self.pool.pop(key, None)
+                del species_set.species[species_id]
+        ## Children still out for evaluation keep the species of their parent
+        species_of = {key: self.species_of.get(key) for key in self.pending}
+        for key in self.pool:
+            species_of[key] = species_set.genome_to_species[key]
+        self.species_of = species_of
+        ## The checkpoint only keeps genome_to_species, so pending children go in it to keep their species on restore
+        for key in self.pending:
+            if species_of[key] is not None:
+                species_set.genome_to_species[key] = species_of[key]
+        if self.innovation_tracker is not None:
+            self.innovation_tracker.reset_generation()
+
+        self.p.population = {**self.pool, **self.pending}
+        self.p.generation = self.epoch
+        self.p.best_genome = self.best_genome
+        self.p.reporters.end_generation(self.config, self.p.population, species_set)
+        self.epoch += 1
+        self.p.reporters.start_generation(self.epoch)
@@ -0,0 +1,270 @@
+"""
+termination ends episodes early once a ship has clearly stopped getting anywhere
+
+ShellBot.check_done only ends an episode on a collision, a completed course or 5 seconds without a new
+max completion. A TerminationPolicy adds rules for ships that keep inching along, drive backwards, sit
+without thrust or spin on the spot, each ending the episode with its own autopsy label:
+
+    Too Slow    the best completion rate so far can't reach 100% before the episode ends
+    Reversing   completion kept dropping over the window
+    Idle        no thrust and barely moving for the whole window
+    Spinning    heading all over the place while completion stays put
+
+The policy works on a population at once so batchsim and ShellBot (a population of one) terminate the
+same ships on the same frames:
+
+    policy = make_termination("too_slow,spinning", pop=1, max_frames=28 * 85)
+    cause = policy.update(rows, frame, completion, thrust, speed, heading)[0]
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+## Frames per second of game time
+GAME_FPS = 28
+
+
+class TerminationRule:
+
+    ## Autopsy recorded when the rule ends an episode
+    label = ""
+    ## Frames of history the rule looks back over
+    frames = 0
+
+    def check(
+        self, policy: "TerminationPolicy", rows: np.ndarray, frame: int
+    ) -> np.ndarray:
+        """check Finds the ships the rule ends this frame
+
+        Args:
+            policy (TerminationPolicy): Policy holding the recent history
+            rows (np.ndarray): Ships updated this frame
+            frame (int): Current frame
+
+        Returns:
+            np.ndarray: Boolean mask over rows
+        """
+        return np.zeros(len(rows), dtype=bool)
+
+
+class ProjectedCompletionRule(TerminationRule):
+
+    label = "Too Slow"
+
+    def __init__(
+        self, slack: float = 1.5, grace: int = GAME_FPS * 5, frames: int = GAME_FPS * 2
+    ) -> None:
+        """__init__ Ends episodes that can't finish the lap at their best rate so far
+
+        Args:
+            slack (float, optional): Multiplier on the best rate, headroom for speeding up later. Defaults to 1.5.
+            grace (int, optional): Frames before the rule applies, ships start from a standstill. Defaults to 5 seconds.
+            frames (int, optional): Window the recent rate is measured over. Defaults to 2 seconds.
+        """
+        self.slack = slack
+        self.grace = grace
+        self.frames = frames
+
+    def check(
+        self, policy: "TerminationPolicy", rows: np.ndarray, frame: int
+    ) -> np.ndarray:
+        if frame < self.grace or policy.max_frames <= 0:
+            return np.zeros(len(rows), dtype=bool)
+        completion = policy.completion[rows]
+        overall_rate = completion / float(frame)
+        recent = policy.window(policy.completion_history, rows, self.frames)
+        recent_rate = (recent[:, -1] - recent[:, 0]) / float(self.frames - 1)
+        rate = np.maximum(overall_rate, recent_rate)
+        frames_left = max(policy.max_frames - frame, 0)
+        return completion + rate * frames_left * self.slack < 100.0
+
+
+class ReverseProgressRule(TerminationRule):
+
+    label = "Reversing"
+
+    def __init__(self, frames: int = GAME_FPS * 2, drop: float = 1.0) -> None:
+        """__init__ Ends episodes where completion dropped steadily over the window
+
+        Args:
+            frames (int, optional): Window length. Defaults to 2 seconds.
+            drop (float, optional): Completion percent that has to be lost over the window. Defaults to 1.0.
+        """
+        self.frames = frames
+        self.drop = drop
+
+    def check(
+        self, policy: "TerminationPolicy", rows: np.ndarray, frame: int
+    ) -> np.ndarray:
+        recent = policy.window(policy.completion_history, rows, self.frames)
+        ## Sustained means no step forward anywhere in the window, not just a net loss
+        never_forward = (np.diff(recent, axis=1) <= 0.0).all(axis=1)
+        return never_forward & (recent[:, 0] - recent[:, -1] >= self.drop)
+
+
+class IdleRule(TerminationRule):
+
+    label = "Idle"
+
+    def __init__(self, frames: int = GAME_FPS * 2, speed: float = 1.0) -> None:
+        """__init__ Ends episodes where the ship hasn't thrust and has drifted to a halt
+
+        Args:
+            frames (int, optional): Window length. Defaults to 2 seconds.
+            speed (float, optional): Speed below which the ship counts as stopped. Defaults to 1.0.
+        """
+        self.frames = frames
+        self.speed = speed
+
+    def check(
+        self, policy: "TerminationPolicy", rows: np.ndarray, frame: int
+    ) -> np.ndarray:
+        ## ShellBot only thrusts above a thrust value of 0.25
+        thrust = policy.window(policy.thrust_history, rows, self.frames)
+        speed = policy.window(policy.speed_history, rows, self.frames)
+        return (thrust <= 0.25).all(axis=1) & (speed < self.speed).all(axis=1)
+
+
+class SpinRule(TerminationRule):
+
+    label = "Spinning"
+
+    def __init__(
+        self, frames: int = GAME_FPS * 3, variance: float = 0.8, progress: float = 0.5
+    ) -> None:
+        """__init__ Ends episodes where the heading keeps going round without the ship getting anywhere
+
+        Args:
+            frames (int, optional): Window length. Defaults to 3 seconds.
+            variance (float, optional): Circular variance of the heading, 0 is steady and 1 is uniform. Defaults to 0.8.
+            progress (float, optional): Completion percent gained over the window that still counts as spinning. Defaults to 0.5.
+        """
+        self.frames = frames
+        self.variance = variance
+        self.progress = progress
+
+    def check(
+        self, policy: "TerminationPolicy", rows: np.ndarray, frame: int
+    ) -> np.ndarray:
+        cos = policy.window(policy.cos_history, rows, self.frames).mean(axis=1)
+        sin = policy.window(policy.sin_history, rows, self.frames).mean(axis=1)
+        variance = 1.0 - np.hypot(cos, sin)
+        recent = policy.window(policy.completion_history, rows, self.frames)
+        return (variance >= self.variance) & (
+            recent[:, -1] - recent[:, 0] < self.progress
+        )
+
+
+RULES = {
+    "too_slow": ProjectedCompletionRule,
+    "reversing": ReverseProgressRule,
+    "idle": IdleRule,
+    "spinning": SpinRule,
+}
+DEFAULT_RULES = ",".join(RULES)
+
+
+class TerminationPolicy:
+
+    def __init__(
+        self, rules: List[TerminationRule], pop: int = 1, max_frames: int = 0
+    ) -> None:
+        """__init__ Preallocates the recent history of every ship
+
+        Args:
+            rules (List[TerminationRule]): Checked in order, the first to fire names the autopsy
+            pop (int, optional): Ships tracked. Defaults to 1.
+            max_frames (int, optional): Frames in an episode, 0 if unknown. Defaults to 0.
+        """
+        self.rules = rules
+        self.max_frames = max_frames
+        self.length = max([rule.frames for rule in rules] + [1])
+        self.completion = np.zeros(pop)
+        self.completion_history = np.zeros((pop, self.length))
+        self.thrust_history = np.zeros((pop, self.length))
+        self.speed_history = np.zeros((pop, self.length))
+        self.cos_history = np.zeros((pop, self.length))
+        self.sin_history = np.zeros((pop, self.length))
+        self.labels = np.full(pop, "", dtype=object)
+        self.head = 0
+        self.count = 0
+
+    def reset(
+        self,
+    ) -> None:
+        self.head = 0
+        self.count = 0
+
+    def window(self, history: np.ndarray, rows: np.ndarray, frames: int) -> np.ndarray:
+        """window The last frames entries of a history for the given ships, oldest first"""
+        columns = (self.head - frames + np.arange(frames)) % self.length
+        return history[rows[:, None], columns[None, :]]
+
+    def update(
+        self,
+        rows: np.ndarray,
+        frame: int,
+        completion: np.ndarray,
+        thrust: np.ndarray,
+        speed: np.ndarray,
+        heading: np.ndarray,
+    ) -> np.ndarray:
+        """update Records a frame for the ships still flying and checks the rules
+
+        Args:
+            rows (np.ndarray): Indices of the ships still flying
+            frame (int): Current frame
+            completion (np.ndarray): Completion percent per ship in rows
+            thrust (np.ndarray): Thrust value the network last output
+            speed (np.ndarray): Speed per ship
+            heading (np.ndarray): Heading in degrees per ship
+
+        Returns:
+            np.ndarray: Autopsy label per ship in rows, empty where the episode goes on, only valid until the next call
+        """
+        self.completion[rows] = completion
+        self.completion_history[rows, self.head] = completion
+        self.thrust_history[rows, self.head] = thrust
+        self.speed_history[rows, self.head] = speed
+        radians = np.radians(heading)
+        self.cos_history[rows, self.head] = np.cos(radians)
+        self.sin_history[rows, self.head] = np.sin(radians)
+        self.head = (self.head + 1) % self.length
+        self.count += 1
+
+        labels = self.labels[: len(rows)]
+        labels[:] = ""
+        undecided = np.ones(len(rows), dtype=bool)
+        for rule in self.rules:
+            if self.count < rule.frames:
+                continue
+            fired = undecided & rule.check(self, rows, frame)
+            labels[fired] = rule.label
+            undecided &= ~fired
+        return labels
+
+
+def make_termination(
+    names: str,
+    pop: int = 1,
+    max_frames: int = 0,
+    options: Optional[Dict[str, Dict[str, float]]] = None,
+) -> Optional[TerminationPolicy]:
+    """make_termination Builds a policy from comma separated rule names
+
+    Args:
+        names (str): Keys in RULES, e.g. "too_slow,spinning", empty turns early termination off
+        pop (int, optional): Ships tracked. Defaults to 1.
+        max_frames (int, optional): Frames in an episode, 0 if unknown. Defaults to 0.
+        options (Optional[Dict[str, Dict[str, float]]], optional): Keyword arguments per rule name. Defaults to None.
+
+    Returns:
+        Optional[TerminationPolicy]: The policy or None
+    """
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    if len(names) == 0:
+        return None
+    options = options or {}
+    rules = [RULES[name](**options.get(name, {})) for name in names]
+    return TerminationPolicy(rules, pop, max_frames)
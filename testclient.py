@@ -2,13 +2,13 @@ import argparse
 import json
 import pickle
 from datetime import datetime
-from time import sleep
 
 import pymongo
 from bson.objectid import ObjectId
 from bson.binary import Binary
 from neat import nn
 
+from nncompiler import compile_network
 from shellracebot import ShellBot
 
 try:
@@ -78,20 +78,18 @@ try:
         human = True
     sb = ShellBot(f"EKKO{track_num}", track, args.port, headless=False, human = human)
     sb.start()
-    sleep(1)
+    sb.wait_for(sb.connected, 30.0, "connection")
     sb.ask_for_perms = True
-    sleep(1)
+    sb.wait_for(sb.perms_granted, 10.0, "permissions")
     if db_objid != "Human":
-        sb.nn = net
+        sb.nn = compile_network(net)
     sb.reset()
-    while sb.awaiting_reset or sb.done:
-        pass
+    sb.wait_for(sb.reset_complete, 30.0, "reset")
     print(f'Generation {generation} number {individual_num} started run on {track}!')
     start_time = datetime.now()
     sb.show_info = True
-    while not sb.done and (datetime.now() - start_time).total_seconds() < eval_length:
-        sleep(0.01)
-    if not sb.done and (datetime.now() - start_time).total_seconds() >= eval_length:
+    sb.episode_done.wait(eval_length)
+    if not sb.done:
         sb.cause_of_death = "Time"
     sb.show_info = False
     bonus, completion, time = sb.get_scores()
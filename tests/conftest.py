@@ -0,0 +1,63 @@
+"""
+Shared fixtures, every test runs from a scratch copy of the tracks so compiled tables stay out of the repo
+"""
+
+import glob
+import os
+import shutil
+import sys
+from typing import List
+
+import neat
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+class Pilot:
+
+    def __init__(self, gain: float, thrust: float) -> None:
+        """__init__ Hand written stand in for a network that steers at the next checkpoint
+
+        Args:
+            gain (float): How hard to turn towards the next checkpoint
+            thrust (float): Thrust output while the way ahead is clear
+        """
+        self.gain = gain
+        self.thrust = thrust
+
+    def activate(self, inputs: List[float]) -> List[float]:
+        ## Back off near the front wall, and lean away from the closest wall when it is scanned
+        thrust = self.thrust if inputs[5] < 0.7 else 0.2
+        return [thrust, -self.gain * inputs[18] + 0.5 * inputs[3] * inputs[4]]
+
+
+@pytest.fixture(scope="session")
+def track_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tracks")
+    for pattern in ("*.xp", "*.json"):
+        for source in glob.glob(os.path.join(REPO_DIR, pattern)):
+            shutil.copy(source, path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def in_track_dir(track_dir, monkeypatch):
+    monkeypatch.chdir(track_dir)
+
+
+@pytest.fixture
+def pilots() -> List[Pilot]:
+    return [Pilot(gain, thrust) for gain in (2.0, 5.0) for thrust in (0.4, 0.9)]
+
+
+@pytest.fixture(scope="session")
+def neat_config() -> neat.Config:
+    return neat.Config(
+        neat.DefaultGenome,
+        neat.DefaultReproduction,
+        neat.DefaultSpeciesSet,
+        neat.DefaultStagnation,
+        os.path.join(REPO_DIR, "config4"),
+    )
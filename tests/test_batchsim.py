@@ -0,0 +1,75 @@
+import random
+
+import neat
+import numpy as np
+import pytest
+
+import batchsim
+import xpsim
+from termination import DEFAULT_RULES
+
+xpsim.install()
+import shellracebot  # noqa: E402
+
+
+def fly_one_at_a_time(nets, track, termination=""):
+    """fly_one_at_a_time Flies each network through xpsim.run_episode for as long as PopulationSim does"""
+    eval_length = batchsim.PopulationSim(track, nets).target_time + 10.0
+    return [
+        xpsim.run_episode(net, track, eval_length, termination=termination)
+        for net in nets
+    ]
+
+
+def assert_same_results(batch_results, episode_results):
+    for batch, episode in zip(batch_results, episode_results):
+        for field, value in episode.items():
+            assert batch[field] == [value], field
+
+
+@pytest.mark.parametrize("track", ["shorttrack", "circuit1_a"])
+def test_matches_xpsim(pilots, track):
+    batch_results = batchsim.evaluate_population(pilots, [track])
+    assert_same_results(batch_results, fly_one_at_a_time(pilots, track))
+
+
+def test_matches_xpsim_with_termination(pilots):
+    batch_results = batchsim.evaluate_population(
+        pilots, ["circuit1_a"], termination=DEFAULT_RULES
+    )
+    episode_results = fly_one_at_a_time(pilots, "circuit1_a", DEFAULT_RULES)
+    assert_same_results(batch_results, episode_results)
+
+
+def test_matches_xpsim_with_closest_wall_scan(pilots, monkeypatch):
+    monkeypatch.setattr(batchsim, "SCAN_CLOSEST_WALL", True)
+    monkeypatch.setattr(shellracebot, "SCAN_CLOSEST_WALL", True)
+    batch_results = batchsim.evaluate_population(pilots, ["circuit1_a"])
+    assert_same_results(batch_results, fly_one_at_a_time(pilots, "circuit1_a"))
+
+
+def test_matches_xpsim_with_recurrent_networks(neat_config):
+    random.seed(2)
+    population = neat.Population(neat_config)
+    genomes = list(population.population.values())[:6]
+    for genome in genomes:
+        for _ in range(20):
+            genome.mutate(neat_config.genome_config)
+    nets = [neat.nn.RecurrentNetwork.create(genome, neat_config) for genome in genomes]
+    batch_results = batchsim.evaluate_population(nets, ["shorttrack"])
+    nets = [neat.nn.RecurrentNetwork.create(genome, neat_config) for genome in genomes]
+    assert_same_results(batch_results, fly_one_at_a_time(nets, "shorttrack"))
+
+
+def test_one_entry_per_track(pilots):
+    results = batchsim.evaluate_population(pilots, ["shorttrack", "testtrack"])
+    assert len(results) == len(pilots)
+    for result in results:
+        assert all(len(values) == 2 for values in result.values())
+
+
+def test_closest_walls_defaults_when_the_scan_is_off(pilots):
+    sim = batchsim.PopulationSim("shorttrack", pilots)
+    distance, heading = sim.closest_walls(sim.x, sim.y)
+    np.testing.assert_array_equal(distance, shellracebot.ShellBot.closest_wall)
+    np.testing.assert_array_equal(heading, shellracebot.ShellBot.closest_wall_heading)
@@ -0,0 +1,115 @@
+import pickle
+import random
+
+import neat
+import numpy as np
+import pytest
+
+from nncompiler import ACTIVATION_CODES, NetworkBatch, compile_network
+
+ACTIVATION_NAMES = ["identity", "sigmoid", "tanh", "clamped", "hat", "gauss"]
+
+
+@pytest.fixture(scope="module")
+def genomes(neat_config):
+    """genomes Mutated genomes with hidden nodes, recurrent links and every supported activation"""
+    random.seed(3)
+    population = neat.Population(neat_config)
+    genomes = list(population.population.values())[:8]
+    for genome in genomes:
+        for _ in range(30):
+            genome.mutate(neat_config.genome_config)
+        for node in genome.nodes.values():
+            node.activation = random.choice(ACTIVATION_NAMES)
+    return genomes
+
+
+def create_nets(genomes, config):
+    return [neat.nn.RecurrentNetwork.create(genome, config) for genome in genomes]
+
+
+def observation_stream(num_inputs, frames=50):
+    rng = np.random.default_rng(4)
+    return rng.uniform(-1.0, 1.0, (frames, num_inputs))
+
+
+def test_every_supported_activation_has_a_code(neat_config):
+    for name in ACTIVATION_NAMES:
+        assert neat_config.genome_config.activation_defs.get(name) in ACTIVATION_CODES
+
+
+def test_compiled_network_matches_recurrent_network(genomes, neat_config):
+    for net, reference in zip(create_nets(genomes, neat_config), create_nets(genomes, neat_config)):
+        compiled = compile_network(net)
+        for inputs in observation_stream(len(reference.input_nodes)):
+            assert compiled.activate(inputs) == reference.activate(inputs.tolist())
+
+
+def test_compiled_network_reset_clears_state(genomes, neat_config):
+    compiled = compile_network(create_nets(genomes, neat_config)[0])
+    stream = observation_stream(len(compiled.input_nodes), frames=10)
+    first = [compiled.activate(inputs) for inputs in stream]
+    compiled.reset()
+    assert [compiled.activate(inputs) for inputs in stream] == first
+
+
+def test_compiled_network_checks_input_count(genomes, neat_config):
+    compiled = compile_network(create_nets(genomes, neat_config)[0])
+    with pytest.raises(RuntimeError):
+        compiled.activate([0.0])
+
+
+def test_compiles_unpickled_networks(genomes, neat_config):
+    net = create_nets(genomes, neat_config)[0]
+    reference = create_nets(genomes, neat_config)[0]
+    compiled = compile_network(pickle.loads(pickle.dumps(net)))
+    for inputs in observation_stream(len(reference.input_nodes), frames=10):
+        assert compiled.activate(inputs) == reference.activate(inputs.tolist())
+
+
+def test_anything_else_is_left_alone():
+    net = object()
+    assert compile_network(net) is net
+
+
+def test_network_batch_matches_recurrent_networks(genomes, neat_config):
+    references = create_nets(genomes, neat_config)
+    batch = NetworkBatch(create_nets(genomes, neat_config))
+    num_inputs = len(references[0].input_nodes)
+    for frame, inputs in enumerate(observation_stream(num_inputs)):
+        observations = np.roll(np.tile(inputs, (len(references), 1)), frame, axis=0)
+        outputs = batch.activate(observations)
+        for row, reference in enumerate(references):
+            expected = reference.activate(observations[row].tolist())
+            np.testing.assert_allclose(outputs[row], expected, rtol=1e-12, atol=1e-12)
+
+
+def test_network_batch_rows_keep_their_own_state(genomes, neat_config):
+    references = create_nets(genomes, neat_config)
+    batch = NetworkBatch(create_nets(genomes, neat_config))
+    num_inputs = len(references[0].input_nodes)
+    ## Odd rows sit out every other frame, as finished ships do in batchsim
+    for frame, inputs in enumerate(observation_stream(num_inputs)):
+        rows = np.arange(len(references))
+        if frame % 2:
+            rows = rows[::2]
+        outputs = batch.activate(np.tile(inputs, (len(rows), 1)), rows)
+        for output, row in zip(outputs, rows):
+            expected = references[row].activate(inputs.tolist())
+            np.testing.assert_allclose(output, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_network_batch_reset_rows(genomes, neat_config):
+    batch = NetworkBatch(create_nets(genomes, neat_config))
+    inputs = np.ones((len(genomes), batch.num_inputs))
+    first = batch.activate(inputs)
+    batch.activate(inputs)
+    batch.reset(np.array([0]))
+    again = batch.activate(inputs)
+    np.testing.assert_array_equal(again[0], first[0])
+
+
+def test_network_batch_checks_input_count(genomes, neat_config):
+    batch = NetworkBatch(create_nets(genomes, neat_config))
+    with pytest.raises(RuntimeError):
+        batch.activate(np.zeros((len(genomes), batch.num_inputs + 1)))
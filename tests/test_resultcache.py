@@ -0,0 +1,197 @@
+import copy
+import pickle
+import random
+from datetime import datetime, timedelta
+
+import neat
+import pytest
+
+pytest.importorskip("pymongo")
+
+from resultcache import (  # noqa: E402
+    EVAL_SETTINGS,
+    ResultCache,
+    eval_key,
+    get_eval_settings,
+    network_hash,
+)
+
+SETTINGS = {
+    "tracks": ["circuit1_a", "circuit1_b"],
+    "terminate": "",
+    "eval_fps": 28,
+    "frame_clock": False,
+    "sim": False,
+}
+
+
+@pytest.fixture(scope="module")
+def genome(neat_config):
+    random.seed(6)
+    genome = list(neat.Population(neat_config).population.values())[0]
+    for _ in range(30):
+        genome.mutate(neat_config.genome_config)
+    return genome
+
+
+def make_document(generation=0, **fields):
+    document = {
+        "_id": f"doc{generation}",
+        "started_at": datetime.now(),
+        "trace_stride": 14,
+        "failed_eval": False,
+        **SETTINGS,
+    }
+    document.update(fields)
+    return document
+
+
+class FakeCollection:
+    """FakeCollection Answers find by _id from a list of documents and remembers the query"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.query = None
+
+    def find(self, query, projection=None):
+        self.query = query
+        ids = query["_id"]["$in"]
+        return [dict(document) for document in self.documents if document["_id"] in ids]
+
+
+def test_network_hash_survives_pickling(genome, neat_config):
+    copied = pickle.loads(pickle.dumps(genome))
+    assert network_hash(copied, neat_config) == network_hash(genome, neat_config)
+
+
+def test_network_hash_ignores_disabled_connections(genome, neat_config):
+    disabled = copy.deepcopy(genome)
+    key = next(iter(disabled.connections))
+    disabled.connections[key].enabled = False
+    reweighted = copy.deepcopy(disabled)
+    reweighted.connections[key].weight += 1.0
+    assert network_hash(reweighted, neat_config) == network_hash(disabled, neat_config)
+
+
+def test_network_hash_ignores_connection_order(genome, neat_config):
+    copied = copy.deepcopy(genome)
+    copied.connections = dict(reversed(list(copied.connections.items())))
+    assert network_hash(copied, neat_config) == network_hash(genome, neat_config)
+
+
+def test_network_hash_sees_weight_changes(genome, neat_config):
+    copied = copy.deepcopy(genome)
+    enabled = [cg for cg in copied.connections.values() if cg.enabled]
+    enabled[0].weight = float(enabled[0].weight) + 1e-9
+    assert network_hash(copied, neat_config) != network_hash(genome, neat_config)
+
+
+def test_network_hash_sees_node_changes(genome, neat_config):
+    copied = copy.deepcopy(genome)
+    output = copied.nodes[neat_config.genome_config.output_keys[0]]
+    output.bias += 0.5
+    assert network_hash(copied, neat_config) != network_hash(genome, neat_config)
+
+
+def test_eval_key_covers_every_setting():
+    base = eval_key("abc", SETTINGS)
+    assert eval_key("abc", dict(reversed(list(SETTINGS.items())))) == base
+    assert eval_key("abd", SETTINGS) != base
+    changed = {
+        "tracks": ["circuit1_b", "circuit1_a"],
+        "terminate": "too_slow",
+        "eval_fps": 56,
+        "frame_clock": True,
+        "sim": True,
+    }
+    assert set(changed) == set(EVAL_SETTINGS)
+    for field, value in changed.items():
+        assert eval_key("abc", dict(SETTINGS, **{field: value})) != base, field
+
+
+def test_eval_settings_fill_in_missing_fields():
+    assert get_eval_settings({"tracks": ["a"]}) == {
+        "tracks": ["a"],
+        "terminate": None,
+        "eval_fps": None,
+        "frame_clock": None,
+        "sim": None,
+    }
+
+
+def test_lookup_hits_the_same_settings_only():
+    cache = ResultCache(1, SETTINGS["tracks"])
+    cache.add("abc", make_document(), 0)
+    assert cache.lookup("abc", SETTINGS, 14)["_id"] == "doc0"
+    assert cache.lookup("abc", dict(SETTINGS, sim=True), 14) is None
+    assert cache.lookup("abd", SETTINGS, 14) is None
+
+
+def test_failed_evaluations_are_not_cached():
+    cache = ResultCache(1, SETTINGS["tracks"])
+    cache.add("abc", make_document(failed_eval=True), 0)
+    assert cache.lookup("abc", SETTINGS, 14) is None
+
+
+def test_coarser_traces_are_a_miss():
+    cache = ResultCache(1, SETTINGS["tracks"])
+    cache.add("abc", make_document(trace_stride=14), 0)
+    assert cache.lookup("abc", SETTINGS, 28) is not None
+    assert cache.lookup("abc", SETTINGS, 1) is None
+    ## Genomes that aren't traced take any cached trace
+    assert cache.lookup("abc", SETTINGS, 0) is not None
+
+
+def test_evict_by_generation_and_age():
+    cache = ResultCache(1, SETTINGS["tracks"], max_generations=5, max_age=60)
+    cache.add("old", make_document(0), 0)
+    cache.add("recent", make_document(4), 4)
+    cache.add(
+        "stale", make_document(6, started_at=datetime.now() - timedelta(seconds=120)), 6
+    )
+    assert cache.evict(6) == 2
+    assert cache.lookup("recent", SETTINGS, 0) is not None
+    assert cache.lookup("old", SETTINGS, 0) is None
+    assert cache.lookup("stale", SETTINGS, 0) is None
+
+
+def test_reused_results_keep_their_age():
+    cache = ResultCache(1, SETTINGS["tracks"], max_generations=5)
+    evaluated_at = datetime.now() - timedelta(seconds=30)
+    cache.add(
+        "abc",
+        make_document(7, evaluated_generation=2, evaluated_at=evaluated_at),
+        7,
+    )
+    entry = cache.lookup("abc", SETTINGS, 0)
+    assert entry["evaluated_generation"] == 2
+    assert entry["evaluated_at"] == evaluated_at
+    assert cache.evict(8) == 1
+
+
+def test_new_context_empties_the_cache():
+    cache = ResultCache(1, SETTINGS["tracks"])
+    cache.add("abc", make_document(), 0)
+    cache.set_context(1, SETTINGS["tracks"])
+    assert cache.lookup("abc", SETTINGS, 0) is not None
+    cache.set_context(1, ["circuit1_a"])
+    assert cache.lookup("abc", SETTINGS, 0) is None
+
+
+def test_fetch_copies_results_and_drops_missing_documents():
+    cache = ResultCache(1, SETTINGS["tracks"])
+    cache.add("abc", make_document(0), 0)
+    cache.add("gone", make_document(1), 1)
+    hits = {
+        "abc": cache.lookup("abc", SETTINGS, 0),
+        "gone": cache.lookup("gone", SETTINGS, 0),
+    }
+    collection = FakeCollection([{"_id": "doc0", "completion": [50.0, 20.0]}])
+    results = cache.fetch(collection, hits)
+    assert list(results) == ["abc"]
+    assert results["abc"]["completion"] == [50.0, 20.0]
+    assert results["abc"]["cached_from"] == "doc0"
+    assert "_id" not in results["abc"]
+    assert collection.query["trial"] == 1
+    assert collection.query["tracks"] == SETTINGS["tracks"]
+    assert cache.lookup("gone", SETTINGS, 0) is None
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from stagedeval import (
+    TRACK_DEFAULTS,
+    QuantilePolicy,
+    StagePolicy,
+    get_seconds_saved,
+    get_stage_tracks,
+    make_policy,
+    merge_track_results,
+)
+
+TRACKS = ["circuit1_a", "circuit1_b", "shorttrack"]
+
+
+def test_unstaged_genomes_run_every_track():
+    assert get_stage_tracks({"tracks": TRACKS}) == [0, 1, 2]
+    assert get_stage_tracks({"tracks": TRACKS, "stage_tracks": None}) == [0, 1, 2]
+    assert get_stage_tracks({"tracks": TRACKS, "stage_tracks": [1]}) == [1]
+
+
+def test_merge_keeps_earlier_stages():
+    genome = {
+        "tracks": TRACKS,
+        "completion": [40.0, 0.0, 0.0],
+        "autopsy": ["Collision", "Unknown", "Unknown"],
+    }
+    merged = merge_track_results(
+        genome, {"completion": [75.0], "autopsy": ["Time"]}, [1]
+    )
+    assert merged == {
+        "completion": [40.0, 75.0, 0.0],
+        "autopsy": ["Collision", "Time", "Unknown"],
+    }
+    ## The document itself is left alone
+    assert genome["completion"] == [40.0, 0.0, 0.0]
+
+
+def test_merge_fills_in_unrun_tracks():
+    merged = merge_track_results(
+        {"tracks": TRACKS, "time": [12.0]}, {"time": [30.5], "x": [100]}, [2]
+    )
+    assert merged["time"] == [TRACK_DEFAULTS["time"], TRACK_DEFAULTS["time"], 30.5]
+    assert merged["x"] == [TRACK_DEFAULTS["x"], TRACK_DEFAULTS["x"], 100]
+
+
+def test_seconds_saved_uses_the_mean_runtime_of_each_track():
+    runtimes = np.array([[10.0, 20.0, -1.0], [30.0, -1.0, -1.0], [20.0, -1.0, -1.0]])
+    ran = np.array([[True, True, False], [True, False, False], [True, False, False]])
+    ## Two skips of track 1 at 20 seconds and three of track 2 at the fallback
+    assert get_seconds_saved(runtimes, ran, [75.0, 75.0, 60.0]) == 2 * 20.0 + 3 * 60.0
+
+
+def test_quantile_halves_distinct_scores():
+    scores = np.arange(16, dtype=float)
+    promoted = QuantilePolicy(quantile=0.5).select(scores)
+    assert promoted.sum() == 8
+    assert promoted[8:].all()
+
+
+def test_quantile_promotes_ties():
+    assert QuantilePolicy(quantile=0.5).select(np.zeros(10)).all()
+
+
+def test_quantile_promotes_at_least_min_promoted():
+    promoted = QuantilePolicy(quantile=1.0, min_promoted=3).select(
+        np.array([5.0, 1.0, 9.0, 7.0, 3.0])
+    )
+    np.testing.assert_array_equal(promoted, [True, False, True, True, False])
+
+
+def test_quantile_of_no_survivors():
+    assert len(QuantilePolicy().select(np.array([]))) == 0
+
+
+def test_successive_halving_over_the_tracks():
+    rng = np.random.default_rng(7)
+    skill = rng.permutation(16).astype(float)
+    policy = QuantilePolicy(quantile=0.5)
+    ran = np.zeros((16, len(TRACKS)), dtype=bool)
+    survivors = np.arange(16)
+    for track in range(len(TRACKS)):
+        ran[survivors, track] = True
+        if track < len(TRACKS) - 1:
+            survivors = survivors[policy.select(skill[survivors] * (track + 1))]
+    assert ran.sum(axis=0).tolist() == [16, 8, 4]
+    assert sorted(survivors.tolist()) == sorted(np.argsort(skill)[-4:].tolist())
+
+
+def test_impute_never_lifts_a_rejected_genome_above_the_promoted():
+    fitness = np.array([[50.0, 80.0], [60.0, 40.0], [10.0, 0.0], [90.0, 0.0]])
+    ran = np.array([[True, True], [True, True], [True, False], [True, False]])
+    imputed = QuantilePolicy().impute(fitness, ran)
+    np.testing.assert_array_equal(imputed[:2], fitness[:2])
+    ## Own average for the weak genome, the worst score on the track for the strong one
+    assert imputed[2, 1] == 10.0
+    assert imputed[3, 1] == 40.0
+    assert imputed[3].sum() <= imputed[:2].sum(axis=1).max()
+
+
+def test_impute_tracks_nobody_ran():
+    fitness = np.array([[30.0, 0.0], [50.0, 0.0]])
+    ran = np.array([[True, False], [True, False]])
+    np.testing.assert_array_equal(
+        QuantilePolicy().impute(fitness, ran), [[30.0, 30.0], [50.0, 50.0]]
+    )
+
+
+def test_base_policy_runs_everything():
+    policy = StagePolicy()
+    assert policy.select(np.array([1.0, 2.0])).all()
+    np.testing.assert_array_equal(
+        policy.impute(np.array([[5.0, 7.0]]), np.array([[True, False]])), [[5.0, 0.0]]
+    )
+
+
+def test_make_policy():
+    assert make_policy(None) is None
+    assert make_policy("") is None
+    policy = make_policy("quantile", {"metric": "fitness", "quantile": 0.25})
+    assert isinstance(policy, QuantilePolicy)
+    assert (policy.metric, policy.quantile) == ("fitness", 0.25)
+    with pytest.raises(KeyError):
+        make_policy("tournament")
@@ -0,0 +1,175 @@
+import numpy as np
+import pytest
+
+from termination import (
+    DEFAULT_RULES,
+    GAME_FPS,
+    IdleRule,
+    ProjectedCompletionRule,
+    make_termination,
+)
+
+MAX_FRAMES = GAME_FPS * 85
+
+
+def fly(policy, frames, completion, thrust, speed, heading):
+    """fly Feeds every ship's per frame values to the policy until each is terminated or frames run out
+
+    Args:
+        completion, thrust, speed, heading: Callables from frame number to one value per ship
+
+    Returns:
+        List: (frame, label) per ship, (None, "") for ships that were never terminated
+    """
+    pop = len(completion(0))
+    ended = [(None, "")] * pop
+    flying = np.arange(pop)
+    for frame in range(frames):
+        labels = policy.update(
+            flying,
+            frame,
+            completion(frame)[flying],
+            thrust(frame)[flying],
+            speed(frame)[flying],
+            heading(frame)[flying],
+        )
+        for row, label in zip(flying, labels):
+            if label:
+                ended[row] = (frame, label)
+        flying = flying[labels == ""]
+        if len(flying) == 0:
+            break
+    return ended
+
+
+def constant(*values):
+    return lambda frame: np.array(values, dtype=float)
+
+
+def test_idle_ends_parked_ships_only():
+    policy = make_termination("idle", pop=2)
+    ended = fly(
+        policy,
+        200,
+        completion=constant(0.0, 0.0),
+        thrust=constant(0.0, 1.0),
+        speed=constant(0.0, 5.0),
+        heading=constant(90.0, 90.0),
+    )
+    assert ended[0] == (IdleRule().frames - 1, "Idle")
+    assert ended[1] == (None, "")
+
+
+def test_reversing_needs_a_steady_drop():
+    policy = make_termination("reversing", pop=3)
+    ended = fly(
+        policy,
+        200,
+        ## Backwards, forwards, and backwards with a step forward every second
+        completion=lambda frame: np.array(
+            [
+                50.0 - frame * 0.1,
+                frame * 0.1,
+                50.0 - frame * 0.1 + (frame % GAME_FPS == 0),
+            ]
+        ),
+        thrust=constant(1.0, 1.0, 1.0),
+        speed=constant(5.0, 5.0, 5.0),
+        heading=constant(90.0, 90.0, 90.0),
+    )
+    assert ended[0][1] == "Reversing"
+    assert ended[1] == (None, "")
+    assert ended[2] == (None, "")
+
+
+def test_spinning_on_the_spot():
+    policy = make_termination("spinning", pop=2)
+    ended = fly(
+        policy,
+        200,
+        completion=lambda frame: np.array([10.0, 10.0 + frame * 0.1]),
+        thrust=constant(1.0, 1.0),
+        speed=constant(5.0, 5.0),
+        heading=lambda frame: np.array([frame * 40.0 % 360.0, frame * 40.0 % 360.0]),
+    )
+    assert ended[0][1] == "Spinning"
+    ## Turning while still getting somewhere isn't spinning
+    assert ended[1] == (None, "")
+
+
+def test_too_slow_projects_the_best_rate():
+    policy = make_termination("too_slow", pop=2, max_frames=MAX_FRAMES)
+    ended = fly(
+        policy,
+        MAX_FRAMES,
+        completion=lambda frame: np.array([frame * 0.01, frame * 0.06]),
+        thrust=constant(1.0, 1.0),
+        speed=constant(5.0, 5.0),
+        heading=constant(90.0, 90.0),
+    )
+    assert ended[0] == (ProjectedCompletionRule().grace, "Too Slow")
+    assert ended[1] == (None, "")
+
+
+def test_too_slow_needs_the_episode_length():
+    policy = make_termination("too_slow", pop=1)
+    ended = fly(
+        policy,
+        400,
+        completion=constant(0.0),
+        thrust=constant(1.0),
+        speed=constant(5.0),
+        heading=constant(90.0),
+    )
+    assert ended[0] == (None, "")
+
+
+@pytest.mark.parametrize(
+    "names,label", [("idle,too_slow", "Idle"), ("too_slow,idle", "Too Slow")]
+)
+def test_first_rule_names_the_autopsy(names, label):
+    ## Both rules fire on the same frame for a parked ship
+    grace = ProjectedCompletionRule().grace
+    policy = make_termination(
+        names, pop=1, max_frames=MAX_FRAMES, options={"idle": {"frames": grace + 1}}
+    )
+    ended = fly(
+        policy,
+        400,
+        completion=constant(0.0),
+        thrust=constant(0.0),
+        speed=constant(0.0),
+        heading=constant(90.0),
+    )
+    assert ended[0] == (grace, label)
+
+
+def test_ships_left_out_keep_their_history():
+    policy = make_termination("idle", pop=2)
+    frames = IdleRule().frames
+    ## Ship 1 thrusts once and then sits out, ship 0 keeps being updated
+    policy.update(
+        np.array([0, 1]), 0, np.zeros(2), np.array([0.0, 1.0]), np.zeros(2), np.zeros(2)
+    )
+    for frame in range(1, frames):
+        labels = policy.update(
+            np.array([0]), frame, np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1)
+        )
+    assert labels[0] == "Idle"
+    rows = np.array([1])
+    assert not IdleRule().check(policy, rows, frames)[0]
+
+
+def test_make_termination():
+    assert make_termination("") is None
+    assert make_termination(" , ") is None
+    policy = make_termination(" too_slow , idle ", pop=3, max_frames=100)
+    assert [rule.label for rule in policy.rules] == ["Too Slow", "Idle"]
+    assert policy.max_frames == 100
+    assert len(policy.completion) == 3
+    assert len(make_termination(DEFAULT_RULES).rules) == 4
+    policy = make_termination("idle", options={"idle": {"frames": 10, "speed": 2.0}})
+    assert (policy.rules[0].frames, policy.rules[0].speed) == (10, 2.0)
+    assert policy.length == 10
+    with pytest.raises(KeyError):
+        make_termination("crashed")
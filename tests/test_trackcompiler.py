@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+import trackcompiler
+from xpmap import BLOCK_SIZE, XPMap
+
+MARCH_STEP = 0.25
+
+
+@pytest.fixture(scope="module")
+def provider(track_dir):
+    cwd = os.getcwd()
+    os.chdir(track_dir)
+    try:
+        yield trackcompiler.load_track("shorttrack")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="module")
+def open_points(track_dir):
+    ## Random points on the track, off the walls
+    rng = np.random.default_rng(0)
+    track = XPMap(os.path.join(track_dir, "shorttrack.xp"))
+    height, width = track.grid.shape
+    x = rng.uniform(0, width * BLOCK_SIZE, 20000)
+    y = rng.uniform(0, height * BLOCK_SIZE, 20000)
+    keep = ~track.is_wall(x, y)
+    x, y = x[keep][:400], y[keep][:400]
+    angles = rng.integers(0, 360, (len(x), 8)).astype(float)
+    return x[:, None], y[:, None], angles
+
+
+def test_distance_transform_matches_brute_force():
+    rng = np.random.default_rng(1)
+    mask = rng.random((12, 17)) < 0.1
+    rows, cols = np.nonzero(mask)
+    grid_rows, grid_cols = np.indices(mask.shape)
+    expected = np.sqrt(
+        np.min(
+            (grid_rows[..., None] - rows) ** 2 + (grid_cols[..., None] - cols) ** 2,
+            axis=-1,
+        )
+    )
+    np.testing.assert_allclose(trackcompiler.distance_transform(mask), expected)
+
+
+def test_distance_transform_of_an_empty_mask():
+    assert np.isinf(trackcompiler.distance_transform(np.zeros((3, 4), dtype=bool))).all()
+
+
+def test_trace_matches_a_fine_march(provider, open_points):
+    x, y, angles = open_points
+    track = XPMap("shorttrack.xp")
+    traced = provider.trace(x, y, angles, 1000)
+    marched = track.raycast(x, y, angles, 1000, step=MARCH_STEP)
+    ## Marching only finds a wall at the first sample inside it
+    assert (marched - traced).min() >= -1e-6
+    assert (marched - traced).max() <= MARCH_STEP + 1e-6
+
+
+def test_feelers_match_trace(provider, open_points):
+    x, y, angles = open_points
+    feelers = provider.feelers(x, y, angles, 1000)
+    traced = provider.trace(x, y, angles, 1000)
+    assert np.abs(feelers - traced).max() <= trackcompiler.TOLERANCE
+
+
+def test_feelers_the_table_cant_answer_are_traced(provider, open_points):
+    x, y, angles = open_points
+    between_degrees = provider.feelers(x, y, angles + 0.5, 1000)
+    np.testing.assert_array_equal(
+        between_degrees, provider.trace(x, y, angles + 0.5, 1000)
+    )
+    beyond_table = provider.feelers(x, y, angles, provider.max_dist + 500)
+    np.testing.assert_array_equal(
+        beyond_table, provider.trace(x, y, angles, provider.max_dist + 500)
+    )
+
+
+def test_feelers_stop_at_max_dist(provider, open_points):
+    x, y, angles = open_points
+    assert provider.feelers(x, y, angles, 50).max() <= 50
+
+
+def test_scalar_and_list_queries(provider, open_points):
+    x, y, angles = open_points
+    feelers = provider.feelers(x[0, 0], y[0, 0], angles[0].tolist(), 1000)
+    assert feelers.shape == (8,)
+    np.testing.assert_array_equal(
+        feelers, provider.feelers(x[:1], y[:1], angles[:1], 1000)[0]
+    )
+
+
+def test_load_track_reads_the_cache(provider):
+    assert os.path.exists(trackcompiler.get_track_path("shorttrack"))
+    cached = trackcompiler.load_track("shorttrack")
+    np.testing.assert_array_equal(cached.rays, provider.rays)
+    np.testing.assert_array_equal(cached.inexact, provider.inexact)
+    np.testing.assert_array_equal(cached.node_index, provider.node_index)
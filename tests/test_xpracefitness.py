@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from xpracefitness import default_config, get_fitness, get_fitness_matrix, get_many_fitnesses
+
+TARGET_TIMES = [60.0, 30.0, 45.0]
+
+
+def scalar_fitnesses(completions, bonuses, times, target_times, config=default_config):
+    ## Python floats like the genome documents hold, NumPy scalars go nan where Python goes complex
+    completions = completions.tolist()
+    bonuses = bonuses.tolist()
+    times = times.tolist()
+    max_target_time = max(target_times)
+    return np.array(
+        [
+            [
+                get_fitness(
+                    completions[row][col],
+                    bonuses[row][col],
+                    times[row][col],
+                    0.0,
+                    0.0,
+                    target_times[col],
+                    max_target_time,
+                    config,
+                )
+                for col in range(len(target_times))
+            ]
+            for row in range(len(completions))
+        ]
+    )
+
+
+@pytest.fixture
+def results():
+    rng = np.random.default_rng(5)
+    shape = (40, len(TARGET_TIMES))
+    completions = rng.uniform(0.0, 100.0, shape)
+    bonuses = rng.uniform(0.0, 80.0, shape)
+    times = np.where(rng.random(shape) < 0.5, -1.0, rng.uniform(1.0, 70.0, shape))
+    ## Edge cases: going backwards, finishing slower than the target time, and exactly on it
+    completions[0] = -3.0
+    times[1] = np.array(TARGET_TIMES) + 5.0
+    times[2] = TARGET_TIMES
+    completions[3] = 100.0
+    return completions, bonuses, times
+
+
+def test_matrix_matches_get_fitness(results):
+    completions, bonuses, times = results
+    matrix = get_fitness_matrix(
+        completions, bonuses, times, np.zeros_like(times), np.zeros_like(times), TARGET_TIMES
+    )
+    np.testing.assert_array_equal(
+        matrix, scalar_fitnesses(completions, bonuses, times, TARGET_TIMES)
+    )
+
+
+def test_matrix_matches_get_fitness_with_another_config(results):
+    completions, bonuses, times = results
+    config = dict(default_config, completion_mod=1.3, time_mod=0.9)
+    matrix = get_fitness_matrix(
+        completions,
+        bonuses,
+        times,
+        np.zeros_like(times),
+        np.zeros_like(times),
+        TARGET_TIMES,
+        config,
+    )
+    np.testing.assert_array_equal(
+        matrix, scalar_fitnesses(completions, bonuses, times, TARGET_TIMES, config)
+    )
+
+
+def test_matrix_is_real(results):
+    completions, bonuses, times = results
+    matrix = get_fitness_matrix(
+        completions, bonuses, times, np.zeros_like(times), np.zeros_like(times), TARGET_TIMES
+    )
+    assert matrix.dtype == float
+    assert np.isfinite(matrix).all()
+
+
+def test_many_fitnesses_is_one_row(results):
+    completions, bonuses, times = results
+    many = get_many_fitnesses(
+        completions[4].tolist(),
+        bonuses[4].tolist(),
+        times[4].tolist(),
+        [0.0] * len(TARGET_TIMES),
+        [0.0] * len(TARGET_TIMES),
+        TARGET_TIMES,
+    )
+    assert many == scalar_fitnesses(completions[4:5], bonuses[4:5], times[4:5], TARGET_TIMES)[0].tolist()
@@ -0,0 +1,101 @@
+import pytest
+
+import xpsim
+from xpmap import XPMap
+
+RESULT_FIELDS = [
+    "bonus",
+    "completion",
+    "time",
+    "x",
+    "y",
+    "avg_speed",
+    "avg_completion_per_frame",
+    "autopsy",
+    "frame",
+    "end_frame",
+]
+
+
+class Parked:
+    def activate(self, inputs):
+        return [0.0, 0.0]
+
+
+def test_spawns_on_the_base():
+    server = xpsim.serve("shorttrack")
+    assert (server.x, server.y) == XPMap("shorttrack.xp").base
+    assert server.alive == 1
+    assert (server.x_vel, server.y_vel) == (0.0, 0.0)
+
+
+def test_thrust_and_friction():
+    server = xpsim.serve("shorttrack")
+    server.heading = 0.0
+    xpsim.setPowerLevel(28.0)
+    xpsim.thrust(1)
+    server.tick()
+    x_vel = 28.0 / xpsim.SHIP_MASS * (1.0 - server.map.friction)
+    assert server.x_vel == pytest.approx(x_vel)
+    assert server.y_vel == pytest.approx(0.0)
+    xpsim.thrust(0)
+    server.tick()
+    assert server.x_vel == pytest.approx(x_vel * (1.0 - server.map.friction))
+    assert xpsim.selfTrackingDeg() == 0
+
+
+def test_turn_to_degree_is_rate_limited():
+    server = xpsim.serve("shorttrack")
+    xpsim.setTurnSpeedDeg(20.0)
+    xpsim.turnToDeg(180)
+    server.tick()
+    assert xpsim.selfHeadingDeg() == 110
+    for _ in range(5):
+        server.tick()
+    assert xpsim.selfHeadingDeg() == 180
+
+
+def test_crash_and_respawn():
+    server = xpsim.serve("shorttrack")
+    base = (server.x, server.y)
+    server.y_vel = -10.0
+    frames = 0
+    while server.alive and frames < 100:
+        server.tick()
+        frames += 1
+    assert server.alive == 0
+    assert (server.x_vel, server.y_vel) == (0.0, 0.0)
+    for _ in range(xpsim.RESPAWN_FRAMES):
+        server.tick()
+    assert server.alive == 1
+    assert (server.x, server.y) == base
+
+
+def test_wall_feeler_matches_the_map():
+    server = xpsim.serve("shorttrack")
+    for degree in range(0, 360, 45):
+        expected = int(server.map.raycast(server.x, server.y, degree, 1000))
+        assert xpsim.wallFeeler(1000, degree) == expected
+
+
+def test_run_episode_flies_shellbot(pilots):
+    results = [xpsim.run_episode(pilot, "shorttrack", eval_length=10.0) for pilot in pilots]
+    for result in results:
+        assert list(result) == RESULT_FIELDS
+        assert 0 < result["end_frame"] <= 10 * xpsim.FPS
+        assert result["completion"] > 0.0
+    ## Pilots that fly differently end up in different places
+    assert len({(result["x"], result["y"]) for result in results}) > 1
+
+
+def test_run_episode_is_deterministic(pilots):
+    first = xpsim.run_episode(pilots[0], "shorttrack", eval_length=10.0)
+    second = xpsim.run_episode(pilots[0], "shorttrack", eval_length=10.0)
+    assert first == second
+
+
+def test_parked_ship_gets_stuck():
+    result = xpsim.run_episode(Parked(), "shorttrack", eval_length=10.0)
+    assert result["autopsy"] == "Stuck"
+    assert result["time"] == -1.0
+    assert result["frame"] == -1
@@ -0,0 +1,413 @@
+"""
+trackcompiler turns .xp maps into cached wall geometry so feelers can be answered without ai.wallFeeler
+
+Each compiled track holds the block grid, an occupancy grid, a signed distance field and a raycast table
+giving the wall distance from every cell corner at every whole degree. Inside a cell the distance is
+interpolated from its four corners, which is exact while every ray from the cell hits the same flat wall.
+Cells and angles where it isn't, and cells touching a wall, are marked when compiling and traced exactly
+through the block grid instead, so feelers match XPMap.raycast to within a pixel. Compile ahead of time with:
+
+    python trackcompiler.py circuit1_a circuit1_b
+"""
+
+import argparse
+import os
+from typing import Sequence, Union
+
+import numpy as np
+
+from xpmap import BLOCK_SIZE, FILLED, REC_LL, REC_LR, REC_UL, REC_UR, XPMap
+
+CELL_SIZE = BLOCK_SIZE / 5.0
+MAX_DIST = 1000
+NUM_ANGLES = 360
+CHUNK_CELLS = 2000
+## Table distances are stored as fixed point in 1/RAY_SCALE pixels
+RAY_SCALE = 32
+## Pixels interpolation may be off by before a cell and angle is traced instead
+TOLERANCE = 0.25
+
+## Wall side of each half filled block as a * u + b * v + c >= 0 in block coordinates, see XPMap.is_wall
+HALF_PLANES = np.zeros((8, 3))
+HALF_PLANES[REC_UL] = (-1.0, 1.0, 0.0)
+HALF_PLANES[REC_LR] = (1.0, -1.0, 0.0)
+HALF_PLANES[REC_LL] = (-1.0, -1.0, 1.0)
+HALF_PLANES[REC_UR] = (1.0, 1.0, -1.0)
+
+
+def get_track_path(mapname: str) -> str:
+    return f"{mapname}.track.npz"
+
+
+def distance_transform(mask: np.ndarray) -> np.ndarray:
+    """distance_transform Exact euclidean distance from every cell to the nearest cell where mask is True
+
+    Args:
+        mask (np.ndarray): 2D boolean grid of target cells
+
+    Returns:
+        np.ndarray: Distance in cells, inf everywhere if the mask is empty
+    """
+    height, width = mask.shape
+    if not mask.any():
+        return np.full(mask.shape, np.inf)
+
+    ## Column pass, distance to the nearest target above or below
+    col_dist = np.full(mask.shape, np.inf)
+    last = np.full(width, -np.inf)
+    for row in range(height):
+        last = np.where(mask[row], row, last)
+        col_dist[row] = row - last
+    last = np.full(width, np.inf)
+    for row in range(height - 1, -1, -1):
+        last = np.where(mask[row], row, last)
+        col_dist[row] = np.minimum(col_dist[row], last - row)
+
+    ## Row pass, brute force minimum over every column in the row
+    cols = np.arange(width)
+    offsets = (cols[:, None] - cols[None, :]) ** 2
+    sq_dist = np.empty(mask.shape)
+    for row in range(height):
+        sq_dist[row] = np.min(offsets + col_dist[row][None, :] ** 2, axis=1)
+    return np.sqrt(sq_dist)
+
+
+class FeelerProvider:
+
+    cell_size: float = CELL_SIZE
+    max_dist: int = MAX_DIST
+
+    def __init__(
+        self,
+        blocks: np.ndarray,
+        occupancy: np.ndarray,
+        sdf: np.ndarray,
+        node_index: np.ndarray,
+        cell_index: np.ndarray,
+        rays: np.ndarray,
+        inexact: np.ndarray,
+        cell_size: float = CELL_SIZE,
+        max_dist: int = MAX_DIST,
+    ) -> None:
+        """__init__ Wall geometry of a compiled track
+
+        Args:
+            blocks (np.ndarray): XPMap.grid, block types indexed by block y and x
+            occupancy (np.ndarray): Whether each cell's center is inside a wall
+            sdf (np.ndarray): Signed distance from each cell center to the nearest wall in pixels, negative inside walls
+            node_index (np.ndarray): Row in rays for each cell corner, -1 where there is none
+            cell_index (np.ndarray): Row in inexact for each cell, -1 for cells touching a wall
+            rays (np.ndarray): Wall distance from each cell corner at each whole degree, in 1/RAY_SCALE pixels
+            inexact (np.ndarray): Whether interpolating rays is off by more than TOLERANCE for each cell and degree
+            cell_size (float, optional): Cell size in pixels. Defaults to CELL_SIZE.
+            max_dist (int, optional): Longest feeler stored in the table. Defaults to MAX_DIST.
+        """
+        self.blocks = blocks
+        self.occupancy = occupancy
+        self.sdf = sdf
+        self.node_index = node_index
+        self.cell_index = cell_index
+        self.rays = rays
+        self.inexact = inexact
+        self.cell_size = float(cell_size)
+        self.max_dist = int(max_dist)
+        self.height, self.width = occupancy.shape
+
+    def get_cells(self, x: np.ndarray, y: np.ndarray):
+        cell_x = np.clip(np.floor(x / self.cell_size).astype(int), 0, self.width - 1)
+        cell_y = np.clip(np.floor(y / self.cell_size).astype(int), 0, self.height - 1)
+        return cell_x, cell_y
+
+    def trace(
+        self,
+        x: Union[float, np.ndarray],
+        y: Union[float, np.ndarray],
+        angle: Union[float, np.ndarray],
+        max_dist: float,
+    ) -> np.ndarray:
+        """trace Walks rays block by block and intersects them with each block's wall exactly
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates of the ray origins
+            y (Union[float, np.ndarray]): y coordinates of the ray origins
+            angle (Union[float, np.ndarray]): Headings of the rays in degrees
+            max_dist (float): How far to look before giving up
+
+        Returns:
+            np.ndarray: Distance to the first wall along each ray, max_dist if none was found
+        """
+        x, y, angle = np.broadcast_arrays(
+            np.asarray(x, dtype=float),
+            np.asarray(y, dtype=float),
+            np.asarray(angle, dtype=float),
+        )
+        shape = x.shape
+        x = x.ravel()
+        y = y.ravel()
+        rads = np.radians(angle.ravel())
+        cos = np.cos(rads)
+        sin = np.sin(rads)
+        height, width = self.blocks.shape
+        block_x = np.floor(x / BLOCK_SIZE).astype(int)
+        block_y = np.floor(y / BLOCK_SIZE).astype(int)
+        step_x = np.where(cos > 0, 1, -1)
+        step_y = np.where(sin > 0, 1, -1)
+        ## Distance along the ray to the next vertical and horizontal block edge, and between edges
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta_x = np.where(cos != 0, BLOCK_SIZE / np.abs(cos), np.inf)
+            delta_y = np.where(sin != 0, BLOCK_SIZE / np.abs(sin), np.inf)
+            next_x = np.where(
+                cos != 0, ((block_x + (cos > 0)) * BLOCK_SIZE - x) / cos, np.inf
+            )
+            next_y = np.where(
+                sin != 0, ((block_y + (sin > 0)) * BLOCK_SIZE - y) / sin, np.inf
+            )
+        enter = np.zeros(len(x))
+        dist = np.full(len(x), float(max_dist))
+        active = np.arange(len(x))
+        while len(active) > 0:
+            active_x = block_x[active]
+            active_y = block_y[active]
+            in_map = (
+                (active_x >= 0)
+                & (active_x < width)
+                & (active_y >= 0)
+                & (active_y < height)
+            )
+            block = np.full(len(active), FILLED, dtype=np.int8)
+            block[in_map] = self.blocks[active_y[in_map], active_x[in_map]]
+            start = enter[active]
+            end = np.minimum(next_x[active], next_y[active])
+
+            ## The wall side of a half filled block changes linearly along the ray, so solve for where it starts
+            plane = HALF_PLANES[block]
+            u = (x[active] + cos[active] * start) / BLOCK_SIZE - active_x
+            v = (y[active] + sin[active] * start) / BLOCK_SIZE - active_y
+            side = plane[:, 0] * u + plane[:, 1] * v + plane[:, 2]
+            slope = (plane[:, 0] * cos[active] + plane[:, 1] * sin[active]) / BLOCK_SIZE
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossing = np.where(side >= 0.0, start, start - side / slope)
+            half = (block >= REC_UL) & (block <= REC_UR)
+            hit_half = half & ((side >= 0.0) | ((slope > 0) & (crossing <= end)))
+            hit = (block == FILLED) | hit_half
+            dist[active[hit]] = np.where(block == FILLED, start, crossing)[hit]
+
+            ## Step into whichever neighbouring block the ray reaches first
+            across_x = next_x[active] < next_y[active]
+            moved_x = active[across_x]
+            moved_y = active[~across_x]
+            enter[moved_x] = next_x[moved_x]
+            block_x[moved_x] += step_x[moved_x]
+            next_x[moved_x] += delta_x[moved_x]
+            enter[moved_y] = next_y[moved_y]
+            block_y[moved_y] += step_y[moved_y]
+            next_y[moved_y] += delta_y[moved_y]
+            active = active[~hit & (enter[active] < max_dist)]
+        return np.minimum(dist, max_dist).reshape(shape)
+
+    def feelers(
+        self,
+        x: Union[float, np.ndarray],
+        y: Union[float, np.ndarray],
+        angles: Union[Sequence[float], np.ndarray],
+        max_dist: float,
+    ) -> np.ndarray:
+        """feelers Answers a batch of wall feeler queries from the table, tracing the ones it can't answer exactly
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates of the ship(s)
+            y (Union[float, np.ndarray]): y coordinates of the ship(s)
+            angles (Union[Sequence[float], np.ndarray]): Feeler headings in degrees
+            max_dist (float): Feeler length
+
+        Returns:
+            np.ndarray: Distance to the wall along each feeler, max_dist if none was found
+        """
+        x, y, angles = np.broadcast_arrays(
+            np.asarray(x, dtype=float),
+            np.asarray(y, dtype=float),
+            np.asarray(angles, dtype=float),
+        )
+        cell_x, cell_y = self.get_cells(x, y)
+        idx = self.cell_index[cell_y, cell_x]
+        angle_bins = np.round(angles).astype(int) % NUM_ANGLES
+        ## Only whole degrees are in the table
+        missing = (
+            (idx < 0) | (angles != np.round(angles)) | (max_dist > self.max_dist)
+        )
+        missing |= self.inexact[np.maximum(idx, 0), angle_bins]
+
+        ## Bilinear between the cell's corners, exact for rays that all hit the same flat wall
+        frac_x = x / self.cell_size - cell_x
+        frac_y = y / self.cell_size - cell_y
+        dists = np.zeros(x.shape)
+        for offset_y, offset_x, weight in (
+            (0, 0, (1.0 - frac_x) * (1.0 - frac_y)),
+            (0, 1, frac_x * (1.0 - frac_y)),
+            (1, 0, (1.0 - frac_x) * frac_y),
+            (1, 1, frac_x * frac_y),
+        ):
+            node = self.node_index[cell_y + offset_y, cell_x + offset_x]
+            dists += weight * self.rays[np.maximum(node, 0), angle_bins]
+        dists = np.clip(dists / RAY_SCALE, 0.0, max_dist)
+
+        if missing.any():
+            dists[missing] = self.trace(
+                x[missing], y[missing], angles[missing], max_dist
+            )
+        return dists
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            blocks=self.blocks,
+            occupancy=self.occupancy,
+            sdf=self.sdf,
+            node_index=self.node_index,
+            cell_index=self.cell_index,
+            rays=self.rays,
+            inexact=self.inexact,
+            cell_size=self.cell_size,
+            max_dist=self.max_dist,
+        )
+
+
+def compile_track(
+    mapname: str, cell_size: float = CELL_SIZE, max_dist: int = MAX_DIST
+) -> FeelerProvider:
+    """compile_track Builds the occupancy grid, distance field and raycast table for a map and caches it
+
+    Args:
+        mapname (str): Track name without the .xp extension
+        cell_size (float, optional): Cell size in pixels. Defaults to CELL_SIZE.
+        max_dist (int, optional): Longest feeler stored in the table. Defaults to MAX_DIST.
+
+    Returns:
+        FeelerProvider: The compiled track
+    """
+    xpmap = XPMap(f"{mapname}.xp")
+    height = int(np.ceil(xpmap.height * BLOCK_SIZE / cell_size))
+    width = int(np.ceil(xpmap.width * BLOCK_SIZE / cell_size))
+    centers_y, centers_x = np.meshgrid(
+        (np.arange(height) + 0.5) * cell_size,
+        (np.arange(width) + 0.5) * cell_size,
+        indexing="ij",
+    )
+    occupancy = xpmap.is_wall(centers_x, centers_y)
+
+    ## Positive in open space, negative inside walls
+    sdf = (distance_transform(occupancy) - distance_transform(~occupancy)) * cell_size
+    sdf = sdf.astype(np.float32)
+
+    ## Only cells with all four corners in the open get a table entry
+    corners_y, corners_x = np.meshgrid(
+        np.arange(height + 1) * cell_size,
+        np.arange(width + 1) * cell_size,
+        indexing="ij",
+    )
+    corner_walls = xpmap.is_wall(corners_x, corners_y)
+    open_cells = ~(
+        corner_walls[:-1, :-1]
+        | corner_walls[:-1, 1:]
+        | corner_walls[1:, :-1]
+        | corner_walls[1:, 1:]
+    )
+    used_nodes = np.zeros(corner_walls.shape, dtype=bool)
+    for offset_y, offset_x in ((0, 0), (0, 1), (1, 0), (1, 1)):
+        used_nodes[offset_y : offset_y + height, offset_x : offset_x + width] |= open_cells
+    nodes = np.flatnonzero(used_nodes)
+    node_index = np.full(used_nodes.shape, -1, dtype=np.int32)
+    node_index.flat[nodes] = np.arange(len(nodes), dtype=np.int32)
+    cells = np.flatnonzero(open_cells)
+    cell_index = np.full(open_cells.shape, -1, dtype=np.int32)
+    cell_index.flat[cells] = np.arange(len(cells), dtype=np.int32)
+
+    rays = np.zeros((len(nodes), NUM_ANGLES), dtype=np.uint16)
+    inexact = np.zeros((len(cells), NUM_ANGLES), dtype=bool)
+    provider = FeelerProvider(
+        xpmap.grid,
+        occupancy,
+        sdf,
+        node_index,
+        cell_index,
+        rays,
+        inexact,
+        cell_size,
+        max_dist,
+    )
+    angles = np.arange(NUM_ANGLES, dtype=float)
+    for start in range(0, len(nodes), CHUNK_CELLS):
+        chunk = nodes[start : start + CHUNK_CELLS]
+        rays[start : start + len(chunk)] = np.round(
+            provider.trace(
+                corners_x.flat[chunk][:, None],
+                corners_y.flat[chunk][:, None],
+                angles[None, :],
+                max_dist,
+            )
+            * RAY_SCALE
+        )
+
+    ## A wall corner poking between the corner rays or a ray that only some corners see past shows up
+    ## as corners that don't fit one plane, or a center that doesn't match what they interpolate to
+    cell_y, cell_x = np.unravel_index(cells, open_cells.shape)
+    for start in range(0, len(cells), CHUNK_CELLS):
+        chunk = slice(start, start + CHUNK_CELLS)
+        corners = [
+            rays[node_index[cell_y[chunk] + offset_y, cell_x[chunk] + offset_x]]
+            / RAY_SCALE
+            for offset_y, offset_x in ((0, 0), (0, 1), (1, 0), (1, 1))
+        ]
+        center = provider.trace(
+            ((cell_x[chunk] + 0.5) * cell_size)[:, None],
+            ((cell_y[chunk] + 0.5) * cell_size)[:, None],
+            angles[None, :],
+            max_dist,
+        )
+        inexact[chunk] = (
+            np.abs(corners[0] + corners[3] - corners[1] - corners[2]) > TOLERANCE
+        ) | (np.abs(sum(corners) / 4.0 - center) > TOLERANCE)
+
+    provider.save(get_track_path(mapname))
+    return provider
+
+
+def load_track(mapname: str) -> FeelerProvider:
+    """load_track Loads a compiled track, compiling it first if the cache is missing or older than the map
+
+    Args:
+        mapname (str): Track name without the .xp extension
+
+    Returns:
+        FeelerProvider: The compiled track
+    """
+    path = get_track_path(mapname)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(
+        f"{mapname}.xp"
+    ):
+        return compile_track(mapname)
+    data = np.load(path)
+    ## Caches from before the corner table was added are rebuilt
+    if "node_index" not in data:
+        return compile_track(mapname)
+    return FeelerProvider(
+        data["blocks"],
+        data["occupancy"],
+        data["sdf"],
+        data["node_index"],
+        data["cell_index"],
+        data["rays"],
+        data["inexact"],
+        float(data["cell_size"]),
+        int(data["max_dist"]),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tracks", nargs="+", help="track names")
+    args = parser.parse_args()
+    for track in args.tracks:
+        print(f"Compiling {track}...")
+        compile_track(track)
+        print(f"Saved {get_track_path(track)}")
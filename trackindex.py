@@ -0,0 +1,326 @@
+"""
+trackindex precomputes the checkpoint geometry of a track so progress can be looked up once per frame
+
+ShellBot and PopulationSim both ask it for the current checkpoint, completion percent and the distances and
+bearings to the next three checkpoints. query answers all of that for one ship in a single call, the
+get_* methods answer it for a whole population with NumPy.
+"""
+
+import json
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+## Checkpoints a query returns distances and bearings for
+LOOKAHEAD = 3
+
+
+def angle_diff(a1: float, a2: float) -> float:
+    """angle_diff Same as ShellBot.angle_diff"""
+    min_ang = min(a1, a2)
+    max_ang = max(a1, a2)
+    diff = max_ang - min_ang
+    comp_diff = min_ang + 360 - max_ang
+    if a2 > a1:
+        return -comp_diff if comp_diff < diff else -diff
+    return min(diff, comp_diff)
+
+
+class TrackIndex:
+
+    checkpoints: np.ndarray = np.zeros((1, 2))
+    segments: np.ndarray = np.zeros((0, 2))
+    segment_lengths: np.ndarray = np.zeros(0)
+    course_lengths: np.ndarray = np.zeros(1)
+    circuit: bool = False
+    finish_marker: int = 1670
+    starting_heading: float = 90.0
+    target_time: float = 0.0
+    grid: Optional[np.ndarray] = None
+    grid_cell_size: float = 35.0
+
+    def __init__(self, mapname: str) -> None:
+        self.mapname = mapname
+        with open(f"{mapname}.json", "r") as f:
+            map_data = json.load(f)
+        self.checkpoint_list: List[List[float]] = map_data["checkpoints"]
+        self.checkpoints = np.array(self.checkpoint_list, dtype=float)
+        self.target_time = map_data["target_time"]
+        self.circuit = map_data.get("circuit", False)
+        if not self.circuit:
+            self.finish_marker = map_data["finish_marker"]
+        self.starting_heading = float(map_data.get("starting_heading", 90))
+        self.num_checkpoints = len(self.checkpoint_list)
+
+        self.segments = self.checkpoints[1:] - self.checkpoints[:-1]
+        self.segment_lengths = np.sqrt(np.sum(self.segments**2, axis=1))
+
+        ## Same running sum as ShellBot.get_total_course_length, kept as a list for the scalar path
+        lengths = [0.0]
+        for idx in range(1, self.num_checkpoints):
+            lengths.append(
+                lengths[-1]
+                + self.get_distance(
+                    self.checkpoint_list[idx - 1], self.checkpoint_list[idx]
+                )
+            )
+        self.course_length_list = lengths
+        self.course_lengths = np.array(lengths)
+        self.total_length = lengths[-1]
+
+        ## Distance between every pair of checkpoints, the windowed lookups don't always pair neighbours
+        self.pair_distances = [
+            [self.get_distance(c1, c2) for c2 in self.checkpoint_list]
+            for c1 in self.checkpoint_list
+        ]
+
+    def get_distance(self, c1: List[float], c2: List[float]) -> float:
+        return math.sqrt((c2[0] - c1[0]) ** 2 + (c2[1] - c1[1]) ** 2)
+
+    def query(
+        self,
+        x: float,
+        y: float,
+        current: int,
+        heading: float,
+        completed: bool = False,
+    ) -> Tuple[int, float, List[float], List[float]]:
+        """query Everything ShellBot needs to know about its progress for a frame
+
+        Args:
+            x (float): x coordinate of the ship
+            y (float): y coordinate of the ship
+            current (int): Checkpoint the ship was heading for last frame
+            heading (float): Heading of the ship in degrees
+            completed (bool, optional): Whether the course is already complete. Defaults to False.
+
+        Returns:
+            Tuple[int, float, List[float], List[float]]: The current checkpoint, the completion percent and the
+            distance and bearing relative to the heading of the next LOOKAHEAD checkpoints
+        """
+        checkpoints = self.checkpoint_list
+        last = self.num_checkpoints - 1
+
+        ## ShellBot.get_current_checkpoint, searching a window of two checkpoints either side
+        low = max(0, current - 2)
+        high = min(self.num_checkpoints, current + 3)
+        dists = [
+            math.sqrt((checkpoint[0] - x) ** 2 + (checkpoint[1] - y) ** 2)
+            for checkpoint in checkpoints[low:high]
+        ]
+        dist_to_closest = min(dists)
+        closest_idx = low + dists.index(dist_to_closest)
+        ## The next waypoint is capped by the window length rather than the checkpoint count
+        next_idx = min(closest_idx + 1, high - low - 1)
+        next_wpt = checkpoints[next_idx]
+        dist_to_next = math.sqrt((next_wpt[0] - x) ** 2 + (next_wpt[1] - y) ** 2)
+        if dist_to_closest < 120.0 or (
+            dist_to_next < self.pair_distances[closest_idx][next_idx] + 50.0
+            and closest_idx < last
+        ):
+            closest_idx += 1
+        checkpoint = max(min(closest_idx, last), 0)
+
+        completion = self.get_completion(x, y, checkpoint, completed)
+
+        distances = []
+        bearings = []
+        for idx in range(checkpoint, checkpoint + LOOKAHEAD):
+            target = checkpoints[max(min(idx, last), 0)]
+            distances.append(
+                math.sqrt((target[0] - x) ** 2 + (target[1] - y) ** 2)
+            )
+            bearings.append(
+                angle_diff(
+                    heading, math.degrees(math.atan2(target[1] - y, target[0] - x))
+                )
+            )
+        return checkpoint, completion, distances, bearings
+
+    def get_completion(
+        self, x: float, y: float, checkpoint: int, completed: bool = False
+    ) -> float:
+        """get_completion ShellBot.get_completion_percent once the current checkpoint is known"""
+        if (not self.circuit and y >= self.finish_marker) or completed:
+            return 100.0
+        checkpoints = self.checkpoint_list
+        last = self.num_checkpoints - 1
+        percent_per_checkpt = 100.0 / float(last)
+        checkpt_idx = checkpoint - 1
+
+        if not self.circuit and checkpoints[checkpt_idx + 1][1] >= self.finish_marker:
+            percentage = 100.0 - percent_per_checkpt
+            diff_finish = self.finish_marker - checkpoints[checkpt_idx][1]
+            if diff_finish != 0:
+                percent_to_finish = max(
+                    min(diff_finish - (self.finish_marker - y) / diff_finish, 1.0),
+                    0.0,
+                )
+                percentage += percent_to_finish * percent_per_checkpt
+                return max(min(round(percentage, 3), 99.999), 0.1)
+
+        percent_per_unit = 100.0 / self.total_length
+        base_percentage = percent_per_unit * (
+            self.course_length_list[checkpt_idx] if checkpt_idx > 0 else 0.0
+        )
+        next_checkpt = checkpoints[checkpt_idx + 1]
+        distance_to_checkpt = math.sqrt(
+            (next_checkpt[0] - x) ** 2 + (next_checkpt[1] - y) ** 2
+        )
+        ## A checkpoint index of -1 wraps around to the last checkpoint like a python list
+        distance_btw_checkpt = (
+            self.pair_distances[checkpt_idx][min(checkpt_idx + 1, last)] - 120.0
+        )
+        percent_to_next = (
+            distance_btw_checkpt - distance_to_checkpt
+        ) * percent_per_unit
+        return max(min(round(base_percentage + percent_to_next, 3), 99.999), 0.1)
+
+    def get_current_checkpoint(
+        self, x: np.ndarray, y: np.ndarray, current: np.ndarray
+    ) -> np.ndarray:
+        """get_current_checkpoint Vectorized query checkpoint lookup, including its windowed next waypoint"""
+        num_checkpoints = self.num_checkpoints
+        rows = np.arange(len(x))
+        low = np.maximum(current - 2, 0)
+        high = np.minimum(num_checkpoints, current + 3)
+        window = low[:, None] + np.arange(5)
+        in_window = window < high[:, None]
+        window = np.minimum(window, num_checkpoints - 1)
+        check_dists = np.sqrt(
+            (self.checkpoints[window, 0] - x[:, None]) ** 2
+            + (self.checkpoints[window, 1] - y[:, None]) ** 2
+        )
+        check_dists[~in_window] = np.inf
+
+        closest_offset = np.argmin(check_dists, axis=1)
+        closest_idx = low + closest_offset
+        dist_to_closest = check_dists[rows, closest_offset]
+        next_idx = np.minimum(closest_idx + 1, high - low - 1)
+        next_wpt = self.checkpoints[next_idx]
+        dist_to_next = np.sqrt((next_wpt[:, 0] - x) ** 2 + (next_wpt[:, 1] - y) ** 2)
+        closest_wpt = self.checkpoints[closest_idx]
+        dist_btw_next = np.sqrt(
+            (next_wpt[:, 0] - closest_wpt[:, 0]) ** 2
+            + (next_wpt[:, 1] - closest_wpt[:, 1]) ** 2
+        )
+        advance = (dist_to_closest < 120.0) | (
+            (dist_to_next < dist_btw_next + 50.0)
+            & (closest_idx < num_checkpoints - 1)
+        )
+        return np.clip(closest_idx + advance, 0, num_checkpoints - 1)
+
+    def get_completion_percent(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        checkpoint: np.ndarray,
+        completed: np.ndarray,
+    ) -> np.ndarray:
+        """get_completion_percent Vectorized get_completion"""
+        num_checkpoints = self.num_checkpoints
+        percent_per_checkpt = 100.0 / float(num_checkpoints - 1)
+        checkpt_idx = checkpoint - 1
+        prev_checkpt = self.checkpoints[checkpt_idx % num_checkpoints]
+        next_checkpt = self.checkpoints[checkpt_idx + 1]
+
+        percent_per_unit = 100.0 / self.total_length
+        base_percentage = percent_per_unit * np.where(
+            checkpt_idx <= 0, 0.0, self.course_lengths[np.maximum(checkpt_idx, 0)]
+        )
+        distance_to_checkpt = np.sqrt(
+            (next_checkpt[:, 0] - x) ** 2 + (next_checkpt[:, 1] - y) ** 2
+        )
+        distance_btw_checkpt = (
+            np.sqrt(
+                (next_checkpt[:, 0] - prev_checkpt[:, 0]) ** 2
+                + (next_checkpt[:, 1] - prev_checkpt[:, 1]) ** 2
+            )
+            - 120.0
+        )
+        percent_to_next = (distance_btw_checkpt - distance_to_checkpt) * percent_per_unit
+        percentage = np.clip(np.round(base_percentage + percent_to_next, 3), 0.1, 99.999)
+
+        if not self.circuit:
+            diff_finish = self.finish_marker - prev_checkpt[:, 1]
+            to_finish = (next_checkpt[:, 1] >= self.finish_marker) & (diff_finish != 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                percent_to_finish = np.clip(
+                    diff_finish - (self.finish_marker - y) / diff_finish, 0.0, 1.0
+                )
+            finish_percentage = np.clip(
+                np.round(
+                    100.0 - percent_per_checkpt + percent_to_finish * percent_per_checkpt,
+                    3,
+                ),
+                0.1,
+                99.999,
+            )
+            percentage = np.where(to_finish, finish_percentage, percentage)
+            completed = completed | (y >= self.finish_marker)
+        return np.where(completed, 100.0, percentage)
+
+    def get_checkpoint_info(
+        self, x: np.ndarray, y: np.ndarray, checkpoint_idx: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """get_checkpoint_info Vectorized distance and absolute angle to checkpoints"""
+        checkpoint = self.checkpoints[np.clip(checkpoint_idx, 0, self.num_checkpoints - 1)]
+        dist = np.sqrt((checkpoint[:, 0] - x) ** 2 + (checkpoint[:, 1] - y) ** 2)
+        angle = np.degrees(np.arctan2(checkpoint[:, 1] - y, checkpoint[:, 0] - x))
+        return dist, angle
+
+    def build_grid(self, cell_size: float = 35.0) -> np.ndarray:
+        """build_grid Rasterizes the waypoint and completion every point would get with no checkpoint history
+
+        Like the maps in map_visualizer.ipynb the closest checkpoint is searched over the whole track, so this is
+        for visualizing and seeding, ShellBot's windowed search can disagree near where the track doubles back.
+
+        Args:
+            cell_size (float, optional): Grid resolution in pixels. Defaults to 35.0.
+
+        Returns:
+            np.ndarray: Array of shape (rows, columns, 2) holding the waypoint and completion of each cell
+        """
+        extent = self.checkpoints.max(axis=0) + 500.0
+        columns = int(math.ceil(extent[0] / cell_size))
+        rows = int(math.ceil(extent[1] / cell_size))
+        centers_y, centers_x = np.meshgrid(
+            (np.arange(rows) + 0.5) * cell_size,
+            (np.arange(columns) + 0.5) * cell_size,
+            indexing="ij",
+        )
+        x = centers_x.ravel()
+        y = centers_y.ravel()
+        dists = np.sqrt(
+            (self.checkpoints[None, :, 0] - x[:, None]) ** 2
+            + (self.checkpoints[None, :, 1] - y[:, None]) ** 2
+        )
+        ## Centering the window on the closest checkpoint makes the windowed search global
+        waypoints = self.get_current_checkpoint(x, y, np.argmin(dists, axis=1))
+        completions = self.get_completion_percent(
+            x, y, waypoints, np.zeros(len(x), dtype=bool)
+        )
+        self.grid = np.stack(
+            [waypoints.reshape(rows, columns), completions.reshape(rows, columns)],
+            axis=-1,
+        )
+        self.grid_cell_size = cell_size
+        return self.grid
+
+    def lookup(self, x: float, y: float) -> Tuple[int, float]:
+        """lookup Reads the waypoint and completion under a point from the rasterized grid
+
+        Args:
+            x (float): x coordinate in pixels
+            y (float): y coordinate in pixels
+
+        Returns:
+            Tuple[int, float]: Waypoint and completion percent of the cell
+        """
+        if self.grid is None:
+            self.build_grid()
+        row = min(max(int(y / self.grid_cell_size), 0), self.grid.shape[0] - 1)
+        column = min(max(int(x / self.grid_cell_size), 0), self.grid.shape[1] - 1)
+        waypoint, completion = self.grid[row, column]
+        return int(waypoint), float(completion)
@@ -0,0 +1,132 @@
+"""
+trajectory records a bot's path into preallocated arrays and packs it into a small binary blob
+
+The blob is a zlib compressed header followed by the samples quantized to integers and delta encoded
+along time, so consecutive frames turn into small int16 steps:
+
+    recorder = TrajectoryRecorder(max_frames=28 * 60, stride=2)
+    recorder.record(frame, x, y, heading, speed, thrust, turn)
+    blob = recorder.to_blob()
+    samples = decode_blob(blob)  ## {"frame": ..., "x": ..., "y": ..., ...}
+"""
+
+import struct
+import zlib
+from typing import Dict
+
+import numpy as np
+
+FIELDS = ["x", "y", "heading", "speed", "thrust", "turn"]
+## Multipliers applied before rounding to integers
+SCALES = np.array([1.0, 1.0, 1.0, 100.0, 1000.0, 1000.0])
+
+MAGIC = b"XPTR"
+VERSION = 1
+## magic, version, bytes per value, stride, samples
+HEADER = struct.Struct("<4sBBHI")
+DTYPES = {2: np.int16, 4: np.int32}
+
+
+class TrajectoryRecorder:
+
+    def __init__(self, max_frames: int, stride: int = 1) -> None:
+        """__init__ Preallocates room for an episode's worth of samples
+
+        Args:
+            max_frames (int): Longest episode in frames, once full the oldest samples are overwritten
+            stride (int, optional): Record every stride-th frame. Defaults to 1.
+        """
+        self.stride = max(int(stride), 1)
+        self.capacity = max_frames // self.stride + 1
+        self.samples = np.zeros((self.capacity, len(FIELDS)), dtype=np.int32)
+        self.frames = np.zeros(self.capacity, dtype=np.int32)
+        self.head = 0
+        self.count = 0
+
+    def reset(
+        self,
+    ) -> None:
+        self.head = 0
+        self.count = 0
+
+    def record(
+        self,
+        frame: int,
+        x: float,
+        y: float,
+        heading: float,
+        speed: float,
+        thrust: float,
+        turn: float,
+    ) -> None:
+        if frame % self.stride:
+            return
+        row = self.samples[self.head]
+        row[0] = round(x)
+        row[1] = round(y)
+        row[2] = round(heading)
+        row[3] = round(speed * 100.0)
+        row[4] = round(thrust * 1000.0)
+        row[5] = round(turn * 1000.0)
+        self.frames[self.head] = frame
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def get_order(
+        self,
+    ) -> np.ndarray:
+        start = (self.head - self.count) % self.capacity
+        return (start + np.arange(self.count)) % self.capacity
+
+    def get_samples(
+        self,
+    ) -> np.ndarray:
+        """get_samples Quantized samples in recording order, oldest first"""
+        return self.samples[self.get_order()]
+
+    def get_frames(
+        self,
+    ) -> np.ndarray:
+        return self.frames[self.get_order()]
+
+    def to_blob(self, level: int = 6) -> bytes:
+        """to_blob Packs the recording for storing in the genome document
+
+        Args:
+            level (int, optional): zlib compression level. Defaults to 6.
+
+        Returns:
+            bytes: Compressed, delta encoded samples
+        """
+        ## Frame numbers go in as an extra leading column, a steady stride costs next to nothing once compressed
+        samples = np.column_stack((self.get_frames(), self.get_samples())).astype(np.int64)
+        deltas = np.diff(samples, axis=0, prepend=np.zeros((1, len(FIELDS) + 1), dtype=np.int64))
+        ## Respawns can jump further than int16 allows, fall back to int32 rather than lose precision
+        width = 2
+        if len(deltas) and (deltas.min() < -32768 or deltas.max() > 32767):
+            width = 4
+        header = HEADER.pack(MAGIC, VERSION, width, self.stride, self.count)
+        ## Field major so each column's small deltas sit together for zlib
+        payload = deltas.astype(DTYPES[width]).T.tobytes()
+        return zlib.compress(header + payload, level)
+
+
+def decode_blob(blob: bytes) -> Dict[str, np.ndarray]:
+    """decode_blob Unpacks a blob written by TrajectoryRecorder.to_blob
+
+    Args:
+        blob (bytes): The stored blob
+
+    Returns:
+        Dict[str, np.ndarray]: Frame numbers and one array per field in original units
+    """
+    data = zlib.decompress(blob)
+    magic, version, width, _, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a trajectory blob!")
+    deltas = np.frombuffer(data, dtype=DTYPES[width], offset=HEADER.size)
+    samples = np.cumsum(deltas.reshape(len(FIELDS) + 1, count).astype(np.int64), axis=1)
+    decoded = {"frame": samples[0]}
+    for idx, field in enumerate(FIELDS):
+        decoded[field] = samples[idx + 1] / SCALES[idx]
+    return decoded
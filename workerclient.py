@@ -9,7 +9,11 @@ from bson.objectid import ObjectId
 from bson.binary import Binary
 from neat import nn
 
+from frameprofiler import FrameProfiler
+from nncompiler import compile_network
 from shellracebot import ShellBot
+from termination import make_termination
+from workqueue import results_filter
 
 ## Get port number track name and bot name from command line
 parser = argparse.ArgumentParser()
@@ -17,6 +21,30 @@ parser.add_argument("-port", help="port number", required=True)
 parser.add_argument("-track", help="track idx", required=True)
 parser.add_argument("-dbid", help="genome db id", required=True)
 parser.add_argument("-eval_length", help="evaluation length", required=True)
+parser.add_argument("-fps", help="server frames per second", default="28")
+parser.add_argument(
+    "-frame_clock",
+    help="time laps and evaluation length in game frames instead of wall clock",
+    action="store_true",
+)
+parser.add_argument(
+    "-profile",
+    help="record per frame timing histograms with the results",
+    action="store_true",
+)
+parser.add_argument(
+    "-slot", help="index of this client among those sharing the server", default="0"
+)
+parser.add_argument(
+    "-follow",
+    help="another client on the server resets the round, wait to be respawned by it",
+    action="store_true",
+)
+parser.add_argument(
+    "-wait_for",
+    help="comma separated genome db ids of the following clients to wait for before resetting the round",
+    default="",
+)
 args = parser.parse_args()
 
 if not args.port:
@@ -31,9 +59,14 @@ if not args.dbid:
     exit(2)
 print(f"port {args.port} for track {track_num} with genome id {args.dbid}")
 db_objid = ObjectId(args.dbid)
+slot = int(args.slot)
+followers = [ObjectId(dbid) for dbid in args.wait_for.split(",") if dbid]
 if not args.eval_length:
     print("No evaluation length specified!")
     exit(2)
+fps = float(args.fps)
+## Game time always runs at 28 frames per second, the server fps only changes how fast it passes
+game_fps = 28.0
 try:
     with open("creds.json") as f:
         creds = json.load(f)
@@ -46,6 +79,7 @@ client = pymongo.MongoClient(db_string)
 db = client.NEAT
 collection = db.genomes
 
+genome = None
 try:
     genome = collection.find_one({"_id": db_objid})
     if genome is None:
@@ -72,29 +106,84 @@ try:
     end_frames = genome["end_frame"]
     time_diffs = genome["time_diff"]
     frame_adj_runtimes = genome["frame_adj_runtime"]
+    frame_profiles = genome.get("frame_profile", [None for _ in tracks])
+    ## Set by the manager per genome, 0 turns the trace off and 1 records every frame
+    trace_stride = int(genome.get("trace_stride", 0))
     hostname = genome["hostname"]
     host = hostname.split("_")[0]
     instance = hostname.split("_")[-1]
 
-    sb = ShellBot(f"EKKO{track_num}", track, args.port, headless=True)
+    ## Every client on a server needs its own name
+    sb = ShellBot(
+        f"EKKO{track_num}_{slot}" if slot > 0 else f"EKKO{track_num}",
+        track,
+        args.port,
+        headless=True,
+        adv_log=trace_stride > 0,
+        frame_clock=args.frame_clock,
+        adv_log_frames=int(eval_length * max(fps, game_fps)),
+        adv_log_stride=max(trace_stride, 1),
+    )
+    if args.profile:
+        sb.profiler = FrameProfiler(fps)
+        sb.observation_pipeline.profile = True
+    if args.frame_clock:
+        sb.frame_limit = int(eval_length * game_fps)
+    ## Set by the manager per genome so a whole generation ends episodes by the same rules
+    sb.termination = make_termination(
+        genome.get("terminate", ""), max_frames=int(eval_length * game_fps)
+    )
     sb.start()
-    sleep(1)
+    sb.wait_for(sb.connected, 30.0, "connection")
     sb.ask_for_perms = True
-    sleep(1)
-    sb.nn = net
-    sb.reset()
-    while sb.awaiting_reset or sb.done:
-        pass
+    sb.wait_for(sb.perms_granted, 10.0, "permissions")
+    sb.nn = compile_network(net)
+    if args.follow:
+        sb.lead_reset = False
+        sb.reset()
+        sb.wait_for(sb.round_armed, 30.0, "spawn")
+        ## Tells the leading client this ship is waiting, the genome's lease keeps stale flags out
+        collection.update_one(
+            results_filter(genome), {"$set": {"round_ready": track_num}}
+        )
+        sb.wait_for(sb.reset_complete, 60.0, "round reset")
+    else:
+        ## Ships that join after the round reset would start late, so wait until every follower is ready
+        waited = 0.0
+        while followers and (
+            collection.count_documents(
+                {
+                    "_id": {"$in": followers},
+                    "$or": [
+                        {"round_ready": track_num},
+                        {"failed_eval": True},
+                        {"finished_eval": True},
+                    ],
+                }
+            )
+            < len(followers)
+        ):
+            if waited > 45.0:
+                raise Exception("Timed out waiting for followers!")
+            sleep(0.1)
+            waited += 0.1
+        sb.reset()
+        sb.wait_for(sb.reset_complete, 30.0, "reset")
     print(
         f"{host} {instance} === Generation {generation} number {individual_num} started evaluation on {track}!"
     )
-    start_time = datetime.now()
     sb.show_info = True
-    while not sb.done and (datetime.now() - start_time).total_seconds() < eval_length:
-        sleep(0.01)
-    if not sb.done and (datetime.now() - start_time).total_seconds() >= eval_length:
+    if args.frame_clock:
+        ## The bot signals when it reaches the frame limit, the timeout only guards against a stalled server
+        sb.episode_done.wait(eval_length * 2.0)
+    else:
+        sb.episode_done.wait(eval_length)
+    if not sb.done:
         sb.cause_of_death = "Time"
-    runtimes[track_num] = round((datetime.now() - sb.start_time).total_seconds(), 3)
+    if args.frame_clock:
+        runtimes[track_num] = round(sb.frame / game_fps, 3)
+    else:
+        runtimes[track_num] = round((datetime.now() - sb.start_time).total_seconds(), 3)
     end_frames[track_num] = sb.frame
     sb.show_info = False
     bonuses[track_num], completions[track_num], times[track_num] = sb.get_scores()
@@ -107,45 +196,52 @@ try:
             frame_rate = sb.frame_rate
         else:
             frame_rate = min(frame_rate, sb.frame_rate)
+    if args.profile:
+        frame_profiles[track_num] = sb.profiler.summary()
+        frame_profiles[track_num]["sensors"] = sb.observation_pipeline.stage_costs()
     avg_speeds[track_num] = round(sb.average_speed, 3)
     avg_completions_per_frame[track_num] = round(sb.average_completion_per_frame, 3)
     frames[track_num] = sb.course_frames
     if sb.completed_course:
-        frame_adj_runtimes[track_num] = float(frames[track_num]) / 28.0
+        frame_adj_runtimes[track_num] = float(frames[track_num]) / game_fps
         time_diffs[track_num] = frame_adj_runtimes[track_num] - times[track_num]
     else:
-        frame_adj_runtimes[track_num] = float(end_frames[track_num]) / 28.0
+        frame_adj_runtimes[track_num] = float(end_frames[track_num]) / game_fps
         time_diffs[track_num] = frame_adj_runtimes[track_num] - runtimes[track_num]
-    collection.update_one(
-        {"_id": genome["_id"]},
-        {
-            "$set": {
-                "bonus": bonuses,
-                "completion": completions,
-                "time": times,
-                "runtime": runtimes,
-                "x": last_xs,
-                "y": last_ys,
-                "avg_speed": avg_speeds,
-                "avg_completion_per_frame": avg_completions_per_frame,
-                "frame_rate": frame_rate,
-                "autopsy": autopsies,
-                "frame": frames,
-                "end_frame": end_frames,
-                "time_diff": time_diffs,
-                "frame_adj_runtime": frame_adj_runtimes,
-            }
-        },
-    )
+    results = {
+        "bonus": bonuses,
+        "completion": completions,
+        "time": times,
+        "runtime": runtimes,
+        "x": last_xs,
+        "y": last_ys,
+        "avg_speed": avg_speeds,
+        "avg_completion_per_frame": avg_completions_per_frame,
+        "frame_rate": frame_rate,
+        "autopsy": autopsies,
+        "frame": frames,
+        "end_frame": end_frames,
+        "time_diff": time_diffs,
+        "frame_adj_runtime": frame_adj_runtimes,
+        "frame_profile": frame_profiles,
+    }
+    if sb.recorder is not None:
+        results[f"{track}_trajectory"] = Binary(sb.recorder.to_blob())
+    ## Only the current lease holder writes, and only until the genome is settled, so a backup that
+    ## already won or a worker the lease was taken from can't overwrite the kept results
+    written = collection.update_one(results_filter(genome), {"$set": results})
+    if written.matched_count == 0:
+        print(f"{host} {instance} === Genome already settled, results dropped!")
+        exit(0)
     if end_frames[track_num] == 0:
         collection.update_one(
-            {"_id": genome["_id"]},
+            results_filter(genome),
             {"$set": {"failed_eval": True, "error": "No frames!", "just_failed": True}},
         )
         exit(1)
-    if frame_rate < 27.0:
+    if frame_rate < fps * 27.0 / game_fps:
         collection.update_one(
-            {"_id": genome["_id"]},
+            results_filter(genome),
             {
                 "$set": {
                     "failed_eval": True,
@@ -166,7 +262,6 @@ try:
     print(f"{host} {instance} === Frame Rate: {frame_rate}")
 except Exception as e:
     print("Error in workerclient.py")
-    genome = collection.find_one({"_id": db_objid})
     if genome is None:
         print("Genome invalid!")
         exit(2)
@@ -176,6 +271,7 @@ except Exception as e:
         "exception": str(e),
         "just_failed": True,
     }
-    collection.update_one({"_id": genome["_id"]}, {"$set": update_dict})
+    ## Keyed on the lease read at startup, a lease taken by another worker or a settled genome is left alone
+    collection.update_one(results_filter(genome), {"$set": update_dict})
     raise e
 exit(0)
@@ -1,24 +1,96 @@
+import atexit
 import faulthandler
 import json
 import socket
 import subprocess
 from datetime import datetime, timedelta
-from random import uniform, randint
-from time import sleep
+from random import uniform
+from time import perf_counter, sleep
 import argparse
 
 from typing import List, Union, Dict, Any
+import pickle
+
 import numpy as np
 import pymongo
+from pymongo.collection import Collection
 
+from batchsim import evaluate_population
+from serverpool import ServerPool
 from shellracebot import ShellBot
+from stagedeval import get_stage_tracks, merge_track_results
+from workqueue import (
+    LeaseHeartbeat,
+    ensure_indexes,
+    is_cancelled,
+    lease_backup,
+    lease_genomes,
+    release_genomes,
+    results_filter,
+    settle_backup,
+)
+from xpmap import XPMap
 
-fps = 28
+## Game time always runs at 28 frames per second, servers can be run faster with -fps and -frame_clock
+game_fps = 28
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-instance", help="instance_no", required=True)
 parser.add_argument("-host", help="host", required=True)
+parser.add_argument(
+    "-genomes",
+    help="genomes evaluated together, each track's server hosts one ship per genome up to its number of bases",
+    default="1",
+)
+parser.add_argument(
+    "-sim",
+    help="evaluate on the headless batch simulator instead of xpilots servers",
+    action="store_true",
+)
+parser.add_argument(
+    "-lease",
+    help="genomes claimed per round trip to the database, evaluated one after another",
+    default="4",
+)
+parser.add_argument(
+    "-lease_ttl",
+    help="seconds without a heartbeat before leased genomes go back in the queue",
+    default="10",
+)
+parser.add_argument(
+    "-speculate",
+    help="run backup copies of running genomes once this few are left in a generation, 0 to disable",
+    default="4",
+)
+parser.add_argument("-fps", help="server frames per second", default=f"{game_fps}")
+parser.add_argument(
+    "-frame_clock",
+    help="measure lap times and episode limits in server frames",
+    action="store_true",
+)
+parser.add_argument(
+    "-profile",
+    help="record per frame timing histograms with the results",
+    action="store_true",
+)
 args = parser.parse_args()
+genomes_per_lease = int(args.genomes)
+lease_size = max(int(args.lease), genomes_per_lease)
+lease_ttl = float(args.lease_ttl)
+speculate_below = int(args.speculate)
+fps = int(args.fps)
+if fps != game_fps and not args.frame_clock:
+    print(
+        f"{args.host} {args.instance} === Server fps {fps} differs from {game_fps}, using frame clock timing!"
+    )
+    args.frame_clock = True
+## loggerclient.py only takes the timing flags, the rest are for workerclient.py alone
+logger_args = ["-fps", f"{fps}"]
+if args.frame_clock:
+    logger_args.append("-frame_clock")
+client_args = list(logger_args)
+if args.profile:
+    client_args.append("-profile")
 
 faulthandler.enable(all_threads=True)
 
@@ -33,6 +105,11 @@ db_string = creds["mongodb"]
 client = pymongo.MongoClient(db_string)
 db = client.NEAT
 collection = db.genomes
+ensure_indexes(collection)
+## The heartbeat and cancellation checks get their own client since the work loop closes and reopens its connection
+control_collection = pymongo.MongoClient(db_string).NEAT.genomes
+heartbeat = LeaseHeartbeat(control_collection, lease_ttl)
+heartbeat.start()
 
 hostname = ""
 import socket
@@ -45,8 +122,132 @@ else:
 hostname += f"_{args.instance}"
 hostname = f"{args.host}_" + hostname
 
+## Servers stay up between evaluations and are only restarted if they crash
+server_pool = ServerPool(fps=fps, log_prefix=f"{args.host} {args.instance}")
+atexit.register(server_pool.close)
+
+## Bases per track, the most ships one server can host
+base_counts: Dict[str, int] = {}
+
+
+def get_base_count(track: str) -> int:
+    if track not in base_counts:
+        base_counts[track] = len(XPMap(f"{track}.xp").bases)
+    return base_counts[track]
+
+
+def start_genome(collection: Collection, genome: Dict[str, Any]) -> bool:
+    """start_genome Clears the results of the tracks a genome is about to run
+
+    Args:
+        collection (Collection): The genomes collection
+        genome (Dict[str, Any]): Document returned by lease_genomes or lease_backup
+
+    Returns:
+        bool: False if the lease ran out and the genome went to another worker
+    """
+    tracks = genome["tracks"]
+    stage_tracks = get_stage_tracks(genome)
+    num_tracks = len(tracks)
+    frames = np.zeros(num_tracks).tolist()
+    resets = {
+        "bonus": np.zeros(num_tracks).tolist(),
+        "completion": np.zeros(num_tracks).tolist(),
+        "time": np.full(num_tracks, -1.0).tolist(),
+        "runtime": np.full(num_tracks, -1.0).tolist(),
+        "x": np.zeros(num_tracks).tolist(),
+        "y": np.zeros(num_tracks).tolist(),
+        "avg_speed": np.zeros(num_tracks).tolist(),
+        "avg_completion_per_frame": np.zeros(num_tracks).tolist(),
+        "autopsy": ["Unknown" for _ in range(num_tracks)],
+        "frame": frames,
+        "end_frame": frames,
+        "time_diff": np.zeros(num_tracks).tolist(),
+        "frame_adj_runtime": np.full(num_tracks, -1.0).tolist(),
+        "frame_profile": [None for _ in range(num_tracks)],
+    }
+    ## Later stages only clear the tracks they run, results from earlier stages are kept
+    if genome.get("stage", 0) > 0:
+        resets = {
+            f"{field}.{idx}": values[idx]
+            for field, values in resets.items()
+            for idx in stage_tracks
+        }
+    started = collection.update_one(
+        {"_id": genome["_id"], "lease_id": genome["lease_id"]},
+        {
+            "$set": dict(
+                resets,
+                frame_rate=0.0,
+                finished_eval=False,
+                started_at=datetime.now(),
+                round_ready=-1,
+                ## Recorded so the manager never reuses or mixes results from different setups
+                eval_fps=fps,
+                frame_clock=bool(args.frame_clock),
+                sim=False,
+            )
+        },
+    )
+    return started.matched_count != 0
+
+
+def run_clients(
+    genomes: List[Dict[str, Any]], port_num: int, track_num: int, eval_length: float
+) -> List[int]:
+    """run_clients Flies every genome at once on the same server, each with its own workerclient.py
+
+    Args:
+        genomes (List[Dict[str, Any]]): Genomes to fly, no more than the track has bases
+        port_num (int): Contact port of the track's server
+        track_num (int): Index of the track in the genomes' track list
+        eval_length (float): Seconds per episode
+
+    Returns:
+        List[int]: Return code of each genome's client
+    """
+    bots: List[subprocess.Popen] = []
+    for slot, genome in enumerate(genomes):
+        ## The first client resets the round once every other ship is parked and waiting for it
+        if slot == 0:
+            slot_args = [
+                "-wait_for",
+                ",".join(str(follower["_id"]) for follower in genomes[1:]),
+            ]
+        else:
+            slot_args = ["-slot", f"{slot}", "-follow"]
+        print(f"{args.host} {args.instance} === Starting Bot!")
+        bots.append(
+            subprocess.Popen(
+                [
+                    "python3",
+                    "workerclient.py",
+                    "-port",
+                    f"{port_num}",
+                    "-track",
+                    f"{track_num}",
+                    "-dbid",
+                    f"{str(genome['_id'])}",
+                    "-eval_length",
+                    f"{eval_length}",
+                ]
+                + client_args
+                + slot_args
+            )
+        )
+    sleep(0.25)
+    print(f"{args.host} {args.instance} === Waiting for Bot to finish!")
+    return_codes = [bot.wait() for bot in bots]
+    sleep(0.25)
+    print(
+        f"{args.host} {args.instance} === Bot finished with return code {return_codes}!"
+    )
+    return return_codes
+
+
 print(f"{args.host} {args.instance} === Beginning Work Cycle ===")
 waiting = False
+pending: List[Dict[str, Any]] = []
 while True:
     with open("pause.txt", "r") as f:
         paused = f.read().strip() == "True"
@@ -60,156 +261,212 @@ while True:
             waiting = True
         sleep(1)
         continue
-    if collection.count_documents({"started_eval": False}) != 0:
+    if len(pending) == 0:
+        pending = lease_genomes(collection, hostname, lease_size, lease_ttl, args.sim)
+        ## Nothing left to start, back up a straggler instead of sitting idle
+        if len(pending) == 0 and speculate_below > 0:
+            backup = lease_backup(
+                collection, hostname, speculate_below, lease_ttl, args.sim
+            )
+            if backup is not None:
+                print(
+                    f"{args.host} {args.instance} === Running backup of genome {backup['individual_num']} in generation {backup['generation']}!"
+                )
+                pending = [backup]
+        heartbeat.hold(pending)
+    if args.sim and len(pending) != 0:
         waiting = False
-        genome = collection.find_one_and_update(
-            {"started_eval": False},
-            update={
-                "$set": {
-                    "started_eval": True,
-                    "hostname": hostname,
-                    "started_at": datetime.now(),
-                }
-            },
-            sort=[
-                ("generation", pymongo.ASCENDING),
-                ("individual_num", pymongo.ASCENDING),
-            ],
-            return_document=pymongo.ReturnDocument.AFTER,
-        )
-        if genome is None:
+        ## Every leased genome flies in the same simulated world where ships can't collide
+        leased = pending[:genomes_per_lease]
+        pending = pending[genomes_per_lease:]
+        ## Genomes whose other copy already finished are dropped before flying anything
+        for genome in [genome for genome in leased if is_cancelled(collection, genome)]:
+            if "backup_of" in genome:
+                settle_backup(collection, genome)
+            leased.remove(genome)
+            print(
+                f"{args.host} {args.instance} === Other copy of genome {genome['individual_num']} finished first, cancelled ==="
+            )
+        if len(leased) == 0:
             continue
+        ## Genomes whose results were written or were settled by their other copy
+        written_ids = set()
         try:
-            generation = genome["generation"]
-            individual_num = genome["individual_num"]
-            species = genome["species"]
-            tracks = genome["tracks"]
-            num_tracks = len(tracks)
-            bonuses = np.zeros(num_tracks).tolist()
-            completions = np.zeros(num_tracks).tolist()
-            times = np.full(num_tracks, -1.0).tolist()
-            last_xs = np.zeros(num_tracks).tolist()
-            last_ys = np.zeros(num_tracks).tolist()
-            avg_speeds = np.zeros(num_tracks).tolist()
-            avg_completions_per_frame = np.zeros(num_tracks).tolist()
-            runtimes = np.full(num_tracks, -1.0).tolist()
-            autopsies = ["Unknown" for _ in range(num_tracks)]
-            frames = np.zeros(num_tracks).tolist()
-            time_diffs = np.zeros(num_tracks).tolist()
-            frame_adj_runtimes = np.full(num_tracks, -1.0).tolist()
-            collection.update_one(
-                {"_id": genome["_id"]},
-                {
-                    "$set": {
-                        "bonus": bonuses,
-                        "completion": completions,
-                        "time": times,
-                        "runtime": runtimes,
-                        "x": last_xs,
-                        "y": last_ys,
-                        "avg_speed": avg_speeds,
-                        "avg_completion_per_frame": avg_completions_per_frame,
-                        "frame_rate": 0.0,
-                        "finished_eval": False,
-                        "autopsy": autopsies,
-                        "frame": frames,
-                        "end_frame": frames,
-                        "time_diff": time_diffs,
-                        "frame_adj_runtime": frame_adj_runtimes,
-                    }
-                },
+            ## Leases only group genomes at the same stage, so they all run the same tracks
+            stage_tracks = get_stage_tracks(leased[0])
+            tracks = [leased[0]["tracks"][idx] for idx in stage_tracks]
+            print(
+                f"{args.host} {args.instance} === Beginning evaluation of genomes {[genome['individual_num'] for genome in leased]} in generation {leased[0]['generation']} on {tracks}!"
+            )
+            nets = [pickle.loads(genome["genome"]) for genome in leased]
+            sim_start = perf_counter()
+            results = evaluate_population(
+                nets,
+                tracks,
+                fps=game_fps,
+                termination=leased[0].get("terminate", ""),
+            )
+            ## Simulated frames per second, only recorded for throughput, the results don't depend on it
+            sim_frames = sum(
+                max(result["end_frame"][track_num] for result in results)
+                for track_num in range(len(tracks))
             )
+            frame_rate = round(sim_frames / max(perf_counter() - sim_start, 1e-6), 3)
+            for genome, result in zip(leased, results):
+                frame_adj_runtimes = []
+                time_diffs = []
+                for track_num in range(len(tracks)):
+                    if result["autopsy"][track_num] == "Completed":
+                        frame_adj_runtime = float(result["frame"][track_num]) / game_fps
+                        time_diff = frame_adj_runtime - result["time"][track_num]
+                    else:
+                        frame_adj_runtime = (
+                            float(result["end_frame"][track_num]) / game_fps
+                        )
+                        time_diff = frame_adj_runtime - result["runtime"][track_num]
+                    frame_adj_runtimes.append(frame_adj_runtime)
+                    time_diffs.append(time_diff)
+                result = dict(
+                    result,
+                    time_diff=time_diffs,
+                    frame_adj_runtime=frame_adj_runtimes,
+                )
+                updates = merge_track_results(genome, result, stage_tracks)
+                updates.update(
+                    {
+                        "frame_rate": frame_rate,
+                        "finished_eval": True,
+                        "eval_fps": game_fps,
+                        "frame_clock": True,
+                        "sim": True,
+                    }
+                )
+                written = collection.update_one(
+                    results_filter(genome), {"$set": updates}
+                )
+                written_ids.add(genome["_id"])
+                if written.matched_count == 0:
+                    ## Settled by the other copy while this one was flying
+                    if "backup_of" in genome:
+                        settle_backup(collection, genome)
+                    continue
+                if "backup_of" in genome and settle_backup(collection, genome):
+                    print(f"{args.host} {args.instance} === Speculative Win ===")
+            print(f"{args.host} {args.instance} === Finished Eval Successfully ===")
+        except Exception as e:
+            release_genomes(collection, pending)
+            pending = []
+            for genome in leased:
+                if genome["_id"] in written_ids:
+                    continue
+                collection.update_one(
+                    results_filter(genome),
+                    {
+                        "$set": {
+                            "started_eval": True,
+                            "finished_eval": False,
+                            "failed_eval": True,
+                            "just_failed": True,
+                            "exception": f"{e}",
+                            "error": f"Runtime Exception: {e}",
+                        }
+                    },
+                )
+            print(f"{args.host} {args.instance} === Error In Eval: {e}")
+            raise e
+    elif len(pending) != 0:
+        waiting = False
+        ## Leases only group genomes at the same stage, so they all run the same tracks
+        tracks = pending[0]["tracks"]
+        stage_tracks = get_stage_tracks(pending[0])
+        ## Every ship on a server needs its own base
+        group_size = min(
+            [genomes_per_lease] + [get_base_count(tracks[idx]) for idx in stage_tracks]
+        )
+        group = pending[:group_size]
+        pending = pending[group_size:]
+        failed: List[Dict[str, Any]] = []
+        try:
+            ## The lease ran out while a genome sat in the queue and it went to another worker
+            flying = [genome for genome in group if start_genome(collection, genome)]
+            if len(flying) == 0:
+                continue
             client.close()
             print(
-                f"{args.host} {args.instance} === Beginning evaluation of genome {individual_num} in generation {generation} on {tracks}!"
+                f"{args.host} {args.instance} === Beginning evaluation of genomes {[genome['individual_num'] for genome in flying]} in generation {flying[0]['generation']} on {tracks}!"
             )
+            cancelled: List[Dict[str, Any]] = []
             for track_num, track in enumerate(tracks):
+                if track_num not in stage_tracks:
+                    continue
+                ## The other copy of a speculatively run genome finished first
+                for genome in list(flying):
+                    if is_cancelled(control_collection, genome):
+                        flying.remove(genome)
+                        cancelled.append(genome)
+                if len(flying) == 0:
+                    break
                 eval_length = 10
                 with open(f"{track}.json") as f:
                     track_info = json.load(f)
                     eval_length += track_info["target_time"]
-                port_num = randint(49152, 65535)
-                print(
-                    f"{args.host} {args.instance} === Starting Server on {port_num}! Track: {track}"
-                )
-                server = subprocess.Popen(
-                    [
-                        "./xpilots",
-                        "-map",
-                        f"{track}.xp",
-                        "-noQuit",
-                        "-maxClientsPerIP",
-                        "500",
-                        "-password",
-                        "test",
-                        "-worldlives",
-                        "999",
-                        "-fps",
-                        f"{fps}",
-                        "-contactPort",
-                        f"{port_num}",
-                    ]
-                )
-                sleep(3)
-                print(f"{args.host} {args.instance} === Starting Bot!")
-                bot = subprocess.Popen(
-                    [
-                        "python3",
-                        "workerclient.py",
-                        "-port",
-                        f"{port_num}",
-                        "-track",
-                        f"{track_num}",
-                        "-dbid",
-                        f"{str(genome['_id'])}",
-                        "-eval_length",
-                        f"{eval_length}",
-                    ]
-                )
-                sleep(0.25)
-                print(f"{args.host} {args.instance} === Waiting for Bot to finish!")
-                bot_return_code = bot.wait()
-                sleep(0.25)
-                print(
-                    f"{args.host} {args.instance} === Bot finished with return code {bot_return_code}!"
-                )
-                server.terminate()
-                sleep(0.25)
-                print(f"{args.host} {args.instance} === Server killed!")
-                if bot_return_code != 0:
-                    raise Exception("Worker Client Error!")
+                port_num = server_pool.get_port(track)
+                return_codes = run_clients(flying, port_num, track_num, eval_length)
+                ## A failed client only takes its own genome out, the rest go on to the next track
+                for genome, bot_return_code in zip(list(flying), return_codes):
+                    if bot_return_code != 0:
+                        flying.remove(genome)
+                        failed.append(genome)
                 print(
                     f"{args.host} {args.instance} === Finished Track {track_num + 1}/{len(tracks)} ==="
                 )
             client = pymongo.MongoClient(db_string)
             db = client.NEAT
             collection = db.genomes
-            collection.update_one(
-                {"_id": genome["_id"]}, {"$set": {"finished_eval": True}}
-            )
-            print(f"{args.host} {args.instance} === Finished Eval Successfully ===")
-            exit(0)
+            for genome in flying:
+                ## Settled by the other copy after the last cancellation check
+                if (
+                    collection.update_one(
+                        results_filter(genome), {"$set": {"finished_eval": True}}
+                    ).matched_count
+                    == 0
+                ):
+                    cancelled.append(genome)
+                    continue
+                if "backup_of" in genome and settle_backup(collection, genome):
+                    print(f"{args.host} {args.instance} === Speculative Win ===")
+                print(
+                    f"{args.host} {args.instance} === Finished Eval Successfully ==="
+                )
+            for genome in cancelled:
+                if "backup_of" in genome:
+                    settle_backup(collection, genome)
+                print(
+                    f"{args.host} {args.instance} === Genome {genome['individual_num']} finished elsewhere or lease lost, cancelled ==="
+                )
+            if len(failed) != 0:
+                raise Exception("Worker Client Error!")
         except Exception as e:
             client = pymongo.MongoClient(db_string)
             db = client.NEAT
             collection = db.genomes
-            genome = collection.find_one({"_id": genome["_id"]})
-            if genome is None:
-                continue
+            ## The worker is going down, let someone else evaluate the rest of the lease
+            release_genomes(collection, pending)
+            pending = []
+            if str(e) != "Worker Client Error!":
+                raise e
             updates: Dict[str, Any] = {
                 "started_eval": True,
                 "finished_eval": False,
                 "failed_eval": True,
                 "just_failed": True,
             }
-            if str(e) != "Worker Client Error!":
-                updates["exception"] = f"{e}"
-                if "error" not in genome:
-                    updates["error"] = f"Runtime Exception: {e}"
-                raise e
-            collection.update_one({"_id": genome["_id"]}, {"$set": updates})
+            ## Only fails a genome if this worker still holds it and it wasn't settled elsewhere
+            for genome in failed:
+                collection.update_one(results_filter(genome), {"$set": updates})
             print(f"{args.host} {args.instance} === Error In Eval: {e}")
             raise e
+    ## Trajectories are normally recorded during evaluation, this only reruns genomes flagged by hand
     elif collection.count_documents({"needs_adv_log": True}) != 0:
         genome = collection.find_one_and_update(
             {"needs_adv_log": True}, {"$set": {"needs_adv_log": False}}
@@ -229,29 +486,7 @@ while True:
             with open(f"{track}.json") as f:
                 track_info = json.load(f)
                 eval_length += track_info["target_time"]
-            port_num = randint(49152, 65535)
-            print(
-                f"{args.host} {args.instance} === Starting Server on {port_num}! Track: {track}"
-            )
-            server = subprocess.Popen(
-                [
-                    "./xpilots",
-                    "-map",
-                    f"{track}.xp",
-                    "-noQuit",
-                    "-maxClientsPerIP",
-                    "500",
-                    "-password",
-                    "test",
-                    "-worldlives",
-                    "999",
-                    "-fps",
-                    f"{fps}",
-                    "-contactPort",
-                    f"{port_num}",
-                ]
-            )
-            sleep(3)
+            port_num = server_pool.get_port(track)
             print(f"{args.host} {args.instance} === Starting Bot!")
             bot = subprocess.Popen(
                 [
@@ -266,6 +501,7 @@ while True:
                     "-eval_length",
                     f"{eval_length}",
                 ]
+                + logger_args
             )
             sleep(0.25)
             print(f"{args.host} {args.instance} === Waiting for Bot to finish!")
@@ -274,9 +510,6 @@ while True:
             print(
                 f"{args.host} {args.instance} === Bot finished with return code {bot_return_code}!"
             )
-            server.terminate()
-            sleep(0.25)
-            print(f"{args.host} {args.instance} === Server killed!")
             if bot_return_code != 0:
                 raise Exception("Worker Client Error!")
             print(
@@ -6,12 +6,36 @@ from typing import List
 parser = argparse.ArgumentParser()
 parser.add_argument("-instances", help="num instances", required=True)
 parser.add_argument("-host", help="host", required=True)
+parser.add_argument("-genomes", help="genomes evaluated together", default="1")
+parser.add_argument("-lease", help="genomes claimed per database round trip", default="4")
+parser.add_argument(
+    "-speculate",
+    help="unfinished genomes left in a generation before idle workers run backups, 0 to disable",
+    default="4",
+)
+parser.add_argument("-fps", help="server frames per second", default="28")
+parser.add_argument("-profile", help="record per frame timing histograms", action="store_true")
+parser.add_argument("-sim", help="evaluate on the headless batch simulator", action="store_true")
 
 args = parser.parse_args()
+worker_args = [
+    "-genomes",
+    args.genomes,
+    "-lease",
+    args.lease,
+    "-speculate",
+    args.speculate,
+    "-fps",
+    args.fps,
+]
+if args.profile:
+    worker_args.append("-profile")
+if args.sim:
+    worker_args.append("-sim")
 
 workers: List[subprocess.Popen] = []
 for i in range(int(args.instances)):
-    workers.append(subprocess.Popen(["python3", "workernode.py", "-instance", str(i), "-host", args.host]))
+    workers.append(subprocess.Popen(["python3", "workernode.py", "-instance", str(i), "-host", args.host] + worker_args))
     sleep(1)
 
 while True:
@@ -20,5 +44,5 @@ while True:
             print(f"Worker {i} died!")
             worker.kill()
             worker.terminate()
-            workers[i] = subprocess.Popen(["python3", "workernode.py", "-instance", str(i), "-host", args.host])
+            workers[i] = subprocess.Popen(["python3", "workernode.py", "-instance", str(i), "-host", args.host] + worker_args)
     sleep(1)
@@ -0,0 +1,451 @@
+"""
+workqueue leases genomes from the Mongo genomes collection to worker nodes in batches
+
+A lease claims up to K unstarted genomes in three round trips however large K is. Each claimed
+document is stamped with the lease id and an expiry, and the started_eval guard on the update
+means two workers racing for the same genomes each only get the ones they won.
+
+Leases only last a few seconds. A LeaseHeartbeat thread on the worker keeps pushing the expiry back
+while it holds genomes, so the manager can requeue anything whose worker stopped renewing right away.
+
+Once the queue is empty and only a few genomes of a generation are left running, idle workers can take a
+backup copy of the oldest one with lease_backup. The copy is its own document so the two evaluations
+never write over each other, whichever finishes first is kept and the other is cancelled between tracks.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import pymongo
+from bson.objectid import ObjectId
+from pymongo.collection import Collection
+
+## Seconds a lease lasts without being renewed
+LEASE_TTL = 10.0
+
+## Fields a backup copy doesn't take over from or hand back to its original
+BACKUP_EXCLUDED = [
+    "_id",
+    "algo",
+    "genome",
+    "backup_of",
+    "backup_id",
+    "backup_hostname",
+    "hostname",
+    "lease_id",
+    "lease_expires",
+    "started_at",
+    "started_eval",
+    "finished_eval",
+]
+
+## Order genomes are handed out in, oldest generation first
+LEASE_SORT = [
+    ("generation", pymongo.ASCENDING),
+    ("individual_num", pymongo.ASCENDING),
+]
+
+
+def ensure_indexes(collection: Collection) -> None:
+    """ensure_indexes Creates the indexes the work queue and manager queries rely on, safe to call every startup
+
+    Args:
+        collection (Collection): The genomes collection
+    """
+    collection.create_index(
+        [("started_eval", pymongo.ASCENDING)] + LEASE_SORT, name="lease_order"
+    )
+    collection.create_index([("lease_id", pymongo.ASCENDING)], name="lease_id")
+    collection.create_index(
+        [
+            ("started_eval", pymongo.ASCENDING),
+            ("finished_eval", pymongo.ASCENDING),
+            ("lease_expires", pymongo.ASCENDING),
+        ],
+        name="lease_expiry",
+    )
+    collection.create_index(
+        [
+            ("trial", pymongo.ASCENDING),
+            ("generation", pymongo.ASCENDING),
+            ("algo", pymongo.ASCENDING),
+            ("finished_eval", pymongo.ASCENDING),
+        ],
+        name="generation_progress",
+    )
+
+
+def get_evaluator_filter(sim: bool) -> Dict[str, Any]:
+    """get_evaluator_filter Matches genomes published for the batch simulator or for real servers, older genomes count as real servers"""
+    if sim:
+        return {"sim": True}
+    return {"sim": {"$ne": True}}
+
+
+def lease_genomes(
+    collection: Collection,
+    hostname: str,
+    count: int,
+    ttl: float = LEASE_TTL,
+    sim: bool = False,
+) -> List[Dict[str, Any]]:
+    """lease_genomes Claims up to count unstarted genomes from the same generation, trial and tracks
+
+    Args:
+        collection (Collection): The genomes collection
+        hostname (str): Worker the genomes are leased to
+        count (int): Most genomes to claim
+        ttl (float, optional): Seconds until the lease expires unless renewed. Defaults to LEASE_TTL.
+        sim (bool, optional): Whether the worker evaluates on the batch simulator, it only gets genomes published for it. Defaults to False.
+
+    Returns:
+        List[Dict[str, Any]]: The claimed genome documents in lease order, empty if there was no work
+    """
+    candidates = list(
+        collection.find(
+            dict(get_evaluator_filter(sim), started_eval=False),
+            projection=[
+                "generation",
+                "trial",
+                "tracks",
+                "stage_tracks",
+                "terminate",
+            ],
+            sort=LEASE_SORT,
+            limit=count,
+        )
+    )
+    if len(candidates) == 0:
+        return []
+    ## Everything in a lease has to be able to fly together on the simulator
+    first = candidates[0]
+    ids = [
+        candidate["_id"]
+        for candidate in candidates
+        if candidate["generation"] == first["generation"]
+        and candidate.get("trial") == first.get("trial")
+        and candidate["tracks"] == first["tracks"]
+        and candidate.get("stage_tracks") == first.get("stage_tracks")
+        and candidate.get("terminate") == first.get("terminate")
+    ]
+    lease_id = uuid4().hex
+    now = datetime.now()
+    collection.update_many(
+        {"_id": {"$in": ids}, "started_eval": False},
+        {
+            "$set": {
+                "started_eval": True,
+                "hostname": hostname,
+                "started_at": now,
+                "lease_id": lease_id,
+                "lease_expires": now + timedelta(seconds=ttl),
+            }
+        },
+    )
+    return list(collection.find({"lease_id": lease_id}, sort=LEASE_SORT))
+
+
+def release_genomes(collection: Collection, genomes: List[Dict[str, Any]]) -> None:
+    """release_genomes Hands leased genomes that were never started back to the queue
+
+    Args:
+        collection (Collection): The genomes collection
+        genomes (List[Dict[str, Any]]): Documents returned by lease_genomes
+    """
+    if len(genomes) == 0:
+        return
+    collection.update_many(
+        {
+            "_id": {"$in": [genome["_id"] for genome in genomes]},
+            "lease_id": genomes[0]["lease_id"],
+        },
+        {
+            "$set": {"started_eval": False, "started_at": None},
+            "$unset": {"hostname": "", "lease_id": "", "lease_expires": ""},
+        },
+    )
+
+
+def requeue_expired(
+    collection: Collection, query: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """requeue_expired Puts genomes whose worker stopped renewing the lease back in the queue
+
+    Args:
+        collection (Collection): The genomes collection
+        query (Optional[Dict[str, Any]], optional): Extra conditions, e.g. the generation and trial. Defaults to None.
+
+    Returns:
+        List[Dict[str, Any]]: The expired genome documents as they were before being requeued
+    """
+    expired_filter = {
+        "started_eval": True,
+        "finished_eval": False,
+        "backup_of": {"$exists": False},
+        ## Genomes claimed before leases existed have no expiry and nobody renewing them
+        "$or": [
+            {"lease_expires": {"$lt": datetime.now()}},
+            {"lease_expires": {"$exists": False}},
+        ],
+    }
+    if query:
+        expired_filter.update(query)
+    expired = list(
+        collection.find(expired_filter, projection=["key", "hostname", "lease_id"])
+    )
+    if len(expired) == 0:
+        return []
+    ## Still guarded on the expiry so a renewal that lands in between wins
+    collection.update_many(
+        dict(expired_filter, _id={"$in": [genome["_id"] for genome in expired]}),
+        {
+            "$set": {"started_eval": False, "started_at": None},
+            "$unset": {"hostname": "", "lease_id": "", "lease_expires": ""},
+        },
+    )
+    return expired
+
+
+class LeaseHeartbeat(threading.Thread):
+
+    def __init__(self, collection: Collection, ttl: float = LEASE_TTL) -> None:
+        """__init__ Renews the leases a worker holds every third of the TTL
+
+        Args:
+            collection (Collection): The genomes collection, from a client the worker doesn't close
+            ttl (float, optional): Seconds a renewal extends the lease by. Defaults to LEASE_TTL.
+        """
+        super(LeaseHeartbeat, self).__init__(daemon=True)
+        self.collection = collection
+        self.ttl = ttl
+        self.held: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.stop_now = threading.Event()
+
+    def hold(self, genomes: List[Dict[str, Any]]) -> None:
+        """hold Sets the genomes to keep renewing, replacing whatever was held before
+
+        Args:
+            genomes (List[Dict[str, Any]]): Documents returned by lease_genomes
+        """
+        with self.lock:
+            self.held = [
+                {"_id": genome["_id"], "lease_id": genome["lease_id"]}
+                for genome in genomes
+            ]
+
+    def renew(
+        self,
+    ) -> None:
+        with self.lock:
+            held = list(self.held)
+        if len(held) == 0:
+            return
+        self.collection.update_many(
+            {
+                "$or": held,
+                "finished_eval": False,
+            },
+            {"$set": {"lease_expires": datetime.now() + timedelta(seconds=self.ttl)}},
+        )
+
+    def run(
+        self,
+    ) -> None:
+        while not self.stop_now.wait(self.ttl / 3.0):
+            try:
+                self.renew()
+            except pymongo.errors.PyMongoError as e:
+                ## Missing a beat is fine, the next one may still land before the lease expires
+                print(f"Lease renewal failed: {e}")
+
+    def stop(
+        self,
+    ) -> None:
+        self.stop_now.set()
+
+
+def lease_backup(
+    collection: Collection,
+    hostname: str,
+    threshold: int,
+    ttl: float = LEASE_TTL,
+    sim: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """lease_backup Leases a backup copy of the longest running genome once a generation is down to its stragglers
+
+    Steady state genomes are never backed up, epochs overlap so there is no generation left to wait on.
+
+    Args:
+        collection (Collection): The genomes collection
+        hostname (str): Worker the copy is leased to
+        threshold (int): Most unfinished genomes left in the generation for a backup to be worth it
+        ttl (float, optional): Seconds until the lease expires unless renewed. Defaults to LEASE_TTL.
+        sim (bool, optional): Whether the worker evaluates on the batch simulator. Defaults to False.
+
+    Returns:
+        Optional[Dict[str, Any]]: The backup document, evaluated like any other genome, or None
+    """
+    now = datetime.now()
+    straggler = collection.find_one(
+        {
+            **get_evaluator_filter(sim),
+            "started_eval": True,
+            "finished_eval": False,
+            "algo": "NEAT",
+            "backup_id": {"$exists": False},
+            "steady_state": {"$ne": True},
+            "hostname": {"$ne": hostname},
+            "lease_expires": {"$gt": now},
+        },
+        projection=["generation", "trial"],
+        sort=[("started_at", pymongo.ASCENDING)],
+    )
+    if straggler is None:
+        return None
+    remaining = collection.count_documents(
+        {
+            "generation": straggler["generation"],
+            "trial": straggler["trial"],
+            "algo": "NEAT",
+            "finished_eval": False,
+        }
+    )
+    if remaining > threshold:
+        return None
+    backup_id = ObjectId()
+    original = collection.find_one_and_update(
+        {
+            "_id": straggler["_id"],
+            "finished_eval": False,
+            "backup_id": {"$exists": False},
+        },
+        {"$set": {"backup_id": backup_id, "backup_hostname": hostname}},
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+    if original is None:
+        return None
+    backup = dict(original)
+    backup.update(
+        {
+            "_id": backup_id,
+            "algo": "NEAT-backup",
+            "backup_of": original["_id"],
+            "hostname": hostname,
+            "started_eval": True,
+            "finished_eval": False,
+            "started_at": now,
+            "lease_id": uuid4().hex,
+            "lease_expires": now + timedelta(seconds=ttl),
+        }
+    )
+    del backup["backup_id"]
+    del backup["backup_hostname"]
+    collection.insert_one(backup)
+    return backup
+
+
+def results_filter(genome: Dict[str, Any]) -> Dict[str, Any]:
+    """results_filter Filter that only matches a leased genome while its lease holder may still write results
+
+    Args:
+        genome (Dict[str, Any]): Document returned by lease_genomes or lease_backup
+
+    Returns:
+        Dict[str, Any]: Matches nothing once the lease was requeued or the genome was settled by its other copy
+    """
+    return {
+        "_id": genome["_id"],
+        "lease_id": genome["lease_id"],
+        "finished_eval": False,
+    }
+
+
+def is_cancelled(collection: Collection, genome: Dict[str, Any]) -> bool:
+    """is_cancelled Whether the other copy of a speculatively run genome already finished
+
+    Args:
+        collection (Collection): The genomes collection
+        genome (Dict[str, Any]): The genome or backup being evaluated
+
+    Returns:
+        bool: True if evaluating it any further is wasted work
+    """
+    if "backup_of" in genome:
+        original = collection.find_one(
+            {"_id": genome["backup_of"]}, projection=["finished_eval"]
+        )
+        return original is None or original["finished_eval"]
+    ## An original only finishes while it is still being evaluated if its backup won
+    return (
+        collection.count_documents(
+            {"_id": genome["_id"], "finished_eval": True}, limit=1
+        )
+        == 1
+    )
+
+
+def settle_backup(collection: Collection, backup: Dict[str, Any]) -> bool:
+    """settle_backup Hands a finished backup's results to its original if the original is still running
+
+    Args:
+        collection (Collection): The genomes collection
+        backup (Dict[str, Any]): The backup document from lease_backup
+
+    Returns:
+        bool: True if the backup finished first
+    """
+    finished = collection.find_one({"_id": backup["_id"]})
+    won = False
+    if finished is not None and finished["finished_eval"]:
+        results = {
+            field: value
+            for field, value in finished.items()
+            if field not in BACKUP_EXCLUDED
+        }
+        results.update(
+            {
+                "started_eval": True,
+                "finished_eval": True,
+                "speculative_win": True,
+                "hostname": finished["hostname"],
+            }
+        )
+        won = (
+            collection.update_one(
+                {"_id": backup["backup_of"], "finished_eval": False},
+                {"$set": results},
+            ).modified_count
+            == 1
+        )
+    collection.delete_one({"_id": backup["_id"]})
+    return won
+
+
+def drop_expired_backups(collection: Collection) -> int:
+    """drop_expired_backups Deletes backups whose worker stopped renewing so the original can be backed up again
+
+    Args:
+        collection (Collection): The genomes collection
+
+    Returns:
+        int: Number of backups dropped
+    """
+    expired = list(
+        collection.find(
+            {
+                "backup_of": {"$exists": True},
+                "lease_expires": {"$lt": datetime.now()},
+            },
+            projection=["backup_of"],
+        )
+    )
+    for backup in expired:
+        collection.update_one(
+            {"_id": backup["backup_of"], "backup_id": backup["_id"]},
+            {"$unset": {"backup_id": "", "backup_hostname": ""}},
+        )
+        collection.delete_one({"_id": backup["_id"]})
+    return len(expired)
@@ -0,0 +1,203 @@
+"""
+xpmap parses XPilot .xp maps into a block grid that can be queried without a server
+"""
+
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+BLOCK_SIZE = 35
+
+## Block types
+EMPTY = 0
+FILLED = 1
+REC_UL = 2  ## Upper left half filled ('s')
+REC_LR = 3  ## Lower right half filled ('q')
+REC_LL = 4  ## Lower left half filled ('w')
+REC_UR = 5  ## Upper right half filled ('a')
+FRICTION = 6
+
+BLOCK_CHARS = {
+    "x": FILLED,
+    "s": REC_UL,
+    "q": REC_LR,
+    "w": REC_LL,
+    "a": REC_UR,
+    "z": FRICTION,
+}
+
+
+class XPMap:
+
+    options: Dict[str, str] = {}
+    width: int = 0
+    height: int = 0
+    grid: np.ndarray = np.zeros((0, 0), dtype=np.int8)
+    base: Tuple[float, float] = (0.0, 0.0)
+    bases: List[Tuple[float, float]] = []
+    checkpoints: Dict[str, Tuple[float, float]] = {}
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.options = {}
+        self.checkpoints = {}
+        self.bases = []
+        rows: List[str] = []
+        with open(path, "r") as f:
+            in_map = False
+            for line in f:
+                line = line.rstrip("\n")
+                if in_map:
+                    if line.strip() == "EndOfMapdata":
+                        in_map = False
+                        continue
+                    rows.append(line)
+                elif line.startswith("mapData:"):
+                    in_map = True
+                elif line.startswith("#") or ":" not in line:
+                    continue
+                else:
+                    key, value = line.split(":", 1)
+                    self.options[key.strip().lower()] = value.strip()
+
+        self.width = int(self.options.get("mapwidth", len(rows[0]) if rows else 0))
+        self.height = int(self.options.get("mapheight", len(rows)))
+        self.friction = self.get_float("friction")
+        self.block_friction = self.get_float("blockfriction")
+        self.gravity = self.get_float("gravity")
+
+        ## Row 0 of the file is the top of the map, so flip it to index by block y
+        self.grid = np.zeros((self.height, self.width), dtype=np.int8)
+        for row_idx, row in enumerate(rows[: self.height]):
+            block_y = self.height - 1 - row_idx
+            for block_x, char in enumerate(row[: self.width]):
+                self.grid[block_y, block_x] = BLOCK_CHARS.get(char, EMPTY)
+                center = (
+                    (block_x + 0.5) * BLOCK_SIZE,
+                    (block_y + 0.5) * BLOCK_SIZE,
+                )
+                if char == "_":
+                    self.bases.append(center)
+                elif char.isupper():
+                    self.checkpoints[char] = center
+        ## Race mode hands out bases nearest the first checkpoint first, so a lone ship starts on bases[0]
+        if "A" in self.checkpoints:
+            first = self.checkpoints["A"]
+            self.bases.sort(
+                key=lambda base: (base[0] - first[0]) ** 2 + (base[1] - first[1]) ** 2
+            )
+        if self.bases:
+            self.base = self.bases[0]
+
+    def get_float(self, option: str, default: float = 0.0) -> float:
+        """get_float Reads a numeric map option
+
+        Args:
+            option (str): Name of the option
+            default (float, optional): Value used when the map does not set it. Defaults to 0.0.
+
+        Returns:
+            float: Value of the option
+        """
+        try:
+            return float(self.options[option])
+        except (KeyError, ValueError):
+            return default
+
+    def block_at(
+        self, x: Union[float, np.ndarray], y: Union[float, np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """block_at Looks up the block type under points, anything off the map is treated as filled
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates in pixels
+            y (Union[float, np.ndarray]): y coordinates in pixels
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The block types and the position of each point inside its block from 0 to 1
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        block_x = np.floor(x / BLOCK_SIZE).astype(int)
+        block_y = np.floor(y / BLOCK_SIZE).astype(int)
+        in_map = (
+            (block_x >= 0)
+            & (block_x < self.width)
+            & (block_y >= 0)
+            & (block_y < self.height)
+        )
+        blocks = np.full(x.shape, FILLED, dtype=np.int8)
+        blocks[in_map] = self.grid[block_y[in_map], block_x[in_map]]
+        u = x / BLOCK_SIZE - block_x
+        v = y / BLOCK_SIZE - block_y
+        return blocks, u, v
+
+    def is_wall(
+        self, x: Union[float, np.ndarray], y: Union[float, np.ndarray]
+    ) -> np.ndarray:
+        """is_wall Checks whether points are inside a wall
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates in pixels
+            y (Union[float, np.ndarray]): y coordinates in pixels
+
+        Returns:
+            np.ndarray: True wherever the point is inside a wall
+        """
+        blocks, u, v = self.block_at(x, y)
+        return (
+            (blocks == FILLED)
+            | ((blocks == REC_UL) & (v >= u))
+            | ((blocks == REC_LR) & (v <= u))
+            | ((blocks == REC_LL) & (u + v <= 1.0))
+            | ((blocks == REC_UR) & (u + v >= 1.0))
+        )
+
+    def is_friction(
+        self, x: Union[float, np.ndarray], y: Union[float, np.ndarray]
+    ) -> np.ndarray:
+        """is_friction Checks whether points are inside a friction block
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates in pixels
+            y (Union[float, np.ndarray]): y coordinates in pixels
+
+        Returns:
+            np.ndarray: True wherever blockfriction applies
+        """
+        return self.block_at(x, y)[0] == FRICTION
+
+    def raycast(
+        self,
+        x: Union[float, np.ndarray],
+        y: Union[float, np.ndarray],
+        angle: Union[float, np.ndarray],
+        max_dist: float,
+        step: float = 2.0,
+    ) -> np.ndarray:
+        """raycast Marches rays out from points until they hit a wall, like ai.wallFeeler
+
+        Args:
+            x (Union[float, np.ndarray]): x coordinates of the ray origins
+            y (Union[float, np.ndarray]): y coordinates of the ray origins
+            angle (Union[float, np.ndarray]): Headings of the rays in degrees
+            max_dist (float): How far to look before giving up
+            step (float, optional): Distance between samples along the ray. Defaults to 2.0.
+
+        Returns:
+            np.ndarray: Distance to the first wall along each ray, max_dist if none was found
+        """
+        x, y, angle = np.broadcast_arrays(
+            np.asarray(x, dtype=float),
+            np.asarray(y, dtype=float),
+            np.asarray(angle, dtype=float),
+        )
+        dists = np.arange(step, max_dist + step, step)
+        dists[-1] = max_dist
+        rads = np.radians(angle)[..., None]
+        hits = self.is_wall(
+            x[..., None] + np.cos(rads) * dists, y[..., None] + np.sin(rads) * dists
+        )
+        any_hit = hits.any(axis=-1)
+        first_hit = dists[hits.argmax(axis=-1)]
+        return np.where(any_hit, first_hit, float(max_dist))
@@ -24,11 +24,31 @@ def get_fitness(completion: float, bonus: float, time: float, avg_speed: float,
         fitness = float(fitness)
     return fitness
 
+def real_power(bases: np.ndarray, exponent: float) -> np.ndarray:
+    ## Python's float pow, np.power rounds differently and gives nan where Python goes complex for negative bases
+    values = bases.ravel().tolist()
+    return np.fromiter(((value ** exponent).real for value in values), dtype=float, count=len(values)).reshape(bases.shape)
+
+
+def get_fitness_matrix(completions: np.ndarray, bonuses: np.ndarray, times: np.ndarray, avg_speeds: np.ndarray, avg_completions_per_frame: np.ndarray, target_times: list, config: dict = default_config) -> np.ndarray:
+    ## Same as get_fitness for every genome and track at once, inputs are (pop, tracks) and so is the result
+    completions = np.asarray(completions, dtype=float)
+    bonuses = np.asarray(bonuses, dtype=float)
+    times = np.asarray(times, dtype=float)
+    target_times = np.asarray(target_times, dtype=float)
+    max_target_time = float(np.max(target_times))
+    time_adj = np.ones_like(target_times)
+    if max_target_time != 0.0:
+        time_adj = max_target_time / target_times
+    completion_bonus = real_power(completions, config['completion_mod'])
+    time_bases = (target_times * time_adj) - (np.minimum(times, target_times - 1.0) * time_adj)
+    time_bonus = np.where(times > 0, real_power(time_bases, config['time_mod']) + 75 ** config['completion_mod'], 0.0)
+    bonuses = np.minimum(bonuses * time_adj, 50.0)
+    return time_bonus + completion_bonus + bonuses
+
+
 def get_many_fitnesses(completions: list, bonuses: list, times: list, avg_speeds: list, avg_completions_per_frame: list, target_times: list, config: dict = default_config) -> list:
-    fitnesses = []
-    for i in range(len(completions)):
-        fitnesses.append(get_fitness(completions[i], bonuses[i], times[i], avg_speeds[i], avg_completions_per_frame[i], target_times[i], np.max(target_times), config))
-    return fitnesses
+    return get_fitness_matrix(np.array([completions]), np.array([bonuses]), np.array([times]), np.array([avg_speeds]), np.array([avg_completions_per_frame]), target_times, config)[0].tolist()
 
 if __name__ == "__main__":
     print(get_fitness(0.0, 0.0, 0.0, 0.0, 60.0, 60.0))
@@ -0,0 +1,306 @@
+"""
+xpsim is a headless stand in for xpilots + libpyAI that steps ship physics as fast as the CPU allows
+
+It exposes the subset of the libpyAI API used by ShellBot, so an unmodified bot can be flown against it:
+
+    import xpsim
+    xpsim.install()
+    from shellracebot import ShellBot
+    results = xpsim.run_episode(net, "circuit1_a", eval_length=75.0)
+"""
+
+import math
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from nncompiler import compile_network
+from trackcompiler import FeelerProvider
+from xpmap import XPMap
+
+## Server defaults, matching the options workernode.py launches xpilots with
+FPS = 28
+SHIP_MASS = 20.0
+SHIP_RADIUS = 14.0
+RESPAWN_FRAMES = 3 * FPS
+HULL_ANGLES = np.radians(np.arange(0, 360, 45))
+
+
+class HeadlessServer:
+
+    ## Ship State
+    x: float = 0.0
+    y: float = 0.0
+    x_vel: float = 0.0
+    y_vel: float = 0.0
+    heading: float = 90.0
+    alive: int = 1
+    dead_frames: int = 0
+
+    ## Controls
+    power: float = 45.0
+    turn_speed: float = 20.0
+    thrusting: bool = False
+    turning_left: bool = False
+    turning_right: bool = False
+    turn_target: Optional[float] = None
+
+    ## Loop Info
+    frame: int = 0
+    running: bool = False
+
+    def __init__(
+        self,
+        mapname: str = "testtrack",
+        fps: int = FPS,
+        ship_mass: float = SHIP_MASS,
+        ship_radius: float = SHIP_RADIUS,
+        feeler_provider: Optional[FeelerProvider] = None,
+    ) -> None:
+        self.map = XPMap(f"{mapname}.xp")
+        self.fps = fps
+        self.ship_mass = ship_mass
+        self.ship_radius = ship_radius
+        self.feeler_provider = feeler_provider
+        self.spawn()
+
+    def raycast(self, angle: float, distance: float) -> float:
+        if self.feeler_provider is not None:
+            return float(self.feeler_provider.feelers(self.x, self.y, angle, distance))
+        return float(self.map.raycast(self.x, self.y, angle, distance))
+
+    def spawn(
+        self,
+    ) -> None:
+        self.x, self.y = self.map.base
+        self.x_vel = 0.0
+        self.y_vel = 0.0
+        self.heading = 90.0
+        self.alive = 1
+        self.dead_frames = 0
+
+    def tick(self, callback: Optional[Callable[[], Any]] = None) -> None:
+        """tick Runs the bot callback for the current frame then advances the world by one frame
+
+        Args:
+            callback (Optional[Callable[[], Any]], optional): The bot's per frame function. Defaults to None.
+        """
+        if callback is not None:
+            callback()
+        self.step()
+        self.frame += 1
+
+    def start(self, callback: Callable[[], Any], args: List[str] = []) -> None:
+        """start Mirrors ai.start, calling back every frame until quit is called"""
+        self.running = True
+        while self.running:
+            self.tick(callback)
+
+    def quit(
+        self,
+    ) -> None:
+        self.running = False
+
+    def step(
+        self,
+    ) -> None:
+        if not self.alive:
+            self.dead_frames += 1
+            if self.dead_frames >= RESPAWN_FRAMES:
+                self.spawn()
+            return
+
+        ## Turning
+        if self.turning_left and not self.turning_right:
+            self.heading += self.turn_speed
+        elif self.turning_right and not self.turning_left:
+            self.heading -= self.turn_speed
+        elif self.turn_target is not None:
+            delta = (self.turn_target - self.heading + 180.0) % 360.0 - 180.0
+            self.heading += max(min(delta, self.turn_speed), -self.turn_speed)
+        self.heading %= 360.0
+
+        ## Forces
+        if self.thrusting:
+            acc = self.power / self.ship_mass
+            heading_rad = math.radians(self.heading)
+            self.x_vel += acc * math.cos(heading_rad)
+            self.y_vel += acc * math.sin(heading_rad)
+        self.y_vel -= self.map.gravity
+        friction = self.map.friction
+        if self.map.block_friction and self.map.is_friction(self.x, self.y):
+            friction += self.map.block_friction
+        self.x_vel *= 1.0 - friction
+        self.y_vel *= 1.0 - friction
+
+        ## Movement and collisions
+        self.x += self.x_vel
+        self.y += self.y_vel
+        if self.map.is_wall(
+            self.x + np.cos(HULL_ANGLES) * self.ship_radius,
+            self.y + np.sin(HULL_ANGLES) * self.ship_radius,
+        ).any():
+            self.alive = 0
+            self.dead_frames = 0
+            self.x_vel = 0.0
+            self.y_vel = 0.0
+
+
+## libpyAI API
+_server: Optional[HeadlessServer] = None
+
+
+def serve(mapname: str, **kwargs) -> HeadlessServer:
+    """serve Loads a map into the module level server used by the libpyAI functions
+
+    Args:
+        mapname (str): Track name without the .xp extension
+
+    Returns:
+        HeadlessServer: The server now backing the API
+    """
+    global _server
+    _server = HeadlessServer(mapname, **kwargs)
+    return _server
+
+
+def install() -> None:
+    """install Registers this module as libpyAI so shellracebot imports it instead of the real client"""
+    sys.modules["libpyAI"] = sys.modules[__name__]
+    if "shellracebot" in sys.modules:
+        sys.modules["shellracebot"].ai = sys.modules[__name__]
+
+
+def headlessMode() -> None:
+    pass
+
+
+def start(callback: Callable[[], Any], args: List[str] = []) -> None:
+    _server.start(callback, args)
+
+
+def quitAI() -> None:
+    if _server is not None:
+        _server.quit()
+
+
+def talk(message: str) -> None:
+    if message.strip() == "/reset all":
+        _server.spawn()
+
+
+def setTurnSpeedDeg(speed: float) -> None:
+    _server.turn_speed = float(speed)
+
+
+def setPowerLevel(power: float) -> None:
+    _server.power = float(power)
+
+
+def thrust(on: int) -> None:
+    _server.thrusting = bool(on)
+
+
+def turnLeft(on: int) -> None:
+    _server.turning_left = bool(on)
+    _server.turn_target = None
+
+
+def turnRight(on: int) -> None:
+    _server.turning_right = bool(on)
+    _server.turn_target = None
+
+
+def turnToDeg(degree: int) -> None:
+    _server.turn_target = float(degree)
+
+
+def selfAlive() -> int:
+    return _server.alive
+
+
+def selfX() -> int:
+    return int(_server.x)
+
+
+def selfY() -> int:
+    return int(_server.y)
+
+
+def selfVelX() -> float:
+    return _server.x_vel
+
+
+def selfVelY() -> float:
+    return _server.y_vel
+
+
+def selfSpeed() -> float:
+    return math.hypot(_server.x_vel, _server.y_vel)
+
+
+def selfHeadingDeg() -> int:
+    return int(_server.heading) % 360
+
+
+def selfTrackingDeg() -> int:
+    if _server.x_vel == 0.0 and _server.y_vel == 0.0:
+        return selfHeadingDeg()
+    return int(math.degrees(math.atan2(_server.y_vel, _server.x_vel)) + 360) % 360
+
+
+def wallFeeler(distance: int, degree: int) -> int:
+    return int(_server.raycast(degree, distance))
+
+
+def run_episode(
+    net, mapname: str, eval_length: float, fps: int = FPS, termination: str = ""
+) -> Dict[str, Any]:
+    """run_episode Flies a ShellBot through one episode on the headless server
+
+    Args:
+        net: Network with an activate method, the same object workerclient.py unpickles
+        mapname (str): Track to fly
+        eval_length (float): Episode length in seconds of game time
+        fps (int, optional): Frames per second of game time. Defaults to FPS.
+        termination (str, optional): Early termination rules for make_termination, empty for none. Defaults to "".
+
+    Returns:
+        Dict[str, Any]: The per track results workerclient.py stores for a genome
+    """
+    install()
+    from shellracebot import ShellBot
+    from termination import make_termination
+
+    server = serve(mapname, fps=fps)
+    sb = ShellBot("Headless", mapname, headless=True)
+    net = compile_network(net)
+    if hasattr(net, "reset"):
+        net.reset()
+    sb.nn = net
+    ## Start parked on the base facing the starting heading, as if /reset all had just finished
+    server.heading = float(sb.starting_heading) % 360.0
+    sb.reset_values()
+    max_frames = int(eval_length * fps)
+    sb.termination = make_termination(termination, max_frames=max_frames)
+    while not sb.done and sb.frame < max_frames:
+        server.tick(sb.run_loop)
+    if not sb.done:
+        sb.cause_of_death = "Time"
+    bonus, completion, _ = sb.get_scores()
+    course_time = -1.0
+    if sb.completed_course:
+        course_time = round(sb.course_frames / float(fps), 3)
+    return {
+        "bonus": bonus,
+        "completion": completion,
+        "time": course_time,
+        "x": sb.x,
+        "y": sb.y,
+        "avg_speed": round(sb.average_speed, 3),
+        "avg_completion_per_frame": round(sb.average_completion_per_frame, 3),
+        "autopsy": sb.cause_of_death,
+        "frame": sb.course_frames,
+        "end_frame": sb.frame,
+    }